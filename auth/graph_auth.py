@@ -3,8 +3,9 @@ Microsoft Graph API OAuth2 authentication module
 Supports both client credentials and delegated authentication flows
 """
 
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime, timedelta
 
 import msal
@@ -31,6 +32,9 @@ class GraphAuthenticator:
         self._access_token: Optional[str] = None
         self._token_expires_at: Optional[datetime] = None
         self._token_cache: Dict[str, Any] = {}
+        
+        # Shared HTTP session so Graph calls reuse pooled keep-alive connections
+        self.session = requests.Session()
     
     async def get_access_token(self) -> str:
         """Get valid access token, refreshing if necessary"""
@@ -130,7 +134,7 @@ class GraphAuthenticator:
             }
             
             # Test with a simple user profile call (works for both auth methods)
-            response = requests.get(
+            response = self.session.get(
                 f"{self.config.graph_api_base_url}/me",
                 headers=headers,
                 timeout=10
@@ -163,6 +167,10 @@ class GraphAuthenticator:
         self._token_cache = {}
         self.logger.info("Token cache cleared")
     
+    def close(self):
+        """Close the shared HTTP session"""
+        self.session.close()
+    
     async def test_permissions(self) -> Dict[str, bool]:
         """Test required permissions for the application"""
         permissions_status = {
@@ -171,41 +179,18 @@ class GraphAuthenticator:
             'user_read': False
         }
         
+        # Endpoint probed for each permission, sent together in one batch request
+        probes = {
+            'mail_send': '/me/mailboxSettings',  # Mail.Send: mail settings are accessible
+            'mail_read': '/me/messages?$top=1',  # Mail.Read: messages are accessible
+            'user_read': '/me'  # User.Read: profile is accessible
+        }
+        
         try:
-            headers = await self.get_authenticated_headers()
+            responses = await self.batch([{'url': url} for url in probes.values()])
             
-            # Test Mail.Send permission by checking if we can access mail settings
-            try:
-                response = requests.get(
-                    f"{self.config.graph_api_base_url}/me/mailboxSettings",
-                    headers=headers,
-                    timeout=10
-                )
-                permissions_status['mail_send'] = response.status_code == 200
-            except Exception:
-                pass
-            
-            # Test Mail.Read permission by checking if we can access messages
-            try:
-                response = requests.get(
-                    f"{self.config.graph_api_base_url}/me/messages?$top=1",
-                    headers=headers,
-                    timeout=10
-                )
-                permissions_status['mail_read'] = response.status_code == 200
-            except Exception:
-                pass
-            
-            # Test User.Read permission
-            try:
-                response = requests.get(
-                    f"{self.config.graph_api_base_url}/me",
-                    headers=headers,
-                    timeout=10
-                )
-                permissions_status['user_read'] = response.status_code == 200
-            except Exception:
-                pass
+            for permission, response in zip(probes, responses):
+                permissions_status[permission] = response.get('status') == 200
             
             self.logger.info(f"Permission test results: {permissions_status}")
             return permissions_status
@@ -213,6 +198,38 @@ class GraphAuthenticator:
         except Exception as e:
             self.logger.error(f"Permission testing failed: {e}")
             return permissions_status
+    
+    async def batch(self, requests_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send up to 20 Graph requests in a single JSON $batch round-trip
+        
+        Each entry needs a 'url' relative to the API version (e.g. '/me') and may set
+        'method', 'headers' and 'body'. Returns the individual responses in request order.
+        """
+        if len(requests_list) > 20:
+            raise ValueError("Microsoft Graph accepts at most 20 requests per batch")
+        
+        payload = {
+            'requests': [
+                {'id': str(index), 'method': 'GET', **request}
+                for index, request in enumerate(requests_list)
+            ]
+        }
+        
+        headers = await self.get_authenticated_headers()
+        
+        # Run the blocking HTTP call in a worker thread so other coroutines keep running
+        response = await asyncio.to_thread(
+            self.session.post,
+            f"{self.config.graph_api_base_url}/$batch",
+            headers=headers,
+            json=payload,
+            timeout=30
+        )
+        response.raise_for_status()
+        
+        # Graph may answer batched requests in any order
+        responses_by_id = {item['id']: item for item in response.json().get('responses', [])}
+        return [responses_by_id.get(str(index), {}) for index in range(len(requests_list))]
 
 
 class GraphAPIClient:
@@ -223,13 +240,14 @@ class GraphAPIClient:
         self.config = authenticator.config
         self.logger = logging.getLogger(__name__)
         self.base_url = self.config.graph_api_base_url
+        self.session = authenticator.session
     
     async def get(self, endpoint: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
         """Make authenticated GET request"""
         headers = await self.authenticator.get_authenticated_headers()
         
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/{endpoint.lstrip('/')}",
                 headers=headers,
                 params=params,
@@ -243,12 +261,21 @@ class GraphAPIClient:
             self.logger.error(f"GET request failed for {endpoint}: {e}")
             raise
     
+    async def batch(self, requests_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send up to 20 GET/POST/PATCH requests as one $batch round-trip"""
+        try:
+            return await self.authenticator.batch(requests_list)
+            
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Batch request of {len(requests_list)} requests failed: {e}")
+            raise
+    
     async def post(self, endpoint: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
         """Make authenticated POST request"""
         headers = await self.authenticator.get_authenticated_headers()
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/{endpoint.lstrip('/')}",
                 headers=headers,
                 json=data,
@@ -272,7 +299,7 @@ class GraphAPIClient:
         headers = await self.authenticator.get_authenticated_headers()
         
         try:
-            response = requests.patch(
+            response = self.session.patch(
                 f"{self.base_url}/{endpoint.lstrip('/')}",
                 headers=headers,
                 json=data,
@@ -102,19 +102,15 @@ async def export_recipients_to_csv(output_file_path: str) -> bool:
         from db.models import RecipientRepository
         recipient_repo = RecipientRepository(app.db_manager)
         
-        # Get all recipients
-        all_recipients = []
-        for status in ['pending', 'active', 'replied', 'stopped']:
-            recipients = await recipient_repo.get_all_by_status(status)
-            all_recipients.extend(recipients)
-        
-        # Write to CSV
+        # Write to CSV as the rows stream in, without holding every recipient in memory
+        exported = 0
         with open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
             fieldnames = ['id', 'first_name', 'company', 'role', 'email', 'status', 'created_at']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             
             writer.writeheader()
-            for recipient in all_recipients:
+            async for recipient in recipient_repo.iter_by_statuses(['pending', 'active', 'replied', 'stopped']):
+                exported += 1
                 writer.writerow({
                     'id': recipient.id,
                     'first_name': recipient.first_name,
@@ -127,7 +123,7 @@ async def export_recipients_to_csv(output_file_path: str) -> bool:
         
         await app.cleanup()
         
-        print(f"✓ Exported {len(all_recipients)} recipients to {output_file_path}")
+        print(f"✓ Exported {exported} recipients to {output_file_path}")
         return True
         
     except Exception as e:
@@ -28,19 +28,31 @@ class Config:
         
         # Database Configuration
         self.database_url = os.getenv("DATABASE_URL", "sqlite:///email_automation.db")
+        self.database_read_pool_size = int(os.getenv("DATABASE_READ_POOL_SIZE", "5"))
         
         # Rate Limiting Configuration
         self.rate_limit_per_minute = int(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
         self.rate_limit_per_day = int(os.getenv("RATE_LIMIT_PER_DAY", "10000"))
+        self.max_concurrent_sends = int(os.getenv("MAX_CONCURRENT_SENDS", "5"))
+        self.rate_limit_redis_url = os.getenv("RATE_LIMIT_REDIS_URL", "")
+        
+        # Per-minute limit accounting: 'token_bucket', 'encoded_sliding', 'fixed_window' or 'exact_sliding'
+        self.rate_limiter_mode = os.getenv("RATE_LIMITER_MODE", "token_bucket")
+        if self.rate_limiter_mode not in ["token_bucket", "encoded_sliding", "fixed_window", "exact_sliding"]:
+            raise ValueError("RATE_LIMITER_MODE must be 'token_bucket', 'encoded_sliding', 'fixed_window' or 'exact_sliding'")
         
         # Email Sequence Configuration
         self.follow_up_1_delay_days = int(os.getenv("FOLLOW_UP_1_DELAY_DAYS", "14"))
         self.follow_up_2_enabled = os.getenv("FOLLOW_UP_2_ENABLED", "true").lower() == "true"
         self.follow_up_2_delay_days = int(os.getenv("FOLLOW_UP_2_DELAY_DAYS", "10"))
+        self.sequence_retention_days = int(os.getenv("SEQUENCE_RETENTION_DAYS", "30"))
         
         # Reply Detection Configuration
         self.reply_check_interval_minutes = int(os.getenv("REPLY_CHECK_INTERVAL_MINUTES", "15"))
         
+        # Monitoring Configuration
+        self.metrics_refresh_interval = int(os.getenv("METRICS_REFRESH_INTERVAL", "15"))
+        
         # Microsoft Graph API Scopes
         if self.auth_method == "client_credentials":
             self.scopes = ["https://graph.microsoft.com/.default"]
@@ -93,6 +105,9 @@ class Config:
             if self.follow_up_1_delay_days <= 0 or self.follow_up_2_delay_days <= 0:
                 return False
             
+            if self.sequence_retention_days <= 0:
+                return False
+            
             return True
             
         except Exception:
@@ -0,0 +1,180 @@
+"""
+Group-commit batching for database writes
+Coalesces concurrent recipient creates and sent-email updates into batched writes with one commit each
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, List, Optional, Set, Tuple
+
+from .models import Recipient, RecipientRepository, EmailSequenceRepository
+
+
+class _GroupCommitBatcher(ABC):
+    """Collects concurrent write requests and flushes them in batches; subclasses do the writes"""
+    
+    def __init__(self, max_batch: int = 64, max_wait: float = 0.01, max_concurrent_flushes: int = 1):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.logger = logging.getLogger(__name__)
+        
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+        
+        # Batch the collector was building when it was stopped, flushed by close()
+        self._unflushed: List[Tuple[Any, asyncio.Future]] = []
+        
+        # Bounds how many batches are written at once; the next batch is still
+        # collected while the current one commits
+        self._flush_slots = asyncio.Semaphore(max_concurrent_flushes)
+    
+    def start(self):
+        """Start the background collector"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def _submit(self, item: Any) -> Any:
+        """Queue a write and wait for its result"""
+        if self._task is None:
+            self.start()
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    async def _run(self):
+        """Collect up to max_batch requests or until max_wait elapses, then flush"""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            try:
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                
+                await self._flush_slots.acquire()
+            except asyncio.CancelledError:
+                self._unflushed = batch
+                raise
+            
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]):
+        """Write a batch and resolve each caller's future with its result"""
+        try:
+            try:
+                results = await self._write_batch([item for item, _ in batch])
+            except Exception as e:
+                # Retry one by one so one bad item doesn't fail the whole batch
+                self.logger.warning(f"Batch write of {len(batch)} items failed, retrying individually: {e}")
+                for item, future in batch:
+                    try:
+                        result = await self._write_one(item)
+                    except Exception as row_error:
+                        if not future.done():
+                            future.set_exception(row_error)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                return
+            
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._flush_slots.release()
+    
+    @abstractmethod
+    async def _write_batch(self, items: List[Any]) -> List[Any]:
+        """Write a batch in one transaction, returning one result per item"""
+    
+    @abstractmethod
+    async def _write_one(self, item: Any) -> Any:
+        """Write a single item"""
+    
+    async def close(self):
+        """Stop collecting, wait for in-flight flushes and flush anything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        
+        pending, self._unflushed = self._unflushed, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        
+        if pending:
+            await self._flush_slots.acquire()
+            await self._flush(pending)
+    
+    async def __aenter__(self):
+        """Async context manager entry"""
+        self.start()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Async context manager exit"""
+        await self.close()
+
+
+class CreateBatcher(_GroupCommitBatcher):
+    """Collects concurrent recipient creates and flushes them with create_many"""
+    
+    def __init__(self, recipient_repo: RecipientRepository, max_batch: int = 64,
+                 max_wait: float = 0.01, max_concurrent_flushes: int = 1):
+        super().__init__(max_batch, max_wait, max_concurrent_flushes)
+        self.recipient_repo = recipient_repo
+    
+    async def submit(self, recipient: Recipient) -> int:
+        """Queue a recipient for creation and wait for its ID"""
+        return await self._submit(recipient)
+    
+    async def _write_batch(self, recipients: List[Recipient]) -> List[int]:
+        """Insert a batch of recipients and return their IDs"""
+        return await self.recipient_repo.create_many(recipients)
+    
+    async def _write_one(self, recipient: Recipient) -> int:
+        """Insert a single recipient"""
+        return await self.recipient_repo.create(recipient)
+
+
+class MarkSentBatcher(_GroupCommitBatcher):
+    """Collects concurrent sent-email updates and flushes them with mark_sent_many"""
+    
+    def __init__(self, sequence_repo: EmailSequenceRepository, max_batch: int = 64,
+                 max_wait: float = 0.01, max_concurrent_flushes: int = 1):
+        super().__init__(max_batch, max_wait, max_concurrent_flushes)
+        self.sequence_repo = sequence_repo
+    
+    async def submit(self, sequence_id: int, message_id: str, sent_at: datetime,
+                     next_step_at: Optional[datetime] = None) -> bool:
+        """Queue a sequence entry to be marked sent and wait for it to be committed"""
+        return await self._submit((sequence_id, message_id, sent_at, next_step_at))
+    
+    async def _write_batch(self, entries: List[Tuple[int, str, datetime, Optional[datetime]]]) -> List[bool]:
+        """Mark a batch of entries sent"""
+        await self.sequence_repo.mark_sent_many(entries)
+        return [True] * len(entries)
+    
+    async def _write_one(self, entry: Tuple[int, str, datetime, Optional[datetime]]) -> bool:
+        """Mark a single entry sent"""
+        return await self.sequence_repo.mark_sent(*entry)
@@ -3,10 +3,11 @@ Database connection management and schema initialization
 Supports SQLite with upgrade path to Azure SQL
 """
 
+import asyncio
 import logging
 import sqlite3
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import aiosqlite
@@ -15,11 +16,20 @@ import aiosqlite
 class DatabaseManager:
     """Manages database connections and schema operations"""
     
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, read_pool_size: int = 5):
         self.database_url = database_url
         self.logger = logging.getLogger(__name__)
         self._connection: Optional[aiosqlite.Connection] = None
         
+        # Every write shares the main connection, where one coroutine's commit or rollback
+        # would end another's transaction; held from the first statement to commit/rollback
+        self._write_lock = asyncio.Lock()
+        
+        # Extra read-only connections for SELECTs; writes stay on the main connection
+        self.read_pool_size = read_pool_size
+        self._read_connections: List[aiosqlite.Connection] = []
+        self._read_pool: Optional[asyncio.Queue] = None
+        
         # Parse database URL to determine type
         parsed = urlparse(database_url)
         self.db_type = parsed.scheme.split('+')[0]  # sqlite, mssql, etc.
@@ -61,6 +71,30 @@ class DatabaseManager:
         
         # Apply any pending migrations
         await self._apply_migrations()
+        
+        # Concurrent readers need a file database in WAL mode (in-memory databases are per-connection)
+        if self.db_path and self.db_path != ':memory:' and self.read_pool_size > 0:
+            await self._initialize_read_pool()
+    
+    async def _initialize_read_pool(self):
+        """Open the pool of read-only connections used by execute_query"""
+        # WAL lets readers run alongside the writer instead of blocking on it
+        # The pragma returns a row; close its cursor so the statement doesn't keep the file locked
+        cursor = await self._connection.execute("PRAGMA journal_mode = WAL")
+        await cursor.close()
+        
+        # In WAL mode NORMAL syncs at checkpoints rather than on every commit; the
+        # database stays consistent, only the last commits can be lost on power failure
+        await self._connection.execute("PRAGMA synchronous = NORMAL")
+        
+        self._read_pool = asyncio.Queue()
+        for _ in range(self.read_pool_size):
+            connection = await aiosqlite.connect(self.db_path)
+            await connection.execute("PRAGMA query_only = ON")
+            self._read_connections.append(connection)
+            self._read_pool.put_nowait(connection)
+        
+        self.logger.info(f"Opened {self.read_pool_size} read connections")
     
     async def _create_schema(self):
         """Create database schema"""
@@ -101,7 +135,6 @@ class DatabaseManager:
         -- Indexes for performance
         CREATE INDEX IF NOT EXISTS idx_recipients_email ON recipients(email);
         CREATE INDEX IF NOT EXISTS idx_recipients_status ON recipients(status);
-        CREATE INDEX IF NOT EXISTS idx_email_sequence_recipient ON email_sequence(recipient_id);
         CREATE INDEX IF NOT EXISTS idx_email_sequence_scheduled ON email_sequence(scheduled_at);
         CREATE INDEX IF NOT EXISTS idx_email_sequence_message_id ON email_sequence(message_id);
         CREATE INDEX IF NOT EXISTS idx_email_sequence_replied ON email_sequence(replied);
@@ -123,6 +156,38 @@ class DatabaseManager:
             1: """
             -- Initial schema version
             INSERT OR IGNORE INTO schema_version (version) VALUES (1);
+            """,
+            2: """
+            -- Key/value store for state that must survive restarts
+            CREATE TABLE IF NOT EXISTS app_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT OR IGNORE INTO schema_version (version) VALUES (2);
+            """,
+            3: """
+            -- Case-insensitive email lookups, also covering the status filter
+            CREATE INDEX IF NOT EXISTS idx_recipients_email_lower_status ON recipients (lower(email), status);
+            INSERT OR IGNORE INTO schema_version (version) VALUES (3);
+            """,
+            4: """
+            -- Unsent entries by reply flag and due time, for the due-email queue
+            CREATE INDEX IF NOT EXISTS idx_email_sequence_due ON email_sequence(replied, scheduled_at)
+            WHERE sent_at IS NULL;
+            INSERT OR IGNORE INTO schema_version (version) VALUES (4);
+            """,
+            5: """
+            -- When a scheduler claimed an entry for sending, so concurrent schedulers don't
+            -- send it twice
+            ALTER TABLE email_sequence ADD COLUMN claimed_at TIMESTAMP NULL;
+            INSERT OR IGNORE INTO schema_version (version) VALUES (5);
+            """,
+            6: """
+            -- Lookups by recipient (and recipient + step) use the UNIQUE(recipient_id, step)
+            -- index; the single-column one only added write cost
+            DROP INDEX IF EXISTS idx_email_sequence_recipient;
+            INSERT OR IGNORE INTO schema_version (version) VALUES (6);
             """
         }
         
@@ -153,26 +218,119 @@ class DatabaseManager:
     
     async def execute_query(self, query: str, params: tuple = None):
         """Execute a query and return results"""
-        connection = await self.get_connection()
-        cursor = await connection.execute(query, params or ())
-        return await cursor.fetchall()
+        if self._read_pool is None:
+            connection = await self.get_connection()
+            cursor = await connection.execute(query, params or ())
+            return await cursor.fetchall()
+        
+        # Borrow a read connection so concurrent SELECTs don't queue behind each other or writes
+        connection = await self._read_pool.get()
+        try:
+            cursor = await connection.execute(query, params or ())
+            return await cursor.fetchall()
+        finally:
+            self._read_pool.put_nowait(connection)
+    
+    async def iter_query(self, query: str, params: tuple = None) -> AsyncIterator[tuple]:
+        """Execute a query and yield rows as the cursor fetches them, without building a result list"""
+        if self._read_pool is None:
+            connection = await self.get_connection()
+            async with connection.execute(query, params or ()) as cursor:
+                async for row in cursor:
+                    yield row
+            return
+        
+        # The read connection stays borrowed until the caller finishes iterating
+        connection = await self._read_pool.get()
+        try:
+            async with connection.execute(query, params or ()) as cursor:
+                async for row in cursor:
+                    yield row
+        finally:
+            self._read_pool.put_nowait(connection)
+    
+    async def get_state(self, key: str) -> Optional[str]:
+        """Get a persisted application state value"""
+        results = await self.execute_query("SELECT value FROM app_state WHERE key = ?", (key,))
+        return results[0][0] if results else None
+    
+    async def set_state(self, key: str, value: str):
+        """Persist an application state value, replacing any previous one"""
+        query = """
+        INSERT INTO app_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+        """
+        await self.execute_update(query, (key, value))
+    
+    def get_pool_stats(self) -> Dict[str, int]:
+        """Get read connection pool usage"""
+        if self._read_pool is None:
+            return {'size': 0, 'free_connections': 0, 'in_use': 0}
+        
+        free = self._read_pool.qsize()
+        return {
+            'size': len(self._read_connections),
+            'free_connections': free,
+            'in_use': len(self._read_connections) - free
+        }
     
     async def execute_insert(self, query: str, params: tuple = None) -> int:
         """Execute insert query and return last row ID"""
         connection = await self.get_connection()
-        cursor = await connection.execute(query, params or ())
-        await connection.commit()
+        async with self._write_lock:
+            try:
+                cursor = await connection.execute(query, params or ())
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
         return cursor.lastrowid
     
     async def execute_update(self, query: str, params: tuple = None) -> int:
         """Execute update/delete query and return affected rows"""
         connection = await self.get_connection()
-        cursor = await connection.execute(query, params or ())
-        await connection.commit()
+        async with self._write_lock:
+            try:
+                cursor = await connection.execute(query, params or ())
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
         return cursor.rowcount
     
+    async def execute_many(self, query: str, params_list: list) -> int:
+        """Execute a query once per parameter set in a single transaction and return affected rows"""
+        connection = await self.get_connection()
+        async with self._write_lock:
+            try:
+                cursor = await connection.executemany(query, params_list)
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
+        return cursor.rowcount
+    
+    async def execute_transaction(self, statements: List[Tuple[str, tuple]]) -> List[aiosqlite.Cursor]:
+        """Execute several statements with one commit and return their cursors (rowcount, lastrowid)"""
+        connection = await self.get_connection()
+        cursors = []
+        async with self._write_lock:
+            try:
+                for query, params in statements:
+                    cursors.append(await connection.execute(query, params or ()))
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
+        return cursors
+    
     async def close(self):
         """Close database connection"""
+        for connection in self._read_connections:
+            await connection.close()
+        self._read_connections = []
+        self._read_pool = None
+        
         if self._connection:
             await self._connection.close()
             self._connection = None
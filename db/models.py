@@ -4,15 +4,47 @@ Provides ORM-like functionality for database operations
 """
 
 import logging
+from functools import lru_cache
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Set, Tuple
 from dataclasses import dataclass
 from email_validator import validate_email, EmailNotValidError
 
 from .database import DatabaseManager
 
+# Stay well under SQLite's bound parameter limit when building IN (...) lists
+MAX_IN_PARAMS = 500
 
-@dataclass
+
+RECIPIENT_STATUSES = frozenset(('pending', 'active', 'replied', 'stopped'))
+
+
+@lru_cache(maxsize=4096)
+def _is_valid_email(email: str) -> bool:
+    """Check email syntax, caching results since CSV imports and retries repeat addresses"""
+    try:
+        # Syntax only; a DNS deliverability lookup would block the event loop
+        validate_email(email, check_deliverability=False)
+        return True
+    except EmailNotValidError:
+        return False
+
+
+def _chunked(items: List[Any], size: int = MAX_IN_PARAMS):
+    """Yield consecutive slices of items of at most size elements"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# SQL condition on email_sequence: every earlier step of the recipient's sequence is sent
+_EARLIER_STEPS_SENT = """NOT EXISTS (
+            SELECT 1 FROM email_sequence AS earlier
+            WHERE earlier.recipient_id = email_sequence.recipient_id
+            AND earlier.step < email_sequence.step AND earlier.sent_at IS NULL
+        )"""
+
+
+@dataclass(slots=True)
 class Recipient:
     """Recipient data model"""
     id: Optional[int] = None
@@ -32,17 +64,15 @@ class Recipient:
                 return False
             
             # Validate email format
-            validate_email(self.email)
+            if not _is_valid_email(self.email):
+                return False
             
             # Validate status
-            valid_statuses = ['pending', 'active', 'replied', 'stopped']
-            if self.status not in valid_statuses:
+            if self.status not in RECIPIENT_STATUSES:
                 return False
             
             return True
             
-        except EmailNotValidError:
-            return False
         except Exception:
             return False
     
@@ -170,6 +200,89 @@ class RecipientRepository:
             self.logger.error(f"Failed to create recipient: {e}")
             raise
     
+    async def create_with_sequence(self, recipient: Recipient,
+                                   sequences: List[EmailSequence]) -> Optional[Tuple[int, List[int]]]:
+        """Create a recipient and their email sequence entries in one transaction, returning all IDs,
+        or None if a recipient with that email (ignoring case) already exists"""
+        if not recipient.validate():
+            raise ValueError("Invalid recipient data")
+        
+        # The existence check is part of the insert, so concurrent adds can't both pass it
+        statements = [(
+            """
+            INSERT INTO recipients (first_name, company, role, email, status)
+            SELECT ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM recipients WHERE lower(email) = lower(?))
+            ON CONFLICT DO NOTHING
+            """,
+            (recipient.first_name, recipient.company, recipient.role, recipient.email, recipient.status,
+             recipient.email)
+        )]
+        
+        # The entries' recipient_id is ignored; they belong to the recipient inserted above.
+        # changes() > 0 chains each insert to the previous one, so nothing is inserted
+        # when the recipient already existed
+        for sequence in sequences:
+            statements.append((
+                """
+                INSERT INTO email_sequence (recipient_id, step, scheduled_at)
+                SELECT id, ?, ? FROM recipients WHERE email = ? AND changes() > 0
+                """,
+                (sequence.step, sequence.scheduled_at, recipient.email)
+            ))
+        
+        try:
+            cursors = await self.db_manager.execute_transaction(statements)
+        except Exception as e:
+            self.logger.error(f"Failed to create recipient {recipient.email} with sequence: {e}")
+            raise
+        
+        if cursors[0].rowcount == 0:
+            return None
+        
+        recipient_id = cursors[0].lastrowid
+        self.logger.info(f"Created recipient {recipient_id} with {len(sequences)} email sequences")
+        return recipient_id, [cursor.lastrowid for cursor in cursors[1:]]
+    
+    async def create_many(self, recipients: List[Recipient]) -> List[int]:
+        """Create several recipients in one transaction and return their IDs in input order"""
+        if not recipients:
+            return []
+        
+        for recipient in recipients:
+            if not recipient.validate():
+                raise ValueError(f"Invalid recipient data: {recipient.email}")
+        
+        query = """
+        INSERT INTO recipients (first_name, company, role, email, status)
+        VALUES (?, ?, ?, ?, ?)
+        """
+        params_list = [
+            (r.first_name, r.company, r.role, r.email, r.status)
+            for r in recipients
+        ]
+        
+        try:
+            await self.db_manager.execute_many(query, params_list)
+        except Exception as e:
+            self.logger.error(f"Failed to create {len(recipients)} recipients: {e}")
+            raise
+        
+        # Look the new IDs up by email (unique), staying under SQLite's bound parameter limit
+        emails = [r.email for r in recipients]
+        ids_by_email = {}
+        for chunk in _chunked(emails):
+            placeholders = ", ".join("?" for _ in chunk)
+            results = await self.db_manager.execute_query(
+                f"SELECT id, email FROM recipients WHERE email IN ({placeholders})",
+                tuple(chunk)
+            )
+            for row in results:
+                ids_by_email[row[1]] = row[0]
+        
+        self.logger.info(f"Created {len(recipients)} recipients")
+        return [ids_by_email[email] for email in emails]
+    
     async def get_by_id(self, recipient_id: int) -> Optional[Recipient]:
         """Get recipient by ID"""
         query = "SELECT * FROM recipients WHERE id = ?"
@@ -190,8 +303,8 @@ class RecipientRepository:
         return None
     
     async def get_by_email(self, email: str) -> Optional[Recipient]:
-        """Get recipient by email"""
-        query = "SELECT * FROM recipients WHERE email = ?"
+        """Get recipient by email, ignoring case"""
+        query = "SELECT * FROM recipients WHERE lower(email) = lower(?)"
         results = await self.db_manager.execute_query(query, (email,))
         
         if results:
@@ -228,6 +341,71 @@ class RecipientRepository:
         
         return success
     
+    async def get_by_ids(self, recipient_ids: List[int]) -> List[Recipient]:
+        """Get recipients by ID in as few queries as possible (missing IDs are skipped)"""
+        recipients = []
+        for chunk in _chunked(recipient_ids):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"SELECT * FROM recipients WHERE id IN ({placeholders})"
+            results = await self.db_manager.execute_query(query, tuple(chunk))
+            
+            for row in results:
+                recipients.append(Recipient(
+                    id=row[0],
+                    first_name=row[1],
+                    company=row[2],
+                    role=row[3],
+                    email=row[4],
+                    status=row[5],
+                    created_at=row[6],
+                    updated_at=row[7]
+                ))
+        
+        return recipients
+    
+    async def get_by_emails(self, emails: List[str]) -> Dict[str, Recipient]:
+        """Get recipients by email in as few queries as possible, ignoring case and keyed by lower-cased email"""
+        recipients = {}
+        for chunk in _chunked(list({email.lower() for email in emails})):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"SELECT * FROM recipients WHERE lower(email) IN ({placeholders})"
+            results = await self.db_manager.execute_query(query, tuple(chunk))
+            
+            for row in results:
+                recipients[row[4].lower()] = Recipient(
+                    id=row[0],
+                    first_name=row[1],
+                    company=row[2],
+                    role=row[3],
+                    email=row[4],
+                    status=row[5],
+                    created_at=row[6],
+                    updated_at=row[7]
+                )
+        
+        return recipients
+    
+    async def update_status_bulk(self, recipient_ids: List[int], status: str) -> int:
+        """Update the status of many recipients, returning the number of rows updated"""
+        valid_statuses = ['pending', 'active', 'replied', 'stopped']
+        if status not in valid_statuses:
+            raise ValueError(f"Invalid status: {status}")
+        
+        affected_rows = 0
+        for chunk in _chunked(recipient_ids):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"""
+            UPDATE recipients 
+            SET status = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE id IN ({placeholders})
+            """
+            affected_rows += await self.db_manager.execute_update(query, (status, *chunk))
+        
+        if affected_rows > 0:
+            self.logger.info(f"Updated {affected_rows} recipients to status {status}")
+        
+        return affected_rows
+    
     async def get_all_by_status(self, status: str) -> List[Recipient]:
         """Get all recipients by status"""
         query = "SELECT * FROM recipients WHERE status = ? ORDER BY created_at"
@@ -247,6 +425,101 @@ class RecipientRepository:
             ))
         
         return recipients
+    
+    async def get_all_by_statuses(self, statuses: List[str]) -> List[Recipient]:
+        """Get all recipients with any of the given statuses in a single query"""
+        placeholders = ", ".join("?" for _ in statuses)
+        query = f"SELECT * FROM recipients WHERE status IN ({placeholders}) ORDER BY created_at"
+        results = await self.db_manager.execute_query(query, tuple(statuses))
+        
+        return [
+            Recipient(
+                id=row[0],
+                first_name=row[1],
+                company=row[2],
+                role=row[3],
+                email=row[4],
+                status=row[5],
+                created_at=row[6],
+                updated_at=row[7]
+            )
+            for row in results
+        ]
+    
+    async def iter_by_status(self, status: str) -> AsyncIterator[Recipient]:
+        """Iterate recipients by status, streaming rows instead of loading them all"""
+        query = "SELECT * FROM recipients WHERE status = ? ORDER BY created_at"
+        
+        async for row in self.db_manager.iter_query(query, (status,)):
+            yield Recipient(
+                id=row[0],
+                first_name=row[1],
+                company=row[2],
+                role=row[3],
+                email=row[4],
+                status=row[5],
+                created_at=row[6],
+                updated_at=row[7]
+            )
+    
+    async def iter_by_statuses(self, statuses: List[str]) -> AsyncIterator[Recipient]:
+        """Iterate recipients with any of the given statuses, streaming rows instead of loading them all"""
+        placeholders = ", ".join("?" for _ in statuses)
+        query = f"SELECT * FROM recipients WHERE status IN ({placeholders}) ORDER BY created_at"
+        
+        async for row in self.db_manager.iter_query(query, tuple(statuses)):
+            yield Recipient(
+                id=row[0],
+                first_name=row[1],
+                company=row[2],
+                role=row[3],
+                email=row[4],
+                status=row[5],
+                created_at=row[6],
+                updated_at=row[7]
+            )
+    
+    async def distinct_field_by_status(self, field: str, status: str) -> List[str]:
+        """Get the distinct values of a recipient field (company or role) for a status"""
+        if field not in ('company', 'role'):
+            raise ValueError(f"Invalid field: {field}")
+        
+        query = f"SELECT DISTINCT {field} FROM recipients WHERE status = ?"
+        results = await self.db_manager.execute_query(query, (status,))
+        return [row[0] for row in results]
+    
+    async def list_active_emails(self) -> Set[str]:
+        """Get the lower-cased emails of all active and pending recipients"""
+        query = "SELECT email FROM recipients WHERE status IN ('active', 'pending')"
+        results = await self.db_manager.execute_query(query)
+        return {row[0].lower() for row in results}
+    
+    async def get_active_email_id_pairs(self) -> List[Tuple[str, int]]:
+        """Get (lower-cased email, ID) pairs for all active recipients"""
+        query = "SELECT lower(email), id FROM recipients WHERE status = 'active'"
+        return await self.db_manager.execute_query(query)
+    
+    async def count_by_status(self, status: str) -> int:
+        """Count recipients with the given status"""
+        query = "SELECT COUNT(*) FROM recipients WHERE status = ?"
+        results = await self.db_manager.execute_query(query, (status,))
+        return results[0][0] if results else 0
+    
+    async def count_by_statuses(self, statuses: List[str]) -> Dict[str, int]:
+        """Count recipients for each of the given statuses in a single query"""
+        placeholders = ", ".join("?" for _ in statuses)
+        query = f"""
+        SELECT status, COUNT(*) FROM recipients
+        WHERE status IN ({placeholders})
+        GROUP BY status
+        """
+        results = await self.db_manager.execute_query(query, tuple(statuses))
+        
+        counts = {status: 0 for status in statuses}
+        for row in results:
+            counts[row[0]] = row[1]
+        
+        return counts
 
 
 class EmailSequenceRepository:
@@ -280,18 +553,221 @@ class EmailSequenceRepository:
             self.logger.error(f"Failed to create email sequence: {e}")
             raise
     
-    async def get_due_emails(self, current_time: datetime = None) -> List[EmailSequence]:
-        """Get emails that are due to be sent"""
+    async def create_many(self, sequences: List[EmailSequence]) -> List[int]:
+        """Create several email sequence entries in one transaction and return their IDs in input order"""
+        if not sequences:
+            return []
+        
+        for sequence in sequences:
+            if not sequence.validate():
+                raise ValueError("Invalid email sequence data")
+        
+        query = """
+        INSERT INTO email_sequence (recipient_id, step, scheduled_at)
+        VALUES (?, ?, ?)
+        """
+        params_list = [(s.recipient_id, s.step, s.scheduled_at) for s in sequences]
+        
+        try:
+            await self.db_manager.execute_many(query, params_list)
+        except Exception as e:
+            self.logger.error(f"Failed to create {len(sequences)} email sequences: {e}")
+            raise
+        
+        # Look the new IDs up by (recipient_id, step), which is unique
+        recipient_ids = list({s.recipient_id for s in sequences})
+        ids_by_key = {}
+        for chunk in _chunked(recipient_ids):
+            placeholders = ", ".join("?" for _ in chunk)
+            results = await self.db_manager.execute_query(
+                f"SELECT id, recipient_id, step FROM email_sequence WHERE recipient_id IN ({placeholders})",
+                tuple(chunk)
+            )
+            for row in results:
+                ids_by_key[(row[1], row[2])] = row[0]
+        
+        self.logger.info(f"Created {len(sequences)} email sequences")
+        return [ids_by_key[(s.recipient_id, s.step)] for s in sequences]
+    
+    async def create_many_and_activate(self, sequences: List[EmailSequence]) -> List[int]:
+        """Create email sequence entries and mark their recipients active in one transaction,
+        returning the entry IDs in input order"""
+        if not sequences:
+            return []
+        
+        for sequence in sequences:
+            if not sequence.validate():
+                raise ValueError("Invalid email sequence data")
+        
+        statements = [
+            (
+                "INSERT INTO email_sequence (recipient_id, step, scheduled_at) VALUES (?, ?, ?)",
+                (s.recipient_id, s.step, s.scheduled_at)
+            )
+            for s in sequences
+        ]
+        
+        recipient_ids = list(dict.fromkeys(s.recipient_id for s in sequences))
+        for chunk in _chunked(recipient_ids):
+            placeholders = ", ".join("?" for _ in chunk)
+            statements.append((
+                f"UPDATE recipients SET status = 'active', updated_at = CURRENT_TIMESTAMP WHERE id IN ({placeholders}) AND status != 'active'",
+                tuple(chunk)
+            ))
+        
+        try:
+            cursors = await self.db_manager.execute_transaction(statements)
+        except Exception as e:
+            self.logger.error(f"Failed to create {len(sequences)} email sequences: {e}")
+            raise
+        
+        self.logger.info(f"Created {len(sequences)} email sequences for {len(recipient_ids)} recipients")
+        return [cursor.lastrowid for cursor in cursors[:len(sequences)]]
+    
+    async def get_by_id(self, sequence_id: int) -> Optional[EmailSequence]:
+        """Get email sequence by ID"""
+        query = "SELECT * FROM email_sequence WHERE id = ?"
+        results = await self.db_manager.execute_query(query, (sequence_id,))
+        
+        if results:
+            row = results[0]
+            return EmailSequence(
+                id=row[0],
+                recipient_id=row[1],
+                step=row[2],
+                scheduled_at=row[3],
+                sent_at=row[4],
+                message_id=row[5],
+                replied=bool(row[6]),
+                created_at=row[7],
+                updated_at=row[8]
+            )
+        return None
+    
+    async def get_ready_by_id(self, sequence_id: int) -> Optional[Tuple[EmailSequence, Recipient]]:
+        """Get email sequence by ID with its recipient, unless an earlier step of its sequence is still unsent"""
+        query = f"""
+        SELECT email_sequence.*, recipients.* FROM email_sequence
+        JOIN recipients ON recipients.id = email_sequence.recipient_id
+        WHERE email_sequence.id = ? AND {_EARLIER_STEPS_SENT}
+        """
+        results = await self.db_manager.execute_query(query, (sequence_id,))
+        
+        if results:
+            row = results[0]
+            sequence = EmailSequence(
+                id=row[0],
+                recipient_id=row[1],
+                step=row[2],
+                scheduled_at=row[3],
+                sent_at=row[4],
+                message_id=row[5],
+                replied=bool(row[6]),
+                created_at=row[7],
+                updated_at=row[8]
+            )
+            recipient = Recipient(
+                id=row[9],
+                first_name=row[10],
+                company=row[11],
+                role=row[12],
+                email=row[13],
+                status=row[14],
+                created_at=row[15],
+                updated_at=row[16]
+            )
+            return sequence, recipient
+        return None
+    
+    async def get_unsent_by_recipient(self, recipient_id: int) -> List[EmailSequence]:
+        """Get a recipient's unsent email sequence entries"""
+        query = "SELECT * FROM email_sequence WHERE recipient_id = ? AND sent_at IS NULL ORDER BY step"
+        results = await self.db_manager.execute_query(query, (recipient_id,))
+        
+        return [
+            EmailSequence(
+                id=row[0],
+                recipient_id=row[1],
+                step=row[2],
+                scheduled_at=row[3],
+                sent_at=row[4],
+                message_id=row[5],
+                replied=bool(row[6]),
+                created_at=row[7],
+                updated_at=row[8]
+            )
+            for row in results
+        ]
+    
+    async def get_by_recipient(self, recipient_id: int) -> List[EmailSequence]:
+        """Get a recipient's email sequence entries ordered by step"""
+        sequences = await self.get_by_recipient_ids([recipient_id])
+        return sequences[recipient_id]
+    
+    async def get_by_recipient_ids(self, recipient_ids: List[int]) -> Dict[int, List[EmailSequence]]:
+        """Get the email sequence entries of several recipients, grouped by recipient ID and ordered by step"""
+        sequences_by_recipient: Dict[int, List[EmailSequence]] = {recipient_id: [] for recipient_id in recipient_ids}
+        
+        for chunk in _chunked(list(set(recipient_ids))):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"""
+            SELECT * FROM email_sequence
+            WHERE recipient_id IN ({placeholders})
+            ORDER BY recipient_id, step
+            """
+            results = await self.db_manager.execute_query(query, tuple(chunk))
+            
+            for row in results:
+                sequences_by_recipient[row[1]].append(EmailSequence(
+                    id=row[0],
+                    recipient_id=row[1],
+                    step=row[2],
+                    scheduled_at=row[3],
+                    sent_at=row[4],
+                    message_id=row[5],
+                    replied=bool(row[6]),
+                    created_at=row[7],
+                    updated_at=row[8]
+                ))
+        
+        return sequences_by_recipient
+    
+    async def exists_for_recipient(self, recipient_id: int) -> bool:
+        """Check whether a recipient has any email sequence entries"""
+        query = "SELECT EXISTS(SELECT 1 FROM email_sequence WHERE recipient_id = ?)"
+        results = await self.db_manager.execute_query(query, (recipient_id,))
+        return bool(results[0][0])
+    
+    async def get_enrolled_recipient_ids(self, recipient_ids: List[int]) -> Set[int]:
+        """Get which of the given recipients already have email sequence entries"""
+        enrolled = set()
+        for chunk in _chunked(list(set(recipient_ids))):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"SELECT DISTINCT recipient_id FROM email_sequence WHERE recipient_id IN ({placeholders})"
+            results = await self.db_manager.execute_query(query, tuple(chunk))
+            enrolled.update(row[0] for row in results)
+        
+        return enrolled
+    
+    async def get_due_emails(self, current_time: datetime = None, limit: Optional[int] = None) -> List[EmailSequence]:
+        """Get emails that are due to be sent, oldest first and at most limit of them when given"""
         if current_time is None:
             current_time = datetime.now()
         
-        query = """
-        SELECT * FROM email_sequence 
-        WHERE scheduled_at <= ? AND sent_at IS NULL AND replied = FALSE
-        ORDER BY scheduled_at
+        # Paused or replied recipients' entries are skipped at send time, so they'd only
+        # take a send slot (and the rate limit budget) from ones that can go out
+        query = f"""
+        SELECT email_sequence.* FROM email_sequence
+        JOIN recipients ON recipients.id = email_sequence.recipient_id
+        WHERE email_sequence.scheduled_at <= ? AND email_sequence.sent_at IS NULL
+        AND email_sequence.replied = FALSE AND recipients.status NOT IN ('replied', 'stopped')
+        AND {_EARLIER_STEPS_SENT}
+        ORDER BY email_sequence.scheduled_at
+        LIMIT ?
         """
         
-        results = await self.db_manager.execute_query(query, (current_time,))
+        # SQLite treats a negative LIMIT as no limit
+        results = await self.db_manager.execute_query(query, (current_time, limit if limit is not None else -1))
         
         sequences = []
         for row in results:
@@ -309,27 +785,126 @@ class EmailSequenceRepository:
         
         return sequences
     
-    async def mark_sent(self, sequence_id: int, message_id: str, sent_at: datetime = None) -> bool:
-        """Mark email as sent"""
-        if sent_at is None:
-            sent_at = datetime.now()
+    async def count_due_emails(self, current_time: datetime = None) -> int:
+        """Count emails that are due to be sent, leaving out paused or replied recipients like get_due_emails"""
+        if current_time is None:
+            current_time = datetime.now()
+        
+        query = f"""
+        SELECT COUNT(*) FROM email_sequence
+        JOIN recipients ON recipients.id = email_sequence.recipient_id
+        WHERE email_sequence.scheduled_at <= ? AND email_sequence.sent_at IS NULL
+        AND email_sequence.replied = FALSE AND recipients.status NOT IN ('replied', 'stopped')
+        AND {_EARLIER_STEPS_SENT}
+        """
+        results = await self.db_manager.execute_query(query, (current_time,))
+        return results[0][0] if results else 0
+    
+    async def get_step_counts(self, recipient_statuses: List[str]) -> Dict[int, Dict[str, int]]:
+        """Count sent, replied and pending entries per step for recipients with the given statuses"""
+        placeholders = ", ".join("?" for _ in recipient_statuses)
+        query = f"""
+        SELECT s.step,
+               SUM(CASE WHEN s.sent_at IS NOT NULL THEN 1 ELSE 0 END),
+               SUM(CASE WHEN s.sent_at IS NULL AND s.replied THEN 1 ELSE 0 END),
+               SUM(CASE WHEN s.sent_at IS NULL AND NOT s.replied THEN 1 ELSE 0 END)
+        FROM email_sequence s
+        JOIN recipients r ON r.id = s.recipient_id
+        WHERE r.status IN ({placeholders})
+        GROUP BY s.step
+        """
+        results = await self.db_manager.execute_query(query, tuple(recipient_statuses))
         
+        return {
+            row[0]: {'sent': row[1], 'replied': row[2], 'pending': row[3]}
+            for row in results
+        }
+    
+    async def claim(self, sequence_id: int, stale_before: datetime) -> bool:
+        """Claim an unsent email for sending unless it was claimed since stale_before"""
         query = """
-        UPDATE email_sequence 
-        SET sent_at = ?, message_id = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
+        UPDATE email_sequence SET claimed_at = ?
+        WHERE id = ? AND sent_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)
         """
         
-        affected_rows = await self.db_manager.execute_update(
-            query, (sent_at, message_id, sequence_id)
+        affected_rows = await self.db_manager.execute_update(query, (datetime.now(), sequence_id, stale_before))
+        return affected_rows > 0
+    
+    async def release_claim(self, sequence_id: int) -> bool:
+        """Release the claim on an email that wasn't sent, so it can be retried right away"""
+        query = "UPDATE email_sequence SET claimed_at = NULL WHERE id = ? AND sent_at IS NULL"
+        affected_rows = await self.db_manager.execute_update(query, (sequence_id,))
+        return affected_rows > 0
+    
+    def _mark_sent_statements(self, sequence_id: int, message_id: str, sent_at: datetime,
+                              next_step_at: Optional[datetime] = None) -> List[Tuple[str, tuple]]:
+        """Statements marking an email sent and, with next_step_at, pushing the next step back to it"""
+        statements = [(
+            """
+            UPDATE email_sequence 
+            SET sent_at = ?, message_id = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (sent_at, message_id, sequence_id)
+        )]
+        
+        # The next step was planned from enrollment; keep its delay after the actual send
+        if next_step_at is not None:
+            statements.append((
+                """
+                UPDATE email_sequence 
+                SET scheduled_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE sent_at IS NULL AND scheduled_at < ?
+                AND (recipient_id, step) = (SELECT recipient_id, step + 1 FROM email_sequence WHERE id = ?)
+                """,
+                (next_step_at, next_step_at, sequence_id)
+            ))
+        
+        return statements
+    
+    async def mark_sent(self, sequence_id: int, message_id: str, sent_at: datetime = None,
+                        next_step_at: Optional[datetime] = None) -> bool:
+        """Mark email as sent, rescheduling the next step in the same transaction"""
+        if sent_at is None:
+            sent_at = datetime.now()
+        
+        cursors = await self.db_manager.execute_transaction(
+            self._mark_sent_statements(sequence_id, message_id, sent_at, next_step_at)
         )
-        success = affected_rows > 0
+        success = cursors[0].rowcount > 0
         
         if success:
-            self.logger.info(f"Marked email sequence {sequence_id} as sent with message ID {message_id}")
+            self.logger.info("Marked email sequence %s as sent with message ID %s", sequence_id, message_id)
         
         return success
     
+    async def mark_sent_many(self, entries: List[Tuple[int, str, datetime, Optional[datetime]]]) -> int:
+        """Mark several emails as sent from (sequence_id, message_id, sent_at, next_step_at) in one transaction"""
+        if not entries:
+            return 0
+        
+        statements = []
+        mark_indexes = []
+        for entry in entries:
+            mark_indexes.append(len(statements))
+            statements.extend(self._mark_sent_statements(*entry))
+        
+        cursors = await self.db_manager.execute_transaction(statements)
+        affected_rows = sum(cursors[i].rowcount for i in mark_indexes)
+        self.logger.info("Marked %d email sequences as sent", affected_rows)
+        return affected_rows
+    
+    async def update_scheduled_at(self, sequence_id: int, scheduled_at: datetime) -> bool:
+        """Reschedule an unsent email"""
+        query = """
+        UPDATE email_sequence 
+        SET scheduled_at = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND sent_at IS NULL
+        """
+        
+        affected_rows = await self.db_manager.execute_update(query, (scheduled_at, sequence_id))
+        return affected_rows > 0
+    
     async def mark_replied(self, recipient_id: int) -> bool:
         """Mark all future emails for recipient as replied"""
         query = """
@@ -365,16 +940,143 @@ class EmailSequenceRepository:
             )
         return None
     
-    async def cancel_future_emails(self, recipient_id: int) -> int:
-        """Cancel all unsent emails for a recipient"""
+    async def get_by_message_ids(self, message_ids: List[str]) -> Dict[str, EmailSequence]:
+        """Get email sequences by message ID in as few queries as possible, keyed by message ID"""
+        sequences = {}
+        for chunk in _chunked(list(set(message_ids))):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"SELECT * FROM email_sequence WHERE message_id IN ({placeholders})"
+            results = await self.db_manager.execute_query(query, tuple(chunk))
+            
+            for row in results:
+                sequences.setdefault(row[5], EmailSequence(
+                    id=row[0],
+                    recipient_id=row[1],
+                    step=row[2],
+                    scheduled_at=row[3],
+                    sent_at=row[4],
+                    message_id=row[5],
+                    replied=bool(row[6]),
+                    created_at=row[7],
+                    updated_at=row[8]
+                ))
+        
+        return sequences
+    
+    async def resolve_reply_context(self, in_reply_to: Optional[str],
+                                    from_email: Optional[str]) -> Tuple[Optional[int], Optional[Recipient], Optional[Recipient]]:
+        """Resolve a reply in one query: (sequence ID, its recipient) for in_reply_to and the sender's recipient"""
+        if not in_reply_to and not from_email:
+            return None, None, None
+        
+        query = """
+        SELECT 'sequence', s.id, r.* FROM email_sequence s
+        JOIN recipients r ON r.id = s.recipient_id
+        WHERE s.message_id = ?
+        UNION ALL
+        SELECT 'sender', NULL, r.* FROM recipients r
+        WHERE lower(r.email) = ?
+        """
+        sender_email = from_email.lower() if from_email else None
+        results = await self.db_manager.execute_query(query, (in_reply_to, sender_email))
+        
+        sequence_id, sequence_recipient, sender = None, None, None
+        for row in results:
+            recipient = Recipient(
+                id=row[2],
+                first_name=row[3],
+                company=row[4],
+                role=row[5],
+                email=row[6],
+                status=row[7],
+                created_at=row[8],
+                updated_at=row[9]
+            )
+            if row[0] == 'sequence':
+                if sequence_recipient is None:
+                    sequence_id, sequence_recipient = row[1], recipient
+            else:
+                sender = recipient
+        
+        return sequence_id, sequence_recipient, sender
+    
+    async def create_missing_next_steps(self, step: int, delay: timedelta) -> int:
+        """Create the next step, delay after this one is sent (or scheduled), where an active recipient is missing it"""
+        # Not 'stopped': a cancelled sequence is stopped with its unsent steps deleted,
+        # which looks the same as a paused one missing them
+        query = """
+        INSERT INTO email_sequence (recipient_id, step, scheduled_at)
+        SELECT s.recipient_id, s.step + 1, datetime(COALESCE(s.sent_at, s.scheduled_at), ?)
+        FROM email_sequence AS s
+        JOIN recipients AS r ON r.id = s.recipient_id
+        WHERE s.step = ? AND r.status = 'active'
+        AND NOT EXISTS (
+            SELECT 1 FROM email_sequence AS next
+            WHERE next.recipient_id = s.recipient_id AND next.step = s.step + 1
+        )
+        """
+        
+        affected_rows = await self.db_manager.execute_update(query, (f"+{int(delay.total_seconds())} seconds", step))
+        
+        if affected_rows > 0:
+            self.logger.info(f"Created {affected_rows} missing step {step + 1} emails")
+        
+        return affected_rows
+    
+    async def delete_finished_before(self, cutoff: datetime) -> int:
+        """Delete sent emails older than cutoff for recipients with nothing left to send"""
+        query = """
+        DELETE FROM email_sequence 
+        WHERE sent_at IS NOT NULL AND sent_at < ?
+        AND NOT EXISTS (
+            SELECT 1 FROM email_sequence AS pending
+            WHERE pending.recipient_id = email_sequence.recipient_id AND pending.sent_at IS NULL
+        )
+        """
+        
+        affected_rows = await self.db_manager.execute_update(query, (cutoff,))
+        
+        if affected_rows > 0:
+            self.logger.info(f"Deleted {affected_rows} sent emails older than {cutoff}")
+        
+        return affected_rows
+    
+    async def cancel_future_emails(self, recipient_id: int, recipient_status: Optional[str] = None) -> int:
+        """Cancel all unsent emails for a recipient, setting their status in the same transaction if given"""
         query = """
         DELETE FROM email_sequence 
         WHERE recipient_id = ? AND sent_at IS NULL
         """
         
-        affected_rows = await self.db_manager.execute_update(query, (recipient_id,))
+        if recipient_status is None:
+            affected_rows = await self.db_manager.execute_update(query, (recipient_id,))
+        else:
+            cursors = await self.db_manager.execute_transaction([
+                (query, (recipient_id,)),
+                (
+                    "UPDATE recipients SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (recipient_status, recipient_id)
+                )
+            ])
+            affected_rows = cursors[0].rowcount
         
         if affected_rows > 0:
             self.logger.info(f"Cancelled {affected_rows} future emails for recipient {recipient_id}")
         
+        return affected_rows
+    
+    async def cancel_future_emails_bulk(self, recipient_ids: List[int]) -> int:
+        """Cancel all unsent emails for many recipients, returning the total cancelled"""
+        affected_rows = 0
+        for chunk in _chunked(recipient_ids):
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"""
+            DELETE FROM email_sequence 
+            WHERE recipient_id IN ({placeholders}) AND sent_at IS NULL
+            """
+            affected_rows += await self.db_manager.execute_update(query, tuple(chunk))
+        
+        if affected_rows > 0:
+            self.logger.info(f"Cancelled {affected_rows} future emails for {len(recipient_ids)} recipients")
+        
         return affected_rows
\ No newline at end of file
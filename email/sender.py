@@ -21,6 +21,10 @@ class EmailSender:
         self.graph_client = graph_client
         self.template_engine = EmailTemplateEngine()
         self.logger = logging.getLogger(__name__)
+        
+        # Per-send values that only depend on config, built once
+        self._send_endpoint = f"users/{config.sender_email}/sendMail"
+        self._sender_address = config.sender_email
     
     async def send_email(self, recipient: Recipient, step: int, custom_variables: Dict[str, Any] = None) -> Dict[str, Any]:
         """Send personalized email to recipient"""
@@ -50,7 +54,7 @@ class EmailSender:
                 'subject': email_content['subject']
             }
             
-            self.logger.info(f"Successfully sent email step {step} to {recipient.email} (Message ID: {message_id})")
+            self.logger.info("Successfully sent email step %s to %s (Message ID: %s)", step, recipient.email, message_id)
             return result
             
         except Exception as e:
@@ -81,7 +85,7 @@ class EmailSender:
                 ],
                 "from": {
                     "emailAddress": {
-                        "address": self.config.sender_email,
+                        "address": self._sender_address,
                         "name": "[Your Name]"  # TODO: Make this configurable
                     }
                 },
@@ -98,8 +102,7 @@ class EmailSender:
         """Send email via Microsoft Graph API"""
         try:
             # Use the sendMail endpoint
-            endpoint = f"users/{self.config.sender_email}/sendMail"
-            response = await self.graph_client.post(endpoint, message_payload)
+            response = await self.graph_client.post(self._send_endpoint, message_payload)
             
             return response
             
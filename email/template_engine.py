@@ -44,35 +44,43 @@ class EmailTemplateEngine:
             3: "Final follow-up - {{ company }}"
         }
         
+        # Compiled templates, kept so rendering doesn't recompile or re-check the loader
+        self._compiled_templates: Dict[int, Template] = {}
+        self._compiled_subjects: Dict[int, Template] = {
+            step: Template(source) for step, source in self.subject_templates.items()
+        }
+        
         self.logger.info(f"Email template engine initialized with templates from {self.templates_dir}")
     
     def render_email(self, step: int, recipient: Recipient, custom_variables: Dict[str, Any] = None) -> Dict[str, str]:
         """Render email template for specific step and recipient"""
+        context = self._prepare_context(recipient, custom_variables)
+        return self.render_email_ctx(step, context)
+    
+    def render_email_ctx(self, step: int, context: Dict[str, Any]) -> Dict[str, str]:
+        """Render email template for a step from a prepared context (first_name, company, role, email, ...)"""
         try:
             # Validate step
             if step not in self.template_files:
                 raise ValueError(f"Invalid email step: {step}. Must be 1, 2, or 3")
             
-            # Prepare template context
-            context = self._prepare_context(recipient, custom_variables)
-            
             # Render HTML content
             html_content = self._render_template(step, context)
             
             # Render subject line
             subject = self._render_subject(step, context)
             
-            self.logger.info(f"Successfully rendered email step {step} for {recipient.email}")
+            self.logger.info("Successfully rendered email step %s for %s", step, context['email'])
             
             return {
                 'subject': subject,
                 'html_content': html_content,
-                'recipient_email': recipient.email,
-                'recipient_name': recipient.first_name
+                'recipient_email': context['email'],
+                'recipient_name': context['first_name']
             }
             
         except Exception as e:
-            self.logger.error(f"Failed to render email step {step} for {recipient.email}: {e}")
+            self.logger.error(f"Failed to render email step {step} for {context.get('email')}: {e}")
             raise
     
     def _prepare_context(self, recipient: Recipient, custom_variables: Dict[str, Any] = None) -> Dict[str, Any]:
@@ -90,12 +98,18 @@ class EmailTemplateEngine:
         
         return context
     
+    def _get_template(self, step: int) -> Template:
+        """Get the compiled HTML template for a step, loading it on first use"""
+        template = self._compiled_templates.get(step)
+        if template is None:
+            template = self.env.get_template(self.template_files[step])
+            self._compiled_templates[step] = template
+        return template
+    
     def _render_template(self, step: int, context: Dict[str, Any]) -> str:
         """Render HTML template for given step"""
         try:
-            template_file = self.template_files[step]
-            template = self.env.get_template(template_file)
-            return template.render(**context)
+            return self._get_template(step).render(context)
             
         except TemplateError as e:
             self.logger.error(f"Template rendering error for step {step}: {e}")
@@ -107,9 +121,7 @@ class EmailTemplateEngine:
     def _render_subject(self, step: int, context: Dict[str, Any]) -> str:
         """Render subject line for given step"""
         try:
-            subject_template = self.subject_templates[step]
-            template = Template(subject_template)
-            return template.render(**context)
+            return self._compiled_subjects[step].render(context)
             
         except TemplateError as e:
             self.logger.error(f"Subject rendering error for step {step}: {e}")
@@ -38,7 +38,7 @@ async def example_basic_setup():
         # Check database
         from db.models import RecipientRepository
         recipient_repo = RecipientRepository(app.db_manager)
-        active_count = len(await recipient_repo.get_all_by_status('active'))
+        active_count = await recipient_repo.count_by_status('active')
         print(f"✓ Database: {active_count} active recipients")
         
         await app.cleanup()
@@ -208,10 +208,7 @@ async def example_system_status():
         from db.models import RecipientRepository
         recipient_repo = RecipientRepository(app.db_manager)
         
-        stats = {}
-        for status in ['pending', 'active', 'replied', 'stopped']:
-            recipients = await recipient_repo.get_all_by_status(status)
-            stats[status] = len(recipients)
+        stats = await recipient_repo.count_by_statuses(['pending', 'active', 'replied', 'stopped'])
         
         print(f"\nRecipient Statistics:")
         for status, count in stats.items():
@@ -4,6 +4,7 @@ Tests complete workflows and component integration
 """
 
 import asyncio
+import json
 import logging
 import sys
 from datetime import datetime, timedelta
@@ -35,6 +36,7 @@ class IntegrationTester:
             ("Rate Limiting", self.test_rate_limiting),
             ("Scheduler Integration", self.test_scheduler),
             ("Reply Detection", self.test_reply_detection),
+            ("Health Check Serialization", self.test_health_check_serialization),
             ("End-to-End Workflow", self.test_end_to_end)
         ]
         
@@ -289,6 +291,33 @@ class IntegrationTester:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    async def test_health_check_serialization(self) -> Dict[str, Any]:
+        """Test that a full health check result serializes to JSON"""
+        try:
+            config = Config()
+            from monitoring import HealthMonitor, _dump_json
+            
+            monitor = HealthMonitor(config)
+            await monitor.initialize()
+            
+            # The email system check reports template validation keyed by step number
+            health_status = await monitor.run_comprehensive_health_check()
+            
+            await monitor.cleanup()
+            
+            serialized = json.loads(_dump_json(health_status))
+            
+            return {
+                'success': serialized['overall_status'] == health_status['overall_status'],
+                'details': {
+                    'overall_status': serialized['overall_status'],
+                    'checks_serialized': len(serialized['checks'])
+                }
+            }
+            
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
     async def test_end_to_end(self) -> Dict[str, Any]:
         """Test complete end-to-end workflow"""
         try:
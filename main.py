@@ -21,6 +21,11 @@ from auth.validator import AuthenticationValidator
 from email.sender import EmailSender
 from replies.reply_matcher import ReplyMatcher, SequenceStopper
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 def setup_logging(log_level: str = "INFO"):
     """Configure structured logging for the application"""
@@ -57,7 +62,7 @@ class EmailAutomationApp:
         """Initialize all application components"""
         try:
             # Initialize database
-            self.db_manager = DatabaseManager(self.config.database_url)
+            self.db_manager = DatabaseManager(self.config.database_url, self.config.database_read_pool_size)
             await self.db_manager.initialize()
             self.logger.info("Database initialized successfully")
             
@@ -85,7 +90,7 @@ class EmailAutomationApp:
             sequence_repo = EmailSequenceRepository(self.db_manager)
             
             self.reply_matcher = ReplyMatcher(sequence_repo, recipient_repo)
-            self.sequence_stopper = SequenceStopper(sequence_repo, recipient_repo)
+            self.sequence_stopper = SequenceStopper(sequence_repo, recipient_repo, self.reply_matcher.message_id_cache)
             
             self.logger.info("Reply tracking initialized")
             
@@ -100,6 +105,9 @@ class EmailAutomationApp:
             self.scheduler.start()
             self.logger.info("Email sequence scheduler started")
             
+            # Keep the reply matcher's active sender set fresh
+            self.reply_matcher.start_active_email_refresh()
+            
             # Start reply tracking
             reply_task = asyncio.create_task(self.reply_tracker.start_monitoring())
             self.logger.info("Reply tracking started")
@@ -125,10 +133,18 @@ class EmailAutomationApp:
         try:
             if self.scheduler:
                 self.scheduler.shutdown()
+                await self.scheduler.close_sent_batcher()
+                await self.scheduler.rate_limiter.close()
+            
+            if self.reply_matcher:
+                await self.reply_matcher.stop_active_email_refresh()
             
             if self.db_manager:
                 await self.db_manager.close()
             
+            if self.authenticator:
+                self.authenticator.close()
+            
             self.logger.info("Application cleanup completed")
             
         except Exception as e:
@@ -240,9 +256,7 @@ async def cmd_status(args):
         from db.models import RecipientRepository
         recipient_repo = RecipientRepository(app.db_manager)
         
-        active_recipients = await recipient_repo.get_all_by_status('active')
-        replied_recipients = await recipient_repo.get_all_by_status('replied')
-        stopped_recipients = await recipient_repo.get_all_by_status('stopped')
+        recipient_counts = await recipient_repo.count_by_statuses(['active', 'replied', 'stopped'])
         
         print("\n" + "="*50)
         print("EMAIL AUTOMATION SYSTEM STATUS")
@@ -259,13 +273,13 @@ async def cmd_status(args):
         print(f"  Known recipients: {reply_status.get('known_recipients_count', 0)}")
         
         print(f"\nRecipients:")
-        print(f"  Active: {len(active_recipients)}")
-        print(f"  Replied: {len(replied_recipients)}")
-        print(f"  Stopped: {len(stopped_recipients)}")
+        print(f"  Active: {recipient_counts['active']}")
+        print(f"  Replied: {recipient_counts['replied']}")
+        print(f"  Stopped: {recipient_counts['stopped']}")
         
-        total = len(active_recipients) + len(replied_recipients) + len(stopped_recipients)
+        total = sum(recipient_counts.values())
         if total > 0:
-            reply_rate = (len(replied_recipients) / total) * 100
+            reply_rate = (recipient_counts['replied'] / total) * 100
             print(f"  Reply rate: {reply_rate:.1f}%")
         
         print("="*50 + "\n")
@@ -359,4 +373,12 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop cuts per-task overhead for the scheduler's sends when it's installed
+    if uvloop is not None and sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
+    else:
+        # asyncio.Runner is 3.11+; on 3.10 uvloop is installed as the loop policy instead
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.run(main())
\ No newline at end of file
@@ -6,14 +6,47 @@ Provides comprehensive monitoring, metrics, and alerting capabilities
 import asyncio
 import logging
 import json
+import os
 import time
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 from enum import Enum
 
 from config import Config
-from main import EmailAutomationApp
+
+if TYPE_CHECKING:
+    from main import EmailAutomationApp
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(obj: Any) -> Any:
+    """Serialize values the JSON encoder can't handle natively"""
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _dump_json(data: Any, indent: bool = False) -> bytes:
+    """Serialize data to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        # Non-str keys (e.g. the template step numbers in the email system check) are
+        # written as strings, like the json module does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, default=_json_default, option=option)
+    return json.dumps(data, indent=2 if indent else None, default=_json_default).encode()
 
 
 class HealthStatus(Enum):
@@ -24,6 +57,15 @@ class HealthStatus(Enum):
     CRITICAL = "critical"
 
 
+# Severity of each status, used to pick the worst one when combining checks
+_SEVERITY = {
+    HealthStatus.HEALTHY: 0,
+    HealthStatus.DEGRADED: 1,
+    HealthStatus.UNHEALTHY: 2,
+    HealthStatus.CRITICAL: 3
+}
+
+
 @dataclass
 class HealthCheck:
     """Individual health check result"""
@@ -39,6 +81,17 @@ class HealthCheck:
             self.timestamp = datetime.now()
         if self.details is None:
             self.details = {}
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a JSON-ready dictionary without the deep copy done by asdict"""
+        return {
+            'name': self.name,
+            'status': self.status.value,
+            'message': self.message,
+            'details': self.details,
+            'timestamp': self.timestamp.isoformat(),
+            'response_time_ms': self.response_time_ms
+        }
 
 
 @dataclass
@@ -63,24 +116,97 @@ class HealthMonitor:
     def __init__(self, config: Config):
         self.config = config
         self.logger = logging.getLogger(__name__)
-        self.app: Optional[EmailAutomationApp] = None
+        self.app: Optional['EmailAutomationApp'] = None
+        self._recipient_repo = None
+        self._sequence_repo = None
+        self._template_engine = None
+        self._metrics_task: Optional[asyncio.Task] = None
         self.last_metrics: Optional[SystemMetrics] = None
-        self.health_history: List[HealthCheck] = []
         self.max_history_size = 1000
+        self.health_history: deque = deque(maxlen=self.max_history_size)
+        
+        # The same history grouped by check name, oldest first
+        self._history_by_name: Dict[str, deque] = defaultdict(deque)
+        
+        # Short-lived cache of the last comprehensive health check (monotonic timestamp, result)
+        self._cache: Optional[Tuple[float, Dict[str, Any]]] = None
+        
+        # Health check run currently in progress, shared by concurrent callers
+        self._inflight: Optional[asyncio.Future] = None
+        
+        # SQLite database file path, parsed once from the connection string
+        self._sqlite_path: Optional[str] = None
+        if config.database_url.startswith('sqlite'):
+            self._sqlite_path = config.database_url.replace('sqlite:///', '')
+        
+        # Connection string with credentials hidden, reported by the database check
+        if '@' in config.database_url:
+            self._safe_conn_str = config.database_url.split('@', 1)[0] + '@***'
+        else:
+            self._safe_conn_str = config.database_url
+        
+        # Prime psutil CPU counters so later cpu_percent(interval=None) calls return
+        # usage since the previous call instead of sleeping to take a sample. The health
+        # check and the metrics loop each get their own Process, since every call resets
+        # the baseline for the next one
+        self._process = None
+        self._metrics_process = None
+        if psutil is not None:
+            psutil.cpu_percent(interval=None)
+            self._process = psutil.Process()
+            self._process.cpu_percent(interval=None)
+            self._metrics_process = psutil.Process()
+            self._metrics_process.cpu_percent(interval=None)
     
     async def initialize(self):
         """Initialize monitoring system"""
         try:
+            # Imported here so loading this module doesn't pull in the whole application
+            from main import EmailAutomationApp
+            
             self.app = EmailAutomationApp(self.config)
             await self.app.initialize()
+            
+            # Built once and reused by every health check and metrics collection
+            from db.models import RecipientRepository, EmailSequenceRepository
+            from email.template_engine import EmailTemplateEngine
+            self._recipient_repo = RecipientRepository(self.app.db_manager)
+            self._sequence_repo = EmailSequenceRepository(self.app.db_manager)
+            self._template_engine = EmailTemplateEngine()
+            
             self.logger.info("Health monitor initialized")
         except Exception as e:
             self.logger.error(f"Failed to initialize health monitor: {e}")
             raise
     
+    async def get_cached_health(self, ttl: float = 3.0) -> Dict[str, Any]:
+        """Return the last health check result if younger than ttl seconds, otherwise run a new one"""
+        if self._cache is not None:
+            cached_at, cached_result = self._cache
+            if time.monotonic() - cached_at < ttl:
+                return cached_result
+        
+        result = await self.run_comprehensive_health_check()
+        self._cache = (time.monotonic(), result)
+        return result
+    
     async def run_comprehensive_health_check(self) -> Dict[str, Any]:
+        """Run all health checks, sharing a single in-flight run between concurrent callers"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._run_health_checks())
+            self._inflight.add_done_callback(self._clear_inflight)
+        
+        # Shield so a cancelled caller doesn't cancel the run other callers are waiting on
+        return await asyncio.shield(self._inflight)
+    
+    def _clear_inflight(self, future: asyncio.Future):
+        """Forget the finished in-flight run so the next caller starts a new one"""
+        if self._inflight is future:
+            self._inflight = None
+    
+    async def _run_health_checks(self) -> Dict[str, Any]:
         """Run all health checks and return comprehensive status"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         health_checks = [
             ("Database", self._check_database_health),
@@ -93,13 +219,16 @@ class HealthMonitor:
         ]
         
         results = []
-        overall_status = HealthStatus.HEALTHY
+        
+        # Summary aggregates, accumulated as the checks run
+        status_counts: Dict[str, int] = defaultdict(int)
+        total_response_time = 0.0
         
         for check_name, check_func in health_checks:
             try:
-                check_start = time.time()
+                check_start = time.perf_counter()
                 check_result = await check_func()
-                check_time = (time.time() - check_start) * 1000
+                check_time = (time.perf_counter() - check_start) * 1000
                 
                 health_check = HealthCheck(
                     name=check_name,
@@ -111,14 +240,8 @@ class HealthMonitor:
                 
                 results.append(health_check)
                 self._update_health_history(health_check)
-                
-                # Update overall status
-                if check_result['status'] == HealthStatus.CRITICAL:
-                    overall_status = HealthStatus.CRITICAL
-                elif check_result['status'] == HealthStatus.UNHEALTHY and overall_status != HealthStatus.CRITICAL:
-                    overall_status = HealthStatus.UNHEALTHY
-                elif check_result['status'] == HealthStatus.DEGRADED and overall_status == HealthStatus.HEALTHY:
-                    overall_status = HealthStatus.DEGRADED
+                status_counts[health_check.status.value] += 1
+                total_response_time += check_time
                 
             except Exception as e:
                 error_check = HealthCheck(
@@ -128,38 +251,34 @@ class HealthMonitor:
                     details={'error': str(e)}
                 )
                 results.append(error_check)
-                overall_status = HealthStatus.CRITICAL
+                status_counts[HealthStatus.CRITICAL.value] += 1
+        
+        total_time = (time.perf_counter() - start_time) * 1000
         
-        total_time = (time.time() - start_time) * 1000
+        # Overall status is the most severe status reported by any check
+        overall_status = max((check.status for check in results), key=_SEVERITY.get, default=HealthStatus.HEALTHY)
         
         return {
             'overall_status': overall_status.value,
             'timestamp': datetime.now().isoformat(),
             'total_check_time_ms': total_time,
-            'checks': [asdict(check) for check in results],
-            'summary': self._generate_health_summary(results)
+            'checks': [check.to_dict() for check in results],
+            'summary': self._generate_health_summary(len(results), status_counts, total_response_time)
         }
     
     async def _check_database_health(self) -> Dict[str, Any]:
         """Check database connectivity and performance"""
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
             
-            # Test basic connectivity
-            from db.models import RecipientRepository
-            recipient_repo = RecipientRepository(self.app.db_manager)
-            
-            # Test query performance
-            active_recipients = await recipient_repo.get_all_by_status('active')
-            query_time = (time.time() - start_time) * 1000
+            # Test basic connectivity and query performance
+            active_count = await self._recipient_repo.count_by_status('active')
+            query_time = (time.perf_counter() - start_time) * 1000
             
             # Check database size (for SQLite)
             db_size = 0
-            if self.config.database_url.startswith('sqlite'):
-                import os
-                db_file = self.config.database_url.replace('sqlite:///', '')
-                if os.path.exists(db_file):
-                    db_size = os.path.getsize(db_file) / (1024 * 1024)  # MB
+            if self._sqlite_path and os.path.exists(self._sqlite_path):
+                db_size = os.path.getsize(self._sqlite_path) / (1024 * 1024)  # MB
             
             status = HealthStatus.HEALTHY
             message = "Database is healthy"
@@ -176,9 +295,9 @@ class HealthMonitor:
                 'message': message,
                 'details': {
                     'query_time_ms': query_time,
-                    'active_recipients': len(active_recipients),
+                    'active_recipients': active_count,
                     'database_size_mb': db_size,
-                    'connection_string': self.config.database_url.split('@')[0] + '@***'  # Hide credentials
+                    'connection_string': self._safe_conn_str
                 }
             }
             
@@ -192,11 +311,11 @@ class HealthMonitor:
     async def _check_authentication_health(self) -> Dict[str, Any]:
         """Check authentication system health"""
         try:
-            # Test token validation
-            token_valid = await self.app.authenticator.validate_token()
-            
-            # Test permissions
-            permissions = await self.app.authenticator.test_permissions()
+            # Test permissions and token validation concurrently
+            permissions, token_valid = await asyncio.gather(
+                self.app.authenticator.test_permissions(),
+                self.app.authenticator.validate_token()
+            )
             
             required_permissions = ['mail_send', 'mail_read']
             missing_permissions = [p for p in required_permissions if not permissions.get(p, False)]
@@ -232,10 +351,7 @@ class HealthMonitor:
         """Check email system health"""
         try:
             # Validate email templates
-            from email.template_engine import EmailTemplateEngine
-            template_engine = EmailTemplateEngine()
-            
-            template_validation = template_engine.validate_all_templates()
+            template_validation = self._template_engine.validate_all_templates()
             invalid_templates = [step for step, valid in template_validation.items() if not valid]
             
             # Check sender email validation
@@ -397,20 +513,33 @@ class HealthMonitor:
                 'details': {'error': str(e)}
             }
     
+    def _sample_system_resources(self) -> Tuple[float, Any, Any, float, float]:
+        """Take all psutil readings used by the system resources check in one go"""
+        # Non-blocking CPU samples report usage since the previous call
+        cpu_percent = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        
+        # Process-specific metrics
+        process_memory = self._process.memory_info().rss / (1024 * 1024)  # MB
+        process_cpu = self._process.cpu_percent(interval=None)
+        
+        return cpu_percent, memory, disk, process_memory, process_cpu
+    
     async def _check_system_resources(self) -> Dict[str, Any]:
         """Check system resource usage"""
+        if psutil is None:
+            return {
+                'status': HealthStatus.HEALTHY,
+                'message': "System resource monitoring not available (psutil not installed)",
+                'details': {'psutil_available': False}
+            }
+        
         try:
-            import psutil
-            
-            # Get system metrics
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
-            
-            # Get process-specific metrics
-            process = psutil.Process()
-            process_memory = process.memory_info().rss / (1024 * 1024)  # MB
-            process_cpu = process.cpu_percent()
+            # Sample in a worker thread so the psutil syscalls don't block the event loop
+            cpu_percent, memory, disk, process_memory, process_cpu = await asyncio.to_thread(
+                self._sample_system_resources
+            )
             
             details = {
                 'system_cpu_percent': cpu_percent,
@@ -441,12 +570,6 @@ class HealthMonitor:
                 'details': details
             }
             
-        except ImportError:
-            return {
-                'status': HealthStatus.HEALTHY,
-                'message': "System resource monitoring not available (psutil not installed)",
-                'details': {'psutil_available': False}
-            }
         except Exception as e:
             return {
                 'status': HealthStatus.DEGRADED,
@@ -455,28 +578,23 @@ class HealthMonitor:
             }
     
     def _update_health_history(self, health_check: HealthCheck):
-        """Update health check history"""
-        self.health_history.append(health_check)
+        """Update health check history (oldest entries are evicted once the deque is full)"""
+        if len(self.health_history) == self.max_history_size:
+            # The evicted entry is also the oldest entry recorded under its name
+            evicted = self.health_history[0]
+            self._history_by_name[evicted.name].popleft()
         
-        # Trim history if too large
-        if len(self.health_history) > self.max_history_size:
-            self.health_history = self.health_history[-self.max_history_size:]
+        self.health_history.append(health_check)
+        self._history_by_name[health_check.name].append(health_check)
     
-    def _generate_health_summary(self, checks: List[HealthCheck]) -> Dict[str, Any]:
-        """Generate summary of health checks"""
-        status_counts = {}
-        total_response_time = 0
-        
-        for check in checks:
-            status = check.status.value
-            status_counts[status] = status_counts.get(status, 0) + 1
-            total_response_time += check.response_time_ms
-        
-        avg_response_time = total_response_time / len(checks) if checks else 0
+    def _generate_health_summary(self, total_checks: int, status_counts: Dict[str, int],
+                                 total_response_time: float) -> Dict[str, Any]:
+        """Generate summary of health checks from counts aggregated while they ran"""
+        avg_response_time = total_response_time / total_checks if total_checks else 0
         
         return {
-            'total_checks': len(checks),
-            'status_breakdown': status_counts,
+            'total_checks': total_checks,
+            'status_breakdown': dict(status_counts),
             'average_response_time_ms': avg_response_time,
             'checks_passed': status_counts.get('healthy', 0),
             'checks_failed': status_counts.get('critical', 0) + status_counts.get('unhealthy', 0)
@@ -485,21 +603,15 @@ class HealthMonitor:
     async def collect_metrics(self) -> SystemMetrics:
         """Collect comprehensive system metrics"""
         try:
-            from db.models import RecipientRepository, EmailSequenceRepository
-            
-            recipient_repo = RecipientRepository(self.app.db_manager)
-            sequence_repo = EmailSequenceRepository(self.app.db_manager)
-            
-            # Get recipient counts
-            active_recipients = await recipient_repo.get_all_by_status('active')
-            replied_recipients = await recipient_repo.get_all_by_status('replied')
-            
-            # Get pending emails
-            due_emails = await sequence_repo.get_due_emails()
+            # Get recipient counts and pending emails concurrently
+            counts, pending_emails = await asyncio.gather(
+                self._recipient_repo.count_by_statuses(['active', 'replied']),
+                self._sequence_repo.count_due_emails()
+            )
             
             # Calculate reply rate
-            total_contacted = len(active_recipients) + len(replied_recipients)
-            reply_rate = (len(replied_recipients) / total_contacted * 100) if total_contacted > 0 else 0
+            total_contacted = counts['active'] + counts['replied']
+            reply_rate = (counts['replied'] / total_contacted * 100) if total_contacted > 0 else 0
             
             # Get rate limiting info
             rate_status = self.app.scheduler.rate_limiter.get_adaptive_status()
@@ -507,20 +619,17 @@ class HealthMonitor:
             # Get system resources (if available)
             memory_usage = 0
             cpu_usage = 0
-            try:
-                import psutil
-                process = psutil.Process()
-                memory_usage = process.memory_info().rss / (1024 * 1024)  # MB
-                cpu_usage = process.cpu_percent()
-            except ImportError:
-                pass
+            if self._metrics_process is not None:
+                memory_usage = self._metrics_process.memory_info().rss / (1024 * 1024)  # MB
+                cpu_usage = self._metrics_process.cpu_percent(interval=None)
             
             metrics = SystemMetrics(
                 timestamp=datetime.now(),
-                active_recipients=len(active_recipients),
-                pending_emails=len(due_emails),
+                active_recipients=counts['active'],
+                pending_emails=pending_emails,
                 reply_rate_percent=reply_rate,
                 emails_sent_last_day=rate_status.get('current_daily_count', 0),
+                database_connections=self.app.db_manager.get_pool_stats()['in_use'] + 1,
                 memory_usage_mb=memory_usage,
                 cpu_usage_percent=cpu_usage
             )
@@ -532,55 +641,89 @@ class HealthMonitor:
             self.logger.error(f"Error collecting metrics: {e}")
             return SystemMetrics(timestamp=datetime.now())
     
+    def start_metrics_collector(self):
+        """Start refreshing last_metrics in the background"""
+        if self._metrics_task is None:
+            self._metrics_task = asyncio.create_task(self._metrics_loop())
+    
+    async def _metrics_loop(self):
+        """Collect metrics every metrics_refresh_interval seconds"""
+        while True:
+            try:
+                await self.collect_metrics()
+            except Exception as e:
+                self.logger.error(f"Error in background metrics collection: {e}")
+            
+            await asyncio.sleep(self.config.metrics_refresh_interval)
+    
     def get_health_trends(self, hours: int = 24) -> Dict[str, Any]:
         """Get health trends over specified time period"""
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        recent_checks = [
-            check for check in self.health_history 
-            if check.timestamp >= cutoff_time
-        ]
-        
-        if not recent_checks:
-            return {'message': 'No health check data available for the specified period'}
-        
-        # Group by check name
         trends = {}
-        for check in recent_checks:
-            if check.name not in trends:
-                trends[check.name] = []
-            trends[check.name].append({
-                'timestamp': check.timestamp.isoformat(),
-                'status': check.status.value,
-                'response_time_ms': check.response_time_ms
-            })
-        
-        # Calculate trend statistics
         trend_stats = {}
-        for check_name, check_data in trends.items():
-            statuses = [item['status'] for item in check_data]
-            response_times = [item['response_time_ms'] for item in check_data]
-            
+        total_checks = 0
+        
+        for check_name, checks in self._history_by_name.items():
+            # Walk newest-first and stop at the first entry older than the cutoff
+            recent = []
+            for check in reversed(checks):
+                if check.timestamp < cutoff_time:
+                    break
+                recent.append(check)
+            
+            if not recent:
+                continue
+            
+            recent.reverse()
+            total_checks += len(recent)
+            
+            status_counts = {'healthy': 0, 'degraded': 0, 'unhealthy': 0, 'critical': 0}
+            response_times = []
+            check_data = []
+            
+            for check in recent:
+                status = check.status.value
+                status_counts[status] += 1
+                response_times.append(check.response_time_ms)
+                check_data.append({
+                    'timestamp': check.timestamp.isoformat(),
+                    'status': status,
+                    'response_time_ms': check.response_time_ms
+                })
+            
+            trends[check_name] = check_data
             trend_stats[check_name] = {
                 'total_checks': len(check_data),
-                'healthy_count': statuses.count('healthy'),
-                'degraded_count': statuses.count('degraded'),
-                'unhealthy_count': statuses.count('unhealthy'),
-                'critical_count': statuses.count('critical'),
+                'healthy_count': status_counts['healthy'],
+                'degraded_count': status_counts['degraded'],
+                'unhealthy_count': status_counts['unhealthy'],
+                'critical_count': status_counts['critical'],
                 'avg_response_time_ms': sum(response_times) / len(response_times),
                 'max_response_time_ms': max(response_times),
                 'min_response_time_ms': min(response_times)
             }
         
+        if not total_checks:
+            return {'message': 'No health check data available for the specified period'}
+        
         return {
             'period_hours': hours,
-            'total_checks': len(recent_checks),
+            'total_checks': total_checks,
             'trends': trend_stats,
             'raw_data': trends
         }
     
     async def cleanup(self):
         """Cleanup monitoring resources"""
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            try:
+                await self._metrics_task
+            except asyncio.CancelledError:
+                pass
+            self._metrics_task = None
+        
         if self.app:
             await self.app.cleanup()
 
@@ -588,14 +731,20 @@ class HealthMonitor:
 async def run_monitoring_server(config: Config, port: int = 8080):
     """Run a simple HTTP monitoring server"""
     try:
-        from aiohttp import web, web_response
+        from aiohttp import web
         
         monitor = HealthMonitor(config)
         await monitor.initialize()
+        monitor.start_metrics_collector()
+        
+        def json_response(data: Any, status: int = 200) -> web.Response:
+            """Build a JSON response without going through aiohttp's stdlib json encoder"""
+            return web.Response(body=_dump_json(data), status=status, content_type='application/json')
         
         async def health_endpoint(request):
-            """Health check endpoint"""
-            health_status = await monitor.run_comprehensive_health_check()
+            """Health check endpoint (pass ?fresh=1 to bypass the result cache)"""
+            ttl = 0 if request.query.get('fresh') == '1' else 3.0
+            health_status = await monitor.get_cached_health(ttl)
             
             # Set HTTP status based on health
             http_status = 200
@@ -604,18 +753,20 @@ async def run_monitoring_server(config: Config, port: int = 8080):
             elif health_status['overall_status'] == 'degraded':
                 http_status = 200  # Still operational
             
-            return web_response.json_response(health_status, status=http_status)
+            return json_response(health_status, status=http_status)
         
         async def metrics_endpoint(request):
-            """Metrics endpoint"""
-            metrics = await monitor.collect_metrics()
-            return web_response.json_response(asdict(metrics))
+            """Metrics endpoint (serves the snapshot kept fresh by the background collector)"""
+            metrics = monitor.last_metrics
+            if metrics is None:
+                metrics = await monitor.collect_metrics()
+            return json_response(asdict(metrics))
         
         async def trends_endpoint(request):
             """Health trends endpoint"""
             hours = int(request.query.get('hours', 24))
             trends = monitor.get_health_trends(hours)
-            return web_response.json_response(trends)
+            return json_response(trends)
         
         # Create web application
         app = web.Application()
@@ -685,7 +836,7 @@ if __name__ == "__main__":
             monitor = HealthMonitor(config)
             await monitor.initialize()
             health_status = await monitor.run_comprehensive_health_check()
-            print(json.dumps(health_status, indent=2, default=str))
+            print(_dump_json(health_status, indent=True).decode())
             await monitor.cleanup()
         
         asyncio.run(single_check())
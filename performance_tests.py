@@ -4,51 +4,85 @@ Tests system behavior under various load conditions
 """
 
 import asyncio
+import json
 import time
 import statistics
+import sys
+import tracemalloc
+from array import array
+from itertools import islice, repeat
+from time import perf_counter_ns
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Awaitable, Optional, Sequence, TextIO, Tuple
 import concurrent.futures
 
 from config import Config
 from main import EmailAutomationApp
-from db.models import Recipient
+from db.batcher import CreateBatcher
+from db.models import Recipient, RecipientRepository
+from email.template_engine import EmailTemplateEngine
+from utils.rate_limiter import RateLimiter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
 
 class PerformanceTester:
     """Performance testing suite"""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, raw_output: Optional[str] = None, keep_raw: bool = False):
         self.config = config
         self.app = None
         self.results = []
+        self.recipient_repo: Optional[RecipientRepository] = None
+        
+        # Created once so compiled templates and limiter state carry over between tests
+        self.template_engine = EmailTemplateEngine()
+        self.rate_limiter = RateLimiter(config)
+        self._string_pools: Dict[int, Tuple[List[str], List[str]]] = {}
+        
+        # Raw per-operation timings go to a JSON Lines file instead of staying in the results
+        self.raw_output = raw_output
+        self.keep_raw = keep_raw
+        self._raw_file: Optional[TextIO] = None
     
     async def initialize(self):
         """Initialize test environment"""
         self.app = EmailAutomationApp(self.config)
         await self.app.initialize()
+        self.recipient_repo = RecipientRepository(self.app.db_manager)
     
     async def cleanup(self):
         """Cleanup test environment"""
+        if self._raw_file:
+            self._raw_file.close()
+            self._raw_file = None
+        
         if self.app:
             await self.app.cleanup()
     
-    async def test_database_performance(self, num_operations: int = 1000) -> Dict[str, Any]:
+    async def test_database_performance(self, num_operations: int = 1000, batch_size: int = 64,
+                                        pipeline: int = 0) -> Dict[str, Any]:
         """Test database operation performance"""
         print(f"Testing database performance with {num_operations} operations...")
         
-        from db.models import RecipientRepository, Recipient
-        recipient_repo = RecipientRepository(self.app.db_manager)
+        recipient_repo = self.recipient_repo
         
-        # Test data
-        test_recipients = []
-        for i in range(num_operations):
-            test_recipients.append(Recipient(
-                first_name=f"Test{i}",
-                company=f"Company{i}",
-                role=f"Role{i}",
-                email=f"test{i}@example.com"
-            ))
+        # Test data, built before any timing starts
+        test_recipients = self._make_recipients("Test", "test", num_operations)
+        batch_recipients = self._make_recipients("Batch", "batch", num_operations)
         
         results = {
             'num_operations': num_operations,
@@ -58,56 +92,76 @@ class PerformanceTester:
             'total_time': 0
         }
         
-        start_total = time.time()
+        start_total = time.perf_counter()
         
         # Test CREATE operations
         print("Testing CREATE operations...")
-        create_times = []
-        recipient_ids = []
+        create_times = array('q', [0]) * len(test_recipients)  # ns, preallocated
         
-        for recipient in test_recipients:
-            start_time = time.time()
+        async def timed_create(indexed_recipient) -> int:
+            i, recipient = indexed_recipient
+            start_ns = perf_counter_ns()
             recipient_id = await recipient_repo.create(recipient)
-            end_time = time.time()
+            create_times[i] = perf_counter_ns() - start_ns
+            return recipient_id
+        
+        if pipeline > 1:
+            # Keep `pipeline` inserts in flight instead of awaiting each before issuing the next
+            print(f"Pipelining CREATE operations ({pipeline} in flight)...")
+            recipient_ids = await self._run_pipelined(list(enumerate(test_recipients)), timed_create, pipeline)
+        else:
+            recipient_ids = []
+            for indexed_recipient in enumerate(test_recipients):
+                recipient_ids.append(await timed_create(indexed_recipient))
+        
+        results['create_times'] = self._ns_to_ms(create_times)
+        results['pipeline_depth'] = pipeline
+        
+        # Test batched CREATE operations (one transaction per batch), timed per row
+        print(f"Testing batched CREATE operations ({batch_size} rows per batch)...")
+        batch_starts = range(0, len(batch_recipients), batch_size)
+        batch_create_times = array('q', [0]) * len(batch_starts)  # ns per row, preallocated
+        
+        for i, start in enumerate(batch_starts):
+            batch = batch_recipients[start:start + batch_size]
             
-            create_times.append((end_time - start_time) * 1000)  # Convert to ms
-            recipient_ids.append(recipient_id)
+            start_ns = perf_counter_ns()
+            await recipient_repo.create_many(batch)
+            batch_create_times[i] = (perf_counter_ns() - start_ns) // len(batch)
         
-        results['create_times'] = create_times
+        results['batch_create_times'] = self._ns_to_ms(batch_create_times)
         
         # Test READ operations
         print("Testing READ operations...")
-        read_times = []
+        sample_ids = recipient_ids[:100]  # Test first 100
+        read_times = array('q', [0]) * len(sample_ids)
         
-        for recipient_id in recipient_ids[:100]:  # Test first 100
-            start_time = time.time()
+        for i, recipient_id in enumerate(sample_ids):
+            start_ns = perf_counter_ns()
             await recipient_repo.get_by_id(recipient_id)
-            end_time = time.time()
-            
-            read_times.append((end_time - start_time) * 1000)
+            read_times[i] = perf_counter_ns() - start_ns
         
-        results['read_times'] = read_times
+        results['read_times'] = self._ns_to_ms(read_times)
         
         # Test UPDATE operations
         print("Testing UPDATE operations...")
-        update_times = []
+        update_times = array('q', [0]) * len(sample_ids)
         
-        for recipient_id in recipient_ids[:100]:  # Test first 100
-            start_time = time.time()
+        for i, recipient_id in enumerate(sample_ids):
+            start_ns = perf_counter_ns()
             await recipient_repo.update_status(recipient_id, 'active')
-            end_time = time.time()
-            
-            update_times.append((end_time - start_time) * 1000)
+            update_times[i] = perf_counter_ns() - start_ns
         
-        results['update_times'] = update_times
+        results['update_times'] = self._ns_to_ms(update_times)
         
-        end_total = time.time()
+        end_total = time.perf_counter()
         results['total_time'] = (end_total - start_total) * 1000
         
         # Calculate statistics
-        results['create_stats'] = self._calculate_stats(create_times)
-        results['read_stats'] = self._calculate_stats(read_times)
-        results['update_stats'] = self._calculate_stats(update_times)
+        results['create_stats'] = self._calculate_stats(results['create_times'])
+        results['batch_create_stats'] = self._calculate_stats(results['batch_create_times'])
+        results['read_stats'] = self._calculate_stats(results['read_times'])
+        results['update_stats'] = self._calculate_stats(results['update_times'])
         
         return results
     
@@ -115,8 +169,7 @@ class PerformanceTester:
         """Test email template rendering performance"""
         print(f"Testing template rendering with {num_renders} renders...")
         
-        from email.template_engine import EmailTemplateEngine
-        template_engine = EmailTemplateEngine()
+        template_engine = self.template_engine
         
         # Test recipient
         test_recipient = Recipient(
@@ -126,28 +179,34 @@ class PerformanceTester:
             email="performance@test.com"
         )
         
+        # Build the render context once so the loop measures template rendering only
+        context = {
+            'first_name': test_recipient.first_name,
+            'company': test_recipient.company,
+            'role': test_recipient.role,
+            'email': test_recipient.email
+        }
+        
         results = {
             'num_renders': num_renders,
             'render_times': {1: [], 2: [], 3: []},
             'total_time': 0
         }
         
-        start_total = time.time()
+        start_total = time.perf_counter()
         
         for step in [1, 2, 3]:
             print(f"Testing template step {step}...")
-            step_times = []
+            step_times = array('q', [0]) * (num_renders // 3)  # Divide renders among steps
             
-            for _ in range(num_renders // 3):  # Divide renders among steps
-                start_time = time.time()
-                template_engine.render_email(step, test_recipient)
-                end_time = time.time()
-                
-                step_times.append((end_time - start_time) * 1000)
+            for i in range(len(step_times)):
+                start_ns = perf_counter_ns()
+                template_engine.render_email_ctx(step, context)
+                step_times[i] = perf_counter_ns() - start_ns
             
-            results['render_times'][step] = step_times
+            results['render_times'][step] = self._ns_to_ms(step_times)
         
-        end_total = time.time()
+        end_total = time.perf_counter()
         results['total_time'] = (end_total - start_total) * 1000
         
         # Calculate statistics for each step
@@ -156,12 +215,13 @@ class PerformanceTester:
         
         return results
     
-    async def test_rate_limiter_performance(self, num_checks: int = 10000) -> Dict[str, Any]:
+    async def test_rate_limiter_performance(self, num_checks: int = 10000, bulk: bool = False,
+                                            bulk_size: int = 1000) -> Dict[str, Any]:
         """Test rate limiter performance"""
-        print(f"Testing rate limiter with {num_checks} checks...")
+        mode = f" in bulks of {bulk_size}" if bulk else ""
+        print(f"Testing rate limiter with {num_checks} checks{mode}...")
         
-        from utils.rate_limiter import RateLimiter
-        rate_limiter = RateLimiter(self.config)
+        rate_limiter = self.rate_limiter
         
         results = {
             'num_checks': num_checks,
@@ -170,60 +230,73 @@ class PerformanceTester:
             'total_time': 0
         }
         
-        start_total = time.time()
+        start_total = time.perf_counter()
         
-        # Test can_send_email performance
-        check_times = []
-        for _ in range(num_checks):
-            start_time = time.time()
-            await rate_limiter.can_send_email()
-            end_time = time.time()
-            
-            check_times.append((end_time - start_time) * 1000)
+        if bulk:
+            # Test can_send_email_bulk performance (one sample per bulk call)
+            check_times = array('q', [0]) * max(1, num_checks // bulk_size)
+            for i in range(len(check_times)):
+                start_ns = perf_counter_ns()
+                await rate_limiter.can_send_email_bulk(bulk_size)
+                check_times[i] = perf_counter_ns() - start_ns
+            checks_done = len(check_times) * bulk_size
+        else:
+            # Test can_send_email performance
+            check_times = array('q', [0]) * num_checks
+            for i in range(num_checks):
+                start_ns = perf_counter_ns()
+                await rate_limiter.can_send_email()
+                check_times[i] = perf_counter_ns() - start_ns
+            checks_done = num_checks
         
-        results['check_times'] = check_times
+        results['check_times'] = self._ns_to_ms(check_times)
+        results['checks_per_second'] = checks_done / ((sum(check_times) / 1_000_000_000) or 1)
         
         # Test record_email_sent performance
-        record_times = []
-        for _ in range(min(num_checks, 100)):  # Limit to avoid hitting actual limits
-            start_time = time.time()
+        record_times = array('q', [0]) * min(num_checks, 100)  # Limit to avoid hitting actual limits
+        for i in range(len(record_times)):
+            start_ns = perf_counter_ns()
             await rate_limiter.record_email_sent()
-            end_time = time.time()
-            
-            record_times.append((end_time - start_time) * 1000)
+            record_times[i] = perf_counter_ns() - start_ns
         
-        results['record_times'] = record_times
+        results['record_times'] = self._ns_to_ms(record_times)
         
-        end_total = time.time()
+        end_total = time.perf_counter()
         results['total_time'] = (end_total - start_total) * 1000
         
         # Calculate statistics
-        results['check_stats'] = self._calculate_stats(check_times)
-        results['record_stats'] = self._calculate_stats(record_times)
+        results['check_stats'] = self._calculate_stats(results['check_times'])
+        results['record_stats'] = self._calculate_stats(results['record_times'])
         
         return results
     
-    async def test_concurrent_operations(self, num_concurrent: int = 50) -> Dict[str, Any]:
+    async def test_concurrent_operations(self, num_concurrent: int = 50, batched: bool = True,
+                                         max_in_flight: int = 16, label: str = "concurrent") -> Dict[str, Any]:
         """Test concurrent operation performance"""
-        print(f"Testing concurrent operations with {num_concurrent} concurrent tasks...")
+        print(f"Testing concurrent operations with {num_concurrent} concurrent tasks ({max_in_flight} in flight)...")
+        
+        recipient_repo = self.recipient_repo
         
-        from db.models import RecipientRepository, Recipient
-        recipient_repo = RecipientRepository(self.app.db_manager)
+        # Concurrent creates are group-committed by the batcher unless batched=False
+        batcher = CreateBatcher(recipient_repo) if batched else None
+        create = batcher.submit if batcher else recipient_repo.create
+        
+        # Bound how many creates run at once so the database isn't overloaded
+        semaphore = asyncio.Semaphore(max_in_flight)
+        recipients = self._make_recipients("Concurrent", label, num_concurrent)
         
         async def create_recipient_task(index: int):
-            """Task to create a recipient"""
-            start_time = time.time()
+            """Task to create a recipient (failures are returned, not raised, so the other tasks keep going)"""
+            recipient = recipients[index]
             
-            recipient = Recipient(
-                first_name=f"Concurrent{index}",
-                company=f"Company{index}",
-                role=f"Role{index}",
-                email=f"concurrent{index}@example.com"
-            )
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    recipient_id = await create(recipient)
+                except Exception as e:
+                    return e
+                end_time = time.perf_counter()
             
-            recipient_id = await recipient_repo.create(recipient)
-            
-            end_time = time.time()
             return {
                 'index': index,
                 'recipient_id': recipient_id,
@@ -231,12 +304,15 @@ class PerformanceTester:
             }
         
         # Run concurrent tasks
-        start_total = time.time()
+        start_total = time.perf_counter()
         
-        tasks = [create_recipient_task(i) for i in range(num_concurrent)]
-        task_results = await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            task_results = await asyncio.gather(*(create_recipient_task(i) for i in range(num_concurrent)))
+        finally:
+            if batcher:
+                await batcher.close()
         
-        end_total = time.time()
+        end_total = time.perf_counter()
         
         # Process results
         successful_tasks = [r for r in task_results if not isinstance(r, Exception)]
@@ -246,90 +322,205 @@ class PerformanceTester:
         
         results = {
             'num_concurrent': num_concurrent,
+            'max_in_flight': max_in_flight,
+            'batched': batched,
             'successful_tasks': len(successful_tasks),
             'failed_tasks': len(failed_tasks),
             'total_time': (end_total - start_total) * 1000,
             'task_durations': durations,
             'duration_stats': self._calculate_stats(durations) if durations else {},
-            'throughput_per_second': len(successful_tasks) / ((end_total - start_total) or 1)
+            'throughput_per_second': len(successful_tasks) / ((end_total - start_total) or 1),
+            'success_rate': len(successful_tasks) / num_concurrent if num_concurrent else 0,
+            'pool_stats': self.app.db_manager.get_pool_stats()
         }
         
         return results
     
-    async def test_memory_usage(self, num_recipients: int = 10000) -> Dict[str, Any]:
+    async def test_concurrency_sweep(self, num_tasks: int = 128, max_level: int = 128) -> Dict[str, Any]:
+        """Measure create throughput at increasing in-flight limits to find where it stops scaling"""
+        print(f"Sweeping concurrency up to {max_level} with {num_tasks} tasks per level...")
+        
+        results = {'num_tasks': num_tasks}
+        
+        level = 1
+        while level <= max_level:
+            level_results = await self.test_concurrent_operations(
+                num_tasks, max_in_flight=level, label=f"sweep{level}_"
+            )
+            results[f'concurrency_{level}_throughput_per_second'] = level_results['throughput_per_second']
+            level *= 2
+        
+        # Text chart of throughput against the in-flight limit
+        throughputs = {key: value for key, value in results.items() if key.startswith('concurrency_')}
+        peak = max(throughputs.values()) or 1
+        for key, value in throughputs.items():
+            level = key.split('_')[1]
+            print(f"  {level:>4} | {'#' * int(40 * value / peak)} {value:.1f}/s")
+        
+        return results
+    
+    async def test_memory_usage(self, num_recipients: int = 10000, batch_size: int = 64) -> Dict[str, Any]:
         """Test memory usage with large datasets"""
         print(f"Testing memory usage with {num_recipients} recipients...")
         
-        try:
-            import psutil
-            process = psutil.Process()
-        except ImportError:
+        if psutil is None:
             return {'error': 'psutil not available for memory testing'}
+        process = psutil.Process()
         
         # Get initial memory usage
         initial_memory = process.memory_info().rss / (1024 * 1024)  # MB
         
-        from db.models import RecipientRepository, Recipient
-        recipient_repo = RecipientRepository(self.app.db_manager)
-        
-        # Create large number of recipients
-        recipients = []
-        for i in range(num_recipients):
-            recipients.append(Recipient(
-                first_name=f"Memory{i}",
-                company=f"Company{i}",
-                role=f"Role{i}",
-                email=f"memory{i}@example.com"
-            ))
-        
-        memory_after_creation = process.memory_info().rss / (1024 * 1024)
+        recipient_repo = self.recipient_repo
         
-        # Insert recipients into database
-        start_time = time.time()
+        # Generate recipients lazily so the measurement reflects the database path, not a list of them
+        recipients = map(
+            Recipient,
+            repeat(None),
+            map("Memory%d".__mod__, range(num_recipients)),
+            map("Company%d".__mod__, range(num_recipients)),
+            map("Role%d".__mod__, range(num_recipients)),
+            map("memory%d@example.com".__mod__, range(num_recipients))
+        )
         
-        for recipient in recipients:
-            await recipient_repo.create(recipient)
+        # Insert recipients into database in batches, tracing Python allocations
+        tracemalloc.start()
+        start_time = time.perf_counter()
         
-        end_time = time.time()
+        try:
+            while batch := list(islice(recipients, batch_size)):
+                await recipient_repo.create_many(batch)
+            
+            end_time = time.perf_counter()
+            allocated_current, allocated_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
         
         memory_after_insert = process.memory_info().rss / (1024 * 1024)
         
-        # Query all recipients
-        all_recipients = await recipient_repo.get_all_by_status('pending')
+        # Stream all recipients so the query measurement isn't dominated by a list of them
+        recipients_queried = 0
+        async for _ in recipient_repo.iter_by_status('pending'):
+            recipients_queried += 1
         
         memory_after_query = process.memory_info().rss / (1024 * 1024)
         
         results = {
             'num_recipients': num_recipients,
             'initial_memory_mb': initial_memory,
-            'memory_after_creation_mb': memory_after_creation,
             'memory_after_insert_mb': memory_after_insert,
             'memory_after_query_mb': memory_after_query,
             'memory_increase_mb': memory_after_query - initial_memory,
             'insert_time_seconds': end_time - start_time,
-            'recipients_queried': len(all_recipients)
+            'allocated_current_bytes': allocated_current,
+            'allocated_peak_bytes': allocated_peak,
+            'recipients_queried': recipients_queried
         }
         
         return results
     
+    def _event_loop_name(self) -> str:
+        """Name of the running event loop implementation (asyncio or uvloop)"""
+        return type(asyncio.get_running_loop()).__module__.split('.')[0]
+    
+    def record_raw_timings(self, test_name: str, results: Dict[str, Any]):
+        """Write a test's raw timing series to the JSON Lines output and drop them from its results"""
+        raw_keys = [
+            key for key, value in results.items()
+            if key.endswith(('_times', '_durations')) and isinstance(value, (list, dict))
+        ]
+        
+        if self.raw_output:
+            if self._raw_file is None:
+                self._raw_file = open(self.raw_output, 'w', encoding='utf-8')
+            
+            for key in raw_keys:
+                # Per-step series (e.g. render_times) are written one line per step
+                series = results[key] if isinstance(results[key], dict) else {None: results[key]}
+                for part, values in series.items():
+                    name = key if part is None else f"{key}.{part}"
+                    self._raw_file.write(json.dumps({'test': test_name, 'series': name, 'values_ms': values}) + "\n")
+            self._raw_file.flush()
+        
+        if not self.keep_raw:
+            for key in raw_keys:
+                del results[key]
+    
+    def _make_recipients(self, name_prefix: str, email_prefix: str, count: int) -> List[Recipient]:
+        """Build test recipients, reusing the company and role strings across tests of the same size"""
+        if count not in self._string_pools:
+            self._string_pools[count] = (
+                list(map("Company%d".__mod__, range(count))),
+                list(map("Role%d".__mod__, range(count)))
+            )
+        companies, roles = self._string_pools[count]
+        
+        first_names = map((name_prefix + "%d").__mod__, range(count))
+        emails = map((email_prefix + "%d@example.com").__mod__, range(count))
+        return list(map(Recipient, repeat(None), first_names, companies, roles, emails))
+    
+    async def _run_pipelined(self, items: Sequence[Any], operation: Callable[[Any], Awaitable[Any]],
+                             depth: int) -> List[Any]:
+        """Run operation over items with up to depth calls in flight, returning results in input order"""
+        results = [None] * len(items)
+        in_flight = {}
+        
+        async def drain(return_when):
+            done, _ = await asyncio.wait(in_flight, return_when=return_when)
+            for task in done:
+                results[in_flight.pop(task)] = task.result()
+        
+        try:
+            for index, item in enumerate(items):
+                in_flight[asyncio.create_task(operation(item))] = index
+                if len(in_flight) >= depth:
+                    await drain(asyncio.FIRST_COMPLETED)
+            
+            if in_flight:
+                await drain(asyncio.ALL_COMPLETED)
+        finally:
+            for task in in_flight:
+                task.cancel()
+        
+        return results
+    
+    def _ns_to_ms(self, samples_ns: array) -> List[float]:
+        """Convert nanosecond timing samples to milliseconds for reporting"""
+        return [sample / 1_000_000 for sample in samples_ns]
+    
     def _calculate_stats(self, times: List[float]) -> Dict[str, float]:
         """Calculate statistics for a list of times"""
-        if not times:
+        if not len(times):
             return {}
         
+        if np is not None:
+            # Vectorized reductions and a single partition for all three percentiles
+            data = np.asarray(times, dtype=np.float64)
+            median, p95, p99 = np.percentile(data, [50, 95, 99])
+            return {
+                'min': float(data.min()),
+                'max': float(data.max()),
+                'mean': float(data.mean()),
+                'median': float(median),
+                'std_dev': float(data.std(ddof=1)) if data.size > 1 else 0,
+                'p95': float(p95),
+                'p99': float(p99)
+            }
+        
+        # Sort once; min, max, median and the percentiles are all read from the sorted data
+        sorted_times = sorted(times)
+        
         return {
-            'min': min(times),
-            'max': max(times),
-            'mean': statistics.mean(times),
-            'median': statistics.median(times),
-            'std_dev': statistics.stdev(times) if len(times) > 1 else 0,
-            'p95': self._percentile(times, 95),
-            'p99': self._percentile(times, 99)
+            'min': sorted_times[0],
+            'max': sorted_times[-1],
+            'mean': statistics.fmean(sorted_times),
+            'median': self._percentile(sorted_times, 50),
+            'std_dev': statistics.stdev(sorted_times) if len(sorted_times) > 1 else 0,
+            'p95': self._percentile(sorted_times, 95),
+            'p99': self._percentile(sorted_times, 99)
         }
     
-    def _percentile(self, data: List[float], percentile: float) -> float:
-        """Calculate percentile of data"""
-        sorted_data = sorted(data)
+    def _percentile(self, sorted_data: List[float], percentile: float) -> float:
+        """Calculate percentile of already sorted data"""
         index = (percentile / 100) * (len(sorted_data) - 1)
         
         if index.is_integer():
@@ -367,46 +558,60 @@ class PerformanceTester:
             elif isinstance(value, str):
                 print(f"{key}: {value}")
     
+    async def _run_test(self, test_name: str, test_func: Callable[[int], Awaitable[Dict[str, Any]]],
+                        test_size: int) -> Dict[str, Any]:
+        """Run a single test, timing it and capturing failures as an error result"""
+        try:
+            print(f"\n{'-'*40}")
+            print(f"Running: {test_name}")
+            print(f"{'-'*40}")
+            
+            start_time = time.perf_counter()
+            results = await test_func(test_size)
+            end_time = time.perf_counter()
+            
+            results['test_duration_seconds'] = end_time - start_time
+            results['event_loop'] = self._event_loop_name()
+            self.record_raw_timings(test_name, results)
+            self.print_results(test_name, results)
+            return results
+            
+        except Exception as e:
+            print(f"Test {test_name} failed: {e}")
+            return {'error': str(e)}
+    
     async def run_all_tests(self) -> Dict[str, Any]:
         """Run all performance tests"""
         print("Starting comprehensive performance testing...")
         
-        all_results = {}
-        
-        tests = [
+        # Tests sharing the database run one at a time; the in-memory ones don't touch it
+        db_tests = [
             ("Database Performance", self.test_database_performance, 500),
-            ("Template Rendering", self.test_template_rendering_performance, 300),
-            ("Rate Limiter", self.test_rate_limiter_performance, 1000),
             ("Concurrent Operations", self.test_concurrent_operations, 25),
             ("Memory Usage", self.test_memory_usage, 1000)
         ]
+        cpu_tests = [
+            ("Template Rendering", self.test_template_rendering_performance, 300),
+            ("Rate Limiter", self.test_rate_limiter_performance, 1000)
+        ]
         
-        for test_name, test_func, test_size in tests:
-            try:
-                print(f"\n{'-'*40}")
-                print(f"Running: {test_name}")
-                print(f"{'-'*40}")
-                
-                start_time = time.time()
-                results = await test_func(test_size)
-                end_time = time.time()
-                
-                results['test_duration_seconds'] = end_time - start_time
-                all_results[test_name] = results
-                
-                self.print_results(test_name, results)
-                
-            except Exception as e:
-                print(f"Test {test_name} failed: {e}")
-                all_results[test_name] = {'error': str(e)}
+        all_results = {}
+        for test_name, test_func, test_size in db_tests:
+            all_results[test_name] = await self._run_test(test_name, test_func, test_size)
+        
+        cpu_results = await asyncio.gather(
+            *(self._run_test(test_name, test_func, test_size) for test_name, test_func, test_size in cpu_tests)
+        )
+        for (test_name, _, _), results in zip(cpu_tests, cpu_results):
+            all_results[test_name] = results
         
         return all_results
 
 
-async def run_performance_tests():
+async def run_performance_tests(raw_output: Optional[str] = None, keep_raw: bool = False):
     """Main function to run performance tests"""
     config = Config()
-    tester = PerformanceTester(config)
+    tester = PerformanceTester(config, raw_output=raw_output, keep_raw=keep_raw)
     
     try:
         await tester.initialize()
@@ -430,13 +635,39 @@ async def run_performance_tests():
         await tester.cleanup()
 
 
+def run_with_event_loop(main, use_uvloop: bool = False):
+    """Run a coroutine on the stock asyncio loop or, if requested, on uvloop"""
+    if use_uvloop:
+        if uvloop is None:
+            main.close()
+            raise RuntimeError("uvloop is not installed")
+        if sys.version_info >= (3, 11):
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                return runner.run(main)
+        
+        # asyncio.Runner is 3.11+; on 3.10 uvloop is installed as the loop policy instead
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        try:
+            return asyncio.run(main)
+        finally:
+            asyncio.set_event_loop_policy(None)
+    
+    return asyncio.run(main)
+
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Email Automation Performance Tests')
-    parser.add_argument('--test', choices=['database', 'template', 'rate', 'concurrent', 'memory'], 
+    parser.add_argument('--test', choices=['database', 'template', 'rate', 'concurrent', 'sweep', 'memory'], 
                        help='Run specific test only')
     parser.add_argument('--size', type=int, default=1000, help='Test size (number of operations)')
+    parser.add_argument('--bulk', action='store_true', help='Use bulk rate limiter checks in the rate test')
+    parser.add_argument('--pipeline', type=int, nargs='?', const=16, default=0,
+                       help='Keep N inserts in flight in the database test (16 if N is omitted)')
+    parser.add_argument('--out', help='Write raw per-operation timings to this JSON Lines file')
+    parser.add_argument('--keep-raw', action='store_true', help='Keep raw timings in the printed results')
+    parser.add_argument('--uvloop', action='store_true', help='Run the tests on uvloop instead of the asyncio loop')
     
     args = parser.parse_args()
     
@@ -444,28 +675,32 @@ if __name__ == "__main__":
         # Run specific test
         async def run_specific_test():
             config = Config()
-            tester = PerformanceTester(config)
+            tester = PerformanceTester(config, raw_output=args.out, keep_raw=args.keep_raw)
             
             try:
                 await tester.initialize()
                 
                 if args.test == 'database':
-                    results = await tester.test_database_performance(args.size)
+                    results = await tester.test_database_performance(args.size, pipeline=args.pipeline)
                 elif args.test == 'template':
                     results = await tester.test_template_rendering_performance(args.size)
                 elif args.test == 'rate':
-                    results = await tester.test_rate_limiter_performance(args.size)
+                    results = await tester.test_rate_limiter_performance(args.size, bulk=args.bulk)
                 elif args.test == 'concurrent':
                     results = await tester.test_concurrent_operations(args.size)
+                elif args.test == 'sweep':
+                    results = await tester.test_concurrency_sweep(args.size)
                 elif args.test == 'memory':
                     results = await tester.test_memory_usage(args.size)
                 
+                results['event_loop'] = tester._event_loop_name()
+                tester.record_raw_timings(args.test.title(), results)
                 tester.print_results(args.test.title(), results)
                 
             finally:
                 await tester.cleanup()
         
-        asyncio.run(run_specific_test())
+        run_with_event_loop(run_specific_test(), args.uvloop)
     else:
         # Run all tests
-        asyncio.run(run_performance_tests())
\ No newline at end of file
+        run_with_event_loop(run_performance_tests(raw_output=args.out, keep_raw=args.keep_raw), args.uvloop)
\ No newline at end of file
@@ -3,24 +3,114 @@ Advanced reply matching and sequence stopping logic
 Handles complex reply detection scenarios and sequence management
 """
 
+import asyncio
+import json
 import logging
+import operator
 import re
-from datetime import datetime, timedelta
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, List, Optional, Tuple, Set
-from dataclasses import dataclass
-from enum import Enum
+from dataclasses import dataclass, field
+from enum import IntEnum
+from functools import lru_cache
 
 from db.models import EmailSequence, Recipient, EmailSequenceRepository, RecipientRepository
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class ReplyConfidence(Enum):
-    """Reply detection confidence levels"""
-    HIGH = "high"
-    MEDIUM = "medium"
-    LOW = "low"
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
-@dataclass
+
+# Recipient statuses whose sequences are still running and can be stopped by a reply
+MATCHABLE_STATUSES = frozenset(('active', 'pending'))
+
+# Shared default for missing Graph API sub-objects; never mutated
+_EMPTY: Dict[str, Any] = {}
+
+# The Graph API message fields match_reply reads, fetched in one call
+_get_fields = operator.itemgetter('id', 'subject', 'from', 'receivedDateTime', 'inReplyTo', 'bodyPreview')
+
+
+def _message_fields(message: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Extract match_reply's fields from a message, with '' for any that are missing"""
+    try:
+        return _get_fields(message)
+    except KeyError:
+        return _get_fields(defaultdict(str, message))
+
+
+def _json_default(obj: Any) -> Any:
+    """Serialize values the JSON encoder can't handle natively"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _dump_json(data: Any) -> str:
+    """Serialize data to a JSON string, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default).decode()
+    return json.dumps(data, default=_json_default)
+
+
+@lru_cache(maxsize=4096)
+def normalize_email(address: str) -> str:
+    """Strip and lower-case an email address, reusing the result for repeat senders"""
+    return address.strip().lower()
+
+
+# Fractional seconds of a timestamp; Graph sends 7 digits, Python 3.10 only parses 3 or 6
+_FRACTION = re.compile(r'\.(\d+)')
+
+
+def parse_graph_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Parse a Graph API timestamp as a timezone-aware UTC datetime, or None if it isn't one"""
+    if not value:
+        return None
+    
+    # Python 3.10's fromisoformat rejects a trailing Z and fractions that aren't 3 or 6 digits
+    if value[-1] in 'Zz':
+        value = value[:-1] + '+00:00'
+    value = _FRACTION.sub(lambda match: '.' + match.group(1)[:6].ljust(6, '0'), value, count=1)
+    
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    
+    # Graph timestamps are UTC, so one without an offset is treated as UTC too
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class ReplyConfidence(IntEnum):
+    """Reply detection confidence levels, ordered so e.g. confidence >= MEDIUM works"""
+    HIGH = 3
+    MEDIUM = 2
+    LOW = 1
+    
+    @property
+    def label(self) -> str:
+        """Lower-case name used in results and logs ("high", "medium", "low")"""
+        return _CONFIDENCE_LABELS[self]
+
+
+_CONFIDENCE_LABELS = {confidence: confidence.name.lower() for confidence in ReplyConfidence}
+
+
+@dataclass(slots=True)
 class ReplyMatch:
     """Represents a matched reply with confidence and metadata"""
     recipient_id: int
@@ -30,7 +120,43 @@ class ReplyMatch:
     original_sequence_id: Optional[int] = None
     reply_subject: str = ""
     reply_timestamp: Optional[datetime] = None
-    metadata: Dict[str, Any] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+class MessageIdCache:
+    """Small TTL + LRU cache of inReplyTo lookups: message ID -> (sequence ID, recipient ID, recipient email)"""
+    
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[int, int, str]]]" = OrderedDict()
+    
+    def get(self, message_id: str) -> Optional[Tuple[int, int, str]]:
+        """Get a cached lookup if it hasn't expired"""
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self._entries[message_id]
+            return None
+        
+        self._entries.move_to_end(message_id)
+        return value
+    
+    def put(self, message_id: str, value: Tuple[int, int, str]):
+        """Cache a lookup, evicting the least recently used entry when full"""
+        self._entries[message_id] = (time.monotonic(), value)
+        self._entries.move_to_end(message_id)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def invalidate_recipient(self, recipient_id: int):
+        """Drop every cached lookup that resolved to a recipient"""
+        stale = [key for key, (_, value) in self._entries.items() if value[1] == recipient_id]
+        for key in stale:
+            del self._entries[key]
 
 
 class ReplyMatcher:
@@ -41,42 +167,44 @@ class ReplyMatcher:
         self.recipient_repo = recipient_repo
         self.logger = logging.getLogger(__name__)
         
-        # Reply detection patterns (more comprehensive)
+        # Redelivered or retried messages resolve the same inReplyTo without hitting the database
+        self.message_id_cache = MessageIdCache()
+        
+        # Emails of active and pending recipients, refreshed in the background so senders who
+        # were never contacted are rejected without a database lookup (None until first loaded)
+        self.active_emails_refresh_interval = 60
+        self._active_emails: Optional[Set[str]] = None
+        self._active_emails_task: Optional[asyncio.Task] = None
+        
+        # Reply and forward subject prefixes (matched case-insensitively)
         self.reply_patterns = {
             'subject_prefixes': [
-                r'^RE:\s*',
-                r'^Re:\s*', 
-                r'^re:\s*',
-                r'^AW:\s*',  # German
-                r'^Aw:\s*',
-                r'^SV:\s*',  # Swedish/Norwegian
-                r'^Sv:\s*',
-                r'^VS:\s*',  # Danish
-                r'^Vs:\s*',
-                r'^回复:\s*',  # Chinese
-                r'^答复:\s*',
-                r'^Répondre:\s*',  # French
-                r'^R:\s*',   # Portuguese
-                r'^RES:\s*', # Portuguese
-                r'^Odp:\s*', # Polish
-                r'^Отв:\s*', # Russian
+                'RE',
+                'AW',  # German
+                'SV',  # Swedish/Norwegian
+                'VS',  # Danish
+                '回复',  # Chinese
+                '答复',
+                'Répondre',  # French
+                'R',   # Portuguese
+                'RES', # Portuguese
+                'Odp', # Polish
+                'Отв', # Russian
             ],
             'forward_prefixes': [
-                r'^FW:\s*',
-                r'^Fw:\s*',
-                r'^fw:\s*',
-                r'^FWD:\s*',
-                r'^Fwd:\s*',
-                r'^fwd:\s*',
-                r'^WG:\s*',  # German
-                r'^Wg:\s*',
-                r'^TR:\s*',  # Turkish
-                r'^Tr:\s*',
-                r'^转发:\s*', # Chinese
-                r'^Fwd:\s*',
+                'FW',
+                'FWD',
+                'WG',  # German
+                'TR',  # Turkish
+                '转发', # Chinese
             ]
         }
         
+        # Each prefix list split once into literal ASCII prefixes (checked with str.startswith)
+        # and a regex for the non-ASCII ones
+        self._reply_prefixes = self._compile_prefixes(self.reply_patterns['subject_prefixes'])
+        self._forward_prefixes = self._compile_prefixes(self.reply_patterns['forward_prefixes'])
+        
         # Common auto-reply indicators
         self.auto_reply_indicators = [
             'out of office',
@@ -128,100 +256,227 @@ class ReplyMatcher:
             'not a fit'
         ]
         
+        # One multi-pattern scanner over all indicator lists, tagged by kind
+        self._indicator_kinds = {
+            'auto': self.auto_reply_indicators,
+            'positive': self.positive_reply_indicators,
+            'negative': self.negative_reply_indicators
+        }
+        self._indicator_scanner = self._build_indicator_scanner()
+        
         self.logger.info("Reply matcher initialized with comprehensive detection patterns")
     
-    async def match_reply(self, message: Dict[str, Any]) -> Optional[ReplyMatch]:
+    @staticmethod
+    def _compile_prefixes(prefixes: List[str]) -> Tuple[Tuple[str, ...], Optional[re.Pattern]]:
+        """Split subject prefixes into lower-cased 'prefix:' literals and a regex for non-ASCII prefixes"""
+        ascii_prefixes = tuple(f"{prefix.lower()}:" for prefix in prefixes if prefix.isascii())
+        
+        other_prefixes = [prefix for prefix in prefixes if not prefix.isascii()]
+        if not other_prefixes:
+            return ascii_prefixes, None
+        
+        alternation = '|'.join(re.escape(prefix) for prefix in other_prefixes)
+        return ascii_prefixes, re.compile(rf'^(?:{alternation})\s*:', re.IGNORECASE)
+    
+    @staticmethod
+    def _has_prefix(subject: str, prefixes: Tuple[Tuple[str, ...], Optional[re.Pattern]]) -> bool:
+        """Check a subject against prefixes from _compile_prefixes"""
+        ascii_prefixes, other_re = prefixes
+        if subject.lower().startswith(ascii_prefixes):
+            return True
+        return other_re is not None and other_re.match(subject) is not None
+    
+    def is_reply_subject(self, subject: str) -> bool:
+        """Check if a subject starts with a reply prefix such as 'RE:' or '回复:'"""
+        return bool(subject) and self._has_prefix(subject, self._reply_prefixes)
+    
+    def _build_indicator_scanner(self):
+        """Build a Hyperscan database or Aho-Corasick automaton over all indicators, or a regex when neither is installed"""
+        if hyperscan is not None:
+            # Pattern IDs index into this list; SINGLEMATCH reports each indicator at most once per scan
+            self._indicator_ids = [
+                (kind, index)
+                for kind, indicators in self._indicator_kinds.items()
+                for index in range(len(indicators))
+            ]
+            expressions = [
+                re.escape(indicator).encode()
+                for indicators in self._indicator_kinds.values()
+                for indicator in indicators
+            ]
+            database = hyperscan.Database()
+            database.compile(
+                expressions=expressions,
+                ids=list(range(len(expressions))),
+                elements=len(expressions),
+                flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(expressions)
+            )
+            return database
+        
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for kind, indicators in self._indicator_kinds.items():
+                for index, indicator in enumerate(indicators):
+                    automaton.add_word(indicator, (kind, index))
+            automaton.make_automaton()
+            return automaton
+        
+        # Zero-width lookahead reports a hit at every position; longest first so no indicator
+        # hides a longer one starting at the same place (none is currently a prefix of another)
+        self._indicator_lookup = {
+            indicator: (kind, index)
+            for kind, indicators in self._indicator_kinds.items()
+            for index, indicator in enumerate(indicators)
+        }
+        alternation = '|'.join(re.escape(indicator) for indicator in sorted(self._indicator_lookup, key=len, reverse=True))
+        return re.compile(f'(?=({alternation}))')
+    
+    @staticmethod
+    def _fold_text(subject: str, body_preview: str) -> str:
+        """Lower-cased subject and body preview, built once per message for indicator scans"""
+        return f"{subject} {body_preview}".lower()
+    
+    def _scan_indicators(self, folded_text: str) -> Dict[str, int]:
+        """Count the distinct auto-reply, positive and negative indicators in folded text in one pass"""
+        if hyperscan is not None:
+            hits = set()
+            
+            def on_match(pattern_id, start, end, flags, context):
+                hits.add(self._indicator_ids[pattern_id])
+            
+            self._indicator_scanner.scan(folded_text.encode(), match_event_handler=on_match)
+        elif ahocorasick is not None:
+            hits = {value for _, value in self._indicator_scanner.iter(folded_text)}
+        else:
+            hits = {self._indicator_lookup[match.group(1)] for match in self._indicator_scanner.finditer(folded_text)}
+        
+        counts = dict.fromkeys(self._indicator_kinds, 0)
+        for kind, _ in hits:
+            counts[kind] += 1
+        return counts
+    
+    async def refresh_active_emails(self):
+        """Reload the set of active and pending recipient emails"""
+        self._active_emails = await self.recipient_repo.list_active_emails()
+    
+    def start_active_email_refresh(self):
+        """Start refreshing the active recipient emails in the background"""
+        if self._active_emails_task is None:
+            self._active_emails_task = asyncio.create_task(self._active_email_loop())
+    
+    async def _active_email_loop(self):
+        """Refresh active recipient emails every active_emails_refresh_interval seconds"""
+        while True:
+            try:
+                await self.refresh_active_emails()
+            except Exception as e:
+                # Fall back to database lookups for every sender until a refresh succeeds
+                self._active_emails = None
+                self.logger.error(f"Error refreshing active recipient emails: {e}")
+            
+            await asyncio.sleep(self.active_emails_refresh_interval)
+    
+    async def stop_active_email_refresh(self):
+        """Stop the background refresh"""
+        if self._active_emails_task is not None:
+            self._active_emails_task.cancel()
+            try:
+                await self._active_emails_task
+            except asyncio.CancelledError:
+                pass
+            self._active_emails_task = None
+    
+    async def match_replies(self, messages: List[Dict[str, Any]]) -> List[Optional[ReplyMatch]]:
+        """Match a batch of messages concurrently, sharing one recency cutoff"""
+        recency_cutoff = datetime.now(timezone.utc) - timedelta(days=30)
+        return await asyncio.gather(*(self.match_reply(message, recency_cutoff) for message in messages))
+    
+    async def match_reply(self, message: Dict[str, Any],
+                          recency_cutoff: Optional[datetime] = None) -> Optional[ReplyMatch]:
         """Match a message to determine if it's a reply and to which recipient"""
         try:
             # Extract message details
-            message_id = message.get('id', '')
-            subject = message.get('subject', '')
-            from_address = self._extract_email_address(message.get('from', {}))
-            received_time = self._parse_datetime(message.get('receivedDateTime'))
-            in_reply_to = message.get('inReplyTo', '')
-            body_preview = message.get('bodyPreview', '')
+            message_id, subject, from_field, received, in_reply_to, body_preview = _message_fields(message)
+            from_address = self._extract_email_address(from_field)
+            received_time = self._parse_datetime(received)
             
             if not from_address:
                 return None
             
+            # Cheap local signals first, so database lookups only run when they can match
+            has_in_reply_to = bool(in_reply_to)
+            has_reply_prefix = self.is_reply_subject(subject)
+            
             # Try different matching methods in order of confidence
             
-            # Method 1: Direct message ID matching (highest confidence)
-            match = await self._match_by_message_id(in_reply_to, from_address, message_id, subject, received_time)
-            if match:
-                return match
+            # Method 1: Direct message ID matching (highest confidence), from the cache when possible
+            lookup_sequence = False
+            if has_in_reply_to:
+                cached = self.message_id_cache.get(in_reply_to)
+                if cached:
+                    match = self._match_by_message_id(in_reply_to, cached, from_address, message_id, subject, received_time)
+                    if match:
+                        return match
+                else:
+                    lookup_sequence = True
+            
+            # Senders outside the active recipient set can only match by message ID
+            sender_possible = self._active_emails is None or from_address in self._active_emails
+            if not lookup_sequence and not sender_possible:
+                return None
+            
+            # One round-trip resolves both the replied-to sequence's recipient and the sender
+            sequence_id, sequence_recipient, recipient = await self.sequence_repo.resolve_reply_context(
+                in_reply_to if lookup_sequence else None,
+                from_address if sender_possible else None
+            )
+            
+            if sequence_recipient:
+                entry = (sequence_id, sequence_recipient.id, normalize_email(sequence_recipient.email))
+                self.message_id_cache.put(in_reply_to, entry)
+                match = self._match_by_message_id(in_reply_to, entry, from_address, message_id, subject, received_time)
+                if match:
+                    return match
+            
+            # Methods 2 and 3 only consider senders whose sequences are still running
+            if not recipient or recipient.status not in MATCHABLE_STATUSES:
+                return None
             
             # Method 2: Subject line analysis (medium confidence)
-            match = await self._match_by_subject(subject, from_address, message_id, received_time)
-            if match:
-                return match
+            if has_reply_prefix:
+                return self._match_by_subject(subject, recipient, message_id, received_time)
             
             # Method 3: Sender analysis (lower confidence)
-            match = await self._match_by_sender(from_address, subject, message_id, received_time, body_preview)
-            if match:
-                return match
-            
-            return None
+            return self._match_by_sender(recipient, subject, message_id, received_time, body_preview, recency_cutoff)
             
         except Exception as e:
             self.logger.error(f"Error matching reply: {e}")
             return None
     
-    async def _match_by_message_id(self, in_reply_to: str, from_address: str, message_id: str, 
-                                 subject: str, received_time: datetime) -> Optional[ReplyMatch]:
-        """Match reply using inReplyTo message ID"""
-        if not in_reply_to:
-            return None
+    def _match_by_message_id(self, in_reply_to: str, entry: Tuple[int, int, str], from_address: str,
+                             message_id: str, subject: str, received_time: datetime) -> Optional[ReplyMatch]:
+        """Match reply using the inReplyTo message's (sequence ID, recipient ID, recipient email)"""
+        sequence_id, recipient_id, recipient_email = entry
         
-        try:
-            # Find original sequence by message ID
-            sequence = await self.sequence_repo.get_by_message_id(in_reply_to)
-            if not sequence:
-                return None
-            
-            # Verify sender matches recipient
-            recipient = await self.recipient_repo.get_by_id(sequence.recipient_id)
-            if not recipient or recipient.email.lower() != from_address.lower():
-                return None
-            
-            return ReplyMatch(
-                recipient_id=sequence.recipient_id,
-                message_id=message_id,
-                confidence=ReplyConfidence.HIGH,
-                matching_method="message_id",
-                original_sequence_id=sequence.id,
-                reply_subject=subject,
-                reply_timestamp=received_time,
-                metadata={'in_reply_to': in_reply_to}
-            )
-            
-        except Exception as e:
-            self.logger.error(f"Error in message ID matching: {e}")
+        # Verify sender matches recipient
+        if recipient_email != from_address:
             return None
+        
+        return ReplyMatch(
+            recipient_id=recipient_id,
+            message_id=message_id,
+            confidence=ReplyConfidence.HIGH,
+            matching_method="message_id",
+            original_sequence_id=sequence_id,
+            reply_subject=subject,
+            reply_timestamp=received_time,
+            metadata={'in_reply_to': in_reply_to}
+        )
     
-    async def _match_by_subject(self, subject: str, from_address: str, message_id: str, 
-                              received_time: datetime) -> Optional[ReplyMatch]:
-        """Match reply using subject line patterns"""
+    def _match_by_subject(self, subject: str, recipient: Recipient, message_id: str, 
+                          received_time: datetime) -> Optional[ReplyMatch]:
+        """Match reply using subject line patterns (subject already has a reply prefix)"""
         try:
-            # Check if subject indicates a reply
-            is_reply_subject = False
-            for pattern in self.reply_patterns['subject_prefixes']:
-                if re.match(pattern, subject, re.IGNORECASE):
-                    is_reply_subject = True
-                    break
-            
-            if not is_reply_subject:
-                return None
-            
-            # Find recipient by email
-            recipient = await self.recipient_repo.get_by_email(from_address)
-            if not recipient:
-                return None
-            
-            # Check if recipient has active sequences
-            if recipient.status not in ['active', 'pending']:
-                return None
-            
             return ReplyMatch(
                 recipient_id=recipient.id,
                 message_id=message_id,
@@ -236,27 +491,23 @@ class ReplyMatcher:
             self.logger.error(f"Error in subject matching: {e}")
             return None
     
-    async def _match_by_sender(self, from_address: str, subject: str, message_id: str, 
-                             received_time: datetime, body_preview: str) -> Optional[ReplyMatch]:
+    def _match_by_sender(self, recipient: Recipient, subject: str, message_id: str, 
+                         received_time: datetime, body_preview: str,
+                         recency_cutoff: Optional[datetime] = None) -> Optional[ReplyMatch]:
         """Match reply using sender analysis"""
         try:
-            # Find recipient by email
-            recipient = await self.recipient_repo.get_by_email(from_address)
-            if not recipient:
-                return None
-            
-            # Only consider if recipient has active sequences
-            if recipient.status not in ['active', 'pending']:
-                return None
-            
             # Check if this looks like an auto-reply (should be ignored)
-            if self._is_auto_reply(subject, body_preview):
-                self.logger.debug(f"Ignoring auto-reply from {from_address}: {subject}")
+            indicator_counts = self._scan_indicators(self._fold_text(subject, body_preview))
+            if indicator_counts['auto']:
+                self.logger.debug(f"Ignoring auto-reply from {recipient.email}: {subject}")
                 return None
             
             # Check recency - only consider messages within reasonable timeframe
-            if received_time and received_time < datetime.now() - timedelta(days=30):
-                return None
+            if received_time:
+                if recency_cutoff is None:
+                    recency_cutoff = datetime.now(timezone.utc) - timedelta(days=30)
+                if received_time < recency_cutoff:
+                    return None
             
             return ReplyMatch(
                 recipient_id=recipient.id,
@@ -267,7 +518,7 @@ class ReplyMatcher:
                 reply_timestamp=received_time,
                 metadata={
                     'body_preview': body_preview[:100],
-                    'reply_sentiment': self._analyze_reply_sentiment(subject, body_preview)
+                    'reply_sentiment': self._sentiment_from_counts(indicator_counts)
                 }
             )
             
@@ -275,22 +526,18 @@ class ReplyMatcher:
             self.logger.error(f"Error in sender matching: {e}")
             return None
     
-    def _is_auto_reply(self, subject: str, body_preview: str) -> bool:
-        """Check if message appears to be an auto-reply"""
-        combined_text = f"{subject} {body_preview}".lower()
-        
-        for indicator in self.auto_reply_indicators:
-            if indicator in combined_text:
-                return True
-        
-        return False
+    def _is_auto_reply(self, folded_text: str) -> bool:
+        """Check if message appears to be an auto-reply (folded_text from _fold_text)"""
+        return self._scan_indicators(folded_text)['auto'] > 0
     
-    def _analyze_reply_sentiment(self, subject: str, body_preview: str) -> str:
-        """Basic sentiment analysis of reply"""
-        combined_text = f"{subject} {body_preview}".lower()
-        
-        positive_score = sum(1 for indicator in self.positive_reply_indicators if indicator in combined_text)
-        negative_score = sum(1 for indicator in self.negative_reply_indicators if indicator in combined_text)
+    def _analyze_reply_sentiment(self, folded_text: str) -> str:
+        """Basic sentiment analysis of reply (folded_text from _fold_text)"""
+        return self._sentiment_from_counts(self._scan_indicators(folded_text))
+    
+    def _sentiment_from_counts(self, indicator_counts: Dict[str, int]) -> str:
+        """Classify sentiment from positive and negative indicator counts"""
+        positive_score = indicator_counts['positive']
+        negative_score = indicator_counts['negative']
         
         if positive_score > negative_score:
             return "positive"
@@ -299,33 +546,27 @@ class ReplyMatcher:
         else:
             return "neutral"
     
-    def _extract_email_address(self, from_field: Dict[str, Any]) -> Optional[str]:
+    def _extract_email_address(self, from_field: Optional[Dict[str, Any]]) -> Optional[str]:
         """Extract email address from Graph API from field"""
-        try:
-            email_address = from_field.get('emailAddress', {})
-            return email_address.get('address', '').lower()
-        except Exception:
-            return None
+        address = ((from_field or _EMPTY).get('emailAddress') or _EMPTY).get('address')
+        return normalize_email(address) if address else None
     
     def _parse_datetime(self, datetime_str: str) -> Optional[datetime]:
-        """Parse datetime string from Graph API"""
-        try:
-            if datetime_str:
-                # Remove timezone info for simplicity
-                clean_str = datetime_str.replace('Z', '').split('.')[0]
-                return datetime.fromisoformat(clean_str)
-        except Exception:
-            pass
-        return None
+        """Parse datetime string from Graph API as a timezone-aware UTC datetime"""
+        return parse_graph_datetime(datetime_str)
 
 
 class SequenceStopper:
     """Handles stopping email sequences when replies are detected"""
     
-    def __init__(self, sequence_repo: EmailSequenceRepository, recipient_repo: RecipientRepository):
+    def __init__(self, sequence_repo: EmailSequenceRepository, recipient_repo: RecipientRepository,
+                 message_id_cache: Optional[MessageIdCache] = None):
         self.sequence_repo = sequence_repo
         self.recipient_repo = recipient_repo
         self.logger = logging.getLogger(__name__)
+        
+        # The matcher's lookup cache, cleared for recipients whose sequences are stopped
+        self.message_id_cache = message_id_cache
     
     async def stop_sequence(self, reply_match: ReplyMatch, scheduler=None) -> Dict[str, Any]:
         """Stop email sequence for a recipient who replied"""
@@ -334,36 +575,36 @@ class SequenceStopper:
                 'recipient_id': reply_match.recipient_id,
                 'cancelled_emails': 0,
                 'status_updated': False,
-                'confidence': reply_match.confidence.value,
+                'confidence': reply_match.confidence.label,
                 'matching_method': reply_match.matching_method,
                 'error': None
             }
             
+            if self.message_id_cache:
+                self.message_id_cache.invalidate_recipient(reply_match.recipient_id)
+            
             # Get recipient info
             recipient = await self.recipient_repo.get_by_id(reply_match.recipient_id)
             if not recipient:
                 result['error'] = f'Recipient {reply_match.recipient_id} not found'
                 return result
             
-            # Cancel future emails
-            cancelled_count = await self.sequence_repo.cancel_future_emails(reply_match.recipient_id)
-            result['cancelled_emails'] = cancelled_count
+            # The scheduler cancels the emails and marks the recipient replied in one
+            # transaction, then drops their dispatch jobs; without one the repository
+            # does the same transaction. Either raises if the write fails, so the status
+            # is only reported updated once it has been
+            if scheduler:
+                cancelled_count = await scheduler.cancel_future_emails(reply_match.recipient_id)
+            else:
+                cancelled_count = await self.sequence_repo.cancel_future_emails(reply_match.recipient_id, 'replied')
             
-            # Update recipient status
-            await self.recipient_repo.update_status(reply_match.recipient_id, 'replied')
             result['status_updated'] = True
-            
-            # If scheduler is available, also cancel scheduled jobs
-            if scheduler:
-                try:
-                    await scheduler.cancel_future_emails(reply_match.recipient_id)
-                except Exception as e:
-                    self.logger.warning(f"Could not cancel scheduler jobs: {e}")
+            result['cancelled_emails'] = cancelled_count
             
             # Log the action
             self.logger.info(
                 f"Stopped sequence for {recipient.email} "
-                f"(confidence: {reply_match.confidence.value}, "
+                f"(confidence: {reply_match.confidence.label}, "
                 f"method: {reply_match.matching_method}, "
                 f"cancelled: {cancelled_count} emails)"
             )
@@ -386,22 +627,25 @@ class SequenceStopper:
         """Store reply analytics for reporting"""
         try:
             # This could be expanded to store in a dedicated analytics table
-            # For now, just log structured data
+            # For now, just log structured data (skipped entirely when INFO is disabled)
+            if not self.logger.isEnabledFor(logging.INFO):
+                return
+            
             analytics_data = {
                 'event': 'reply_detected',
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': datetime.now(),
                 'recipient_id': reply_match.recipient_id,
                 'recipient_email': recipient.email,
                 'company': recipient.company,
                 'role': recipient.role,
-                'reply_confidence': reply_match.confidence.value,
+                'reply_confidence': reply_match.confidence.label,
                 'matching_method': reply_match.matching_method,
                 'reply_subject': reply_match.reply_subject,
-                'reply_timestamp': reply_match.reply_timestamp.isoformat() if reply_match.reply_timestamp else None,
-                'metadata': reply_match.metadata or {}
+                'reply_timestamp': reply_match.reply_timestamp,
+                'metadata': reply_match.metadata
             }
             
-            self.logger.info(f"Reply analytics: {analytics_data}")
+            self.logger.info("Reply analytics: %s", _dump_json(analytics_data))
             
         except Exception as e:
             self.logger.error(f"Error storing reply analytics: {e}")
@@ -416,26 +660,53 @@ class SequenceStopper:
             'errors': []
         }
         
+        if not reply_matches:
+            return results
+        
+        # Look up, cancel and update all recipients with a few set-based queries
+        recipient_ids = list(dict.fromkeys(match.recipient_id for match in reply_matches))
+        
+        try:
+            recipients = {recipient.id: recipient for recipient in await self.recipient_repo.get_by_ids(recipient_ids)}
+            found_ids = [recipient_id for recipient_id in recipient_ids if recipient_id in recipients]
+            
+            if self.message_id_cache:
+                for recipient_id in recipient_ids:
+                    self.message_id_cache.invalidate_recipient(recipient_id)
+            
+            # The scheduler also drops the cancelled entries' dispatch jobs
+            if found_ids and scheduler:
+                results['total_cancelled_emails'] = await scheduler.cancel_future_emails_bulk(found_ids)
+            elif found_ids:
+                results['total_cancelled_emails'] = await self.sequence_repo.cancel_future_emails_bulk(found_ids)
+                await self.recipient_repo.update_status_bulk(found_ids, 'replied')
+            
+        except Exception as e:
+            self.logger.error(f"Error stopping sequences for {len(recipient_ids)} recipients: {e}")
+            results['failed_stops'] = len(reply_matches)
+            results['errors'] = [
+                {'recipient_id': match.recipient_id, 'error': str(e)}
+                for match in reply_matches
+            ]
+            return results
+        
         for reply_match in reply_matches:
-            try:
-                result = await self.stop_sequence(reply_match, scheduler)
-                
-                if result.get('error'):
-                    results['failed_stops'] += 1
-                    results['errors'].append({
-                        'recipient_id': reply_match.recipient_id,
-                        'error': result['error']
-                    })
-                else:
-                    results['successful_stops'] += 1
-                    results['total_cancelled_emails'] += result.get('cancelled_emails', 0)
-                    
-            except Exception as e:
+            recipient = recipients.get(reply_match.recipient_id)
+            if not recipient:
                 results['failed_stops'] += 1
                 results['errors'].append({
                     'recipient_id': reply_match.recipient_id,
-                    'error': str(e)
+                    'error': f'Recipient {reply_match.recipient_id} not found'
                 })
+                continue
+            
+            results['successful_stops'] += 1
+            self.logger.info(
+                f"Stopped sequence for {recipient.email} "
+                f"(confidence: {reply_match.confidence.label}, "
+                f"method: {reply_match.matching_method})"
+            )
+            await self._store_reply_analytics(reply_match, recipient)
         
         self.logger.info(f"Bulk sequence stop completed: {results['successful_stops']} successful, {results['failed_stops']} failed")
         
@@ -444,34 +715,26 @@ class SequenceStopper:
     async def get_reply_statistics(self) -> Dict[str, Any]:
         """Get statistics about replies and stopped sequences"""
         try:
-            # Get all replied recipients
-            replied_recipients = await self.recipient_repo.get_all_by_status('replied')
+            # Status counts and the distinct replied companies/roles are computed by the database
+            status_totals, companies_replied, roles_replied = await asyncio.gather(
+                self.recipient_repo.count_by_statuses(['replied', 'active', 'stopped']),
+                self.recipient_repo.distinct_field_by_status('company', 'replied'),
+                self.recipient_repo.distinct_field_by_status('role', 'replied')
+            )
             
             stats = {
-                'total_replies': len(replied_recipients),
+                'total_replies': status_totals['replied'],
                 'reply_rate': 0.0,
-                'companies_replied': set(),
-                'roles_replied': set(),
+                'companies_replied': companies_replied,
+                'roles_replied': roles_replied,
                 'recent_replies': []
             }
             
             # Get total active + replied for rate calculation
-            active_recipients = await self.recipient_repo.get_all_by_status('active')
-            stopped_recipients = await self.recipient_repo.get_all_by_status('stopped')
-            
-            total_contacted = len(replied_recipients) + len(active_recipients) + len(stopped_recipients)
+            total_contacted = sum(status_totals.values())
             
             if total_contacted > 0:
-                stats['reply_rate'] = (len(replied_recipients) / total_contacted) * 100
-            
-            # Analyze replied recipients
-            for recipient in replied_recipients:
-                stats['companies_replied'].add(recipient.company)
-                stats['roles_replied'].add(recipient.role)
-            
-            # Convert sets to lists for JSON serialization
-            stats['companies_replied'] = list(stats['companies_replied'])
-            stats['roles_replied'] = list(stats['roles_replied'])
+                stats['reply_rate'] = (status_totals['replied'] / total_contacted) * 100
             
             return stats
             
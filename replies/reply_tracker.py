@@ -3,21 +3,37 @@ Reply detection and tracking system
 Monitors inbox for replies and manages sequence cancellation
 """
 
+import json
 import logging
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Set
-import re
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+from urllib.parse import quote, urlencode
 
 from auth.graph_auth import GraphAPIClient
-from db.models import RecipientRepository, EmailSequenceRepository
+from db.models import Recipient, EmailSequence, RecipientRepository, EmailSequenceRepository
 from db.database import DatabaseManager
 from config import Config
+from replies.reply_matcher import parse_graph_datetime
+
+
+def _odata_quote(value: str) -> str:
+    """Escape a value for use inside a single-quoted OData string literal"""
+    return value.replace("'", "''")
 
 
 class ReplyTracker:
     """Monitors inbox for replies and manages sequence cancellation"""
     
+    __slots__ = (
+        'config', 'db_manager', 'scheduler', 'logger', 'recipient_repo', 'sequence_repo',
+        'graph_client', '_sender_email', '_inbox_folder_endpoint', '_inbox_endpoint',
+        'check_interval', '_check_interval_seconds', 'last_check_time', 'processed_message_ids',
+        '_dedup_cap', '_persisted_ids_cap', 'known_recipients', '_concurrency',
+        'reply_subject_prefixes', '_reply_prefixes', '_reply_prefix_len'
+    )
+    
     def __init__(self, config: Config, db_manager: DatabaseManager, scheduler=None):
         self.config = config
         self.db_manager = db_manager
@@ -31,26 +47,33 @@ class ReplyTracker:
         # Graph API client will be injected
         self.graph_client: Optional[GraphAPIClient] = None
         
+        # Inbox endpoints, built once
+        self._sender_email = config.sender_email
+        self._inbox_folder_endpoint = f"users/{self._sender_email}/mailFolders/inbox"
+        self._inbox_endpoint = f"{self._inbox_folder_endpoint}/messages"
+        
         # Reply detection settings
         self.check_interval = timedelta(minutes=config.reply_check_interval_minutes)
-        self.last_check_time = datetime.now() - timedelta(hours=1)  # Start with 1 hour ago
+        self._check_interval_seconds = self.check_interval.total_seconds()
+        # High-water mark of receivedDateTime (UTC); only newer messages are fetched
+        self.last_check_time = datetime.now(timezone.utc) - timedelta(hours=1)  # Start with 1 hour ago
         
         # Tracking data
-        self.processed_message_ids: Set[str] = set()
+        # Processed message IDs in insertion order; the oldest half is evicted past the cap
+        self.processed_message_ids: OrderedDict[str, None] = OrderedDict()
+        self._dedup_cap = 100_000
         self.known_recipients: Dict[str, int] = {}  # email -> recipient_id mapping
         
-        # Reply detection patterns
-        self.reply_subject_patterns = [
-            r'^RE:\s*',
-            r'^Re:\s*',
-            r'^re:\s*',
-            r'^FW:\s*',
-            r'^Fw:\s*',
-            r'^fw:\s*',
-            r'^FWD:\s*',
-            r'^Fwd:\s*',
-            r'^fwd:\s*'
-        ]
+        # Most recent processed IDs saved across restarts; older ones fall behind last_check_time anyway
+        self._persisted_ids_cap = 1000
+        
+        # Limits how many messages are processed at once so a scan doesn't flood the database
+        self._concurrency = asyncio.Semaphore(10)
+        
+        # Reply detection prefixes, checked as lower-cased 'prefix:' literals
+        self.reply_subject_prefixes = ('re', 'fw', 'fwd')
+        self._reply_prefixes = tuple(f"{prefix}:" for prefix in self.reply_subject_prefixes)
+        self._reply_prefix_len = max(map(len, self._reply_prefixes))
         
         self.logger.info("Reply tracker initialized")
     
@@ -66,18 +89,30 @@ class ReplyTracker:
         """Start the reply monitoring loop"""
         self.logger.info("Starting reply monitoring")
         
+        # Resume from where the previous run stopped
+        await self._load_state()
+        
         # Load known recipients
         await self._load_known_recipients()
         
-        # Start monitoring loop
+        # Start monitoring loop on a fixed cadence, so slow scans don't push later ones back
+        loop = asyncio.get_running_loop()
+        interval = self._check_interval_seconds
+        next_wake = loop.time()
+        
         while True:
             try:
                 await self.scan_inbox()
-                await asyncio.sleep(self.check_interval.total_seconds())
                 
             except Exception as e:
                 self.logger.error(f"Error in reply monitoring loop: {e}")
-                await asyncio.sleep(60)  # Wait 1 minute before retrying
+            
+            # Skip any slots missed during a long scan instead of running them back to back
+            next_wake += interval
+            now = loop.time()
+            if next_wake < now:
+                next_wake = now + ((next_wake - now) % interval if interval else 0)
+            await asyncio.sleep(next_wake - now)
     
     async def scan_inbox(self):
         """Scan inbox for new replies"""
@@ -86,59 +121,125 @@ class ReplyTracker:
                 self.logger.error("Graph API client not configured")
                 return
             
-            # Get messages since last check
-            messages = await self._get_recent_messages()
+            # Start processing each page of messages while the next one is fetched
+            tasks = []
+            received_times = []
+            complete = False
+            try:
+                async for page in self._iter_recent_message_pages():
+                    tasks.extend(await self._start_page_tasks(page))
+                    received_times.extend(received for received in map(self._parse_received, page) if received)
+                complete = True
+            except Exception as e:
+                self.logger.error(f"Error retrieving recent messages: {e}")
             
-            if not messages:
+            if not tasks:
                 self.logger.debug("No new messages found")
                 return
             
-            self.logger.info(f"Scanning {len(messages)} messages for replies")
+            self.logger.info(f"Scanning {len(tasks)} messages for replies")
             
-            # Process each message
-            replies_found = 0
-            for message in messages:
-                if await self._process_message(message):
-                    replies_found += 1
+            # Each task handles its own errors
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            replies_found = sum(1 for result in results if result is True)
             
             if replies_found > 0:
                 self.logger.info(f"Detected {replies_found} replies")
             
-            # Update last check time
-            self.last_check_time = datetime.now()
+            # Advance to the newest message seen, so the next scan only fetches later ones; pages
+            # are unordered, so after a failed page the window is rescanned and deduplicated instead
+            if complete:
+                self.last_check_time = max([self.last_check_time, *received_times])
+            
+            await self._save_state()
             
         except Exception as e:
             self.logger.error(f"Error scanning inbox: {e}")
     
-    async def _get_recent_messages(self) -> List[Dict[str, Any]]:
-        """Get messages from inbox since last check"""
+    async def _start_page_tasks(self, messages: List[Dict[str, Any]]) -> List[asyncio.Task]:
+        """Prefetch a page's lookups in two bulk queries and start processing its messages"""
+        new_messages = [m for m in messages if m.get('id') not in self.processed_message_ids]
+        in_reply_to_ids = [m['inReplyTo'] for m in new_messages if m.get('inReplyTo')]
+        # Senders already in known_recipients resolve from memory, so only look up the rest
+        from_addresses = {self._extract_email_address(m.get('from', {})) for m in new_messages}
+        from_addresses.difference_update(self.known_recipients)
+        from_addresses.discard(None)
+        from_addresses.discard('')
+        
+        sequences = await self.sequence_repo.get_by_message_ids(in_reply_to_ids) if in_reply_to_ids else {}
+        recipients = await self.recipient_repo.get_by_emails(list(from_addresses)) if from_addresses else {}
+        
+        return [
+            asyncio.create_task(self._process_message(message, sequences, recipients))
+            for message in messages
+        ]
+    
+    async def _load_state(self):
+        """Restore last_check_time and recent processed message IDs saved by a previous run"""
         try:
-            # Format datetime for Graph API
-            since_time = self.last_check_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-            
-            # Query parameters
-            params = {
-                '$filter': f"receivedDateTime ge {since_time}",
-                '$select': 'id,subject,from,toRecipients,receivedDateTime,conversationId,internetMessageId,inReplyTo',
-                '$orderby': 'receivedDateTime desc',
-                '$top': 100  # Limit to prevent overwhelming
-            }
+            last_check = await self.db_manager.get_state('reply_tracker.last_check')
+            if last_check:
+                self.last_check_time = datetime.fromisoformat(last_check)
             
-            # Get messages from inbox
-            endpoint = f"users/{self.config.sender_email}/mailFolders/inbox/messages"
-            response = await self.graph_client.get(endpoint, params)
+            processed = await self.db_manager.get_state('reply_tracker.processed')
+            if processed:
+                for message_id in json.loads(processed):
+                    self._mark_processed(message_id)
             
-            messages = response.get('value', [])
+            self.logger.info(f"Resuming reply monitoring from {self.last_check_time.isoformat()}")
             
-            self.logger.debug(f"Retrieved {len(messages)} messages since {since_time}")
-            return messages
+        except Exception as e:
+            self.logger.error(f"Error loading reply tracker state: {e}")
+    
+    async def _save_state(self):
+        """Persist last_check_time and the most recent processed message IDs"""
+        try:
+            recent_ids = list(self.processed_message_ids)[-self._persisted_ids_cap:]
+            await self.db_manager.set_state('reply_tracker.last_check', self.last_check_time.isoformat())
+            await self.db_manager.set_state('reply_tracker.processed', json.dumps(recent_ids))
             
         except Exception as e:
-            self.logger.error(f"Error retrieving recent messages: {e}")
-            return []
+            self.logger.error(f"Error saving reply tracker state: {e}")
+    
+    def _recent_messages_query(self) -> Tuple[str, Dict[str, Any]]:
+        """Build the inbox endpoint and query parameters for messages since last check"""
+        # Format datetime for Graph API
+        since_time = self.last_check_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+        
+        # Query parameters
+        params = {
+            '$filter': f"receivedDateTime gt {since_time}",
+            '$select': 'id,subject,from,toRecipients,receivedDateTime,conversationId,internetMessageId,inReplyTo',
+            '$top': 100  # Page size; later pages are followed via @odata.nextLink
+        }
+        
+        return self._inbox_endpoint, params
+    
+    async def _iter_recent_message_pages(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield pages of inbox messages since last check, following @odata.nextLink"""
+        # Without a server-side sort every page is read, so the last_check_time
+        # high-water mark can't skip an unread page
+        endpoint, params = self._recent_messages_query()
+        response = await self.graph_client.get(endpoint, params)
+        retrieved = 0
+        
+        while True:
+            messages = response.get('value', [])
+            retrieved += len(messages)
+            if messages:
+                yield messages
+            
+            next_link = response.get('@odata.nextLink')
+            if not next_link:
+                break
+            response = await self.graph_client.get(next_link.removeprefix(self.graph_client.base_url))
+        
+        self.logger.debug(f"Retrieved {retrieved} messages since {params['$filter']}")
     
-    async def _process_message(self, message: Dict[str, Any]) -> bool:
-        """Process a single message to check if it's a reply"""
+    async def _process_message(self, message: Dict[str, Any],
+                               sequences: Optional[Dict[str, EmailSequence]] = None,
+                               recipients: Optional[Dict[str, Recipient]] = None) -> bool:
+        """Process a single message to check if it's a reply, using prefetched lookups when given"""
         try:
             message_id = message.get('id')
             
@@ -147,17 +248,21 @@ class ReplyTracker:
                 return False
             
             # Mark as processed
-            self.processed_message_ids.add(message_id)
+            self._mark_processed(message_id)
             
-            # Check if this is a reply
-            if await self._is_reply_message(message):
-                # Identify the recipient who replied
-                recipient_id = await self._identify_replying_recipient(message)
-                
-                if recipient_id:
-                    # Handle the reply
-                    await self._handle_reply(recipient_id, message)
-                    return True
+            # Parse the sender once for every check below
+            from_address = self._extract_email_address(message.get('from', {}))
+            
+            async with self._concurrency:
+                # Check if this is a reply
+                if await self._is_reply_message(message, sequences, from_address):
+                    # Identify the recipient who replied
+                    recipient_id = await self._identify_replying_recipient(from_address, recipients)
+                    
+                    if recipient_id:
+                        # Handle the reply
+                        await self._handle_reply(recipient_id, message, from_address)
+                        return True
             
             return False
             
@@ -165,55 +270,70 @@ class ReplyTracker:
             self.logger.error(f"Error processing message {message.get('id', 'unknown')}: {e}")
             return False
     
-    async def _is_reply_message(self, message: Dict[str, Any]) -> bool:
+    def _mark_processed(self, message_id: str):
+        """Record a processed message ID, evicting the oldest half once over the cap"""
+        self.processed_message_ids[message_id] = None
+        
+        if len(self.processed_message_ids) > self._dedup_cap:
+            for _ in range(self._dedup_cap // 2):
+                self.processed_message_ids.popitem(last=False)
+    
+    async def _is_reply_message(self, message: Dict[str, Any],
+                                sequences: Optional[Dict[str, EmailSequence]] = None,
+                                from_address: Optional[str] = None) -> bool:
         """Determine if a message is a reply to our emails"""
         try:
-            # Check 1: inReplyTo field
+            # Checks run cheapest first: dict lookup, prefix test, then the inReplyTo lookup
+            # Check 1: From address is a known recipient
+            if from_address is None:
+                from_address = self._extract_email_address(message.get('from', {}))
+            if from_address and from_address in self.known_recipients:
+                self.logger.debug(f"Reply detected from known recipient: {from_address}")
+                return True
+            
+            # Check 2: Subject line patterns
+            subject = message.get('subject') or ''
+            if subject[:self._reply_prefix_len].lower().startswith(self._reply_prefixes):
+                self.logger.debug(f"Reply detected via subject pattern: {subject}")
+                return True
+            
+            # Check 3: inReplyTo field
             in_reply_to = message.get('inReplyTo')
             if in_reply_to:
                 # Check if this is a reply to one of our sent messages
-                sequence = await self.sequence_repo.get_by_message_id(in_reply_to)
+                if sequences is not None:
+                    sequence = sequences.get(in_reply_to)
+                else:
+                    sequence = await self.sequence_repo.get_by_message_id(in_reply_to)
                 if sequence:
                     self.logger.debug(f"Reply detected via inReplyTo field: {in_reply_to}")
                     return True
             
-            # Check 2: Subject line patterns
-            subject = message.get('subject', '')
-            for pattern in self.reply_subject_patterns:
-                if re.match(pattern, subject, re.IGNORECASE):
-                    self.logger.debug(f"Reply detected via subject pattern: {subject}")
-                    return True
-            
-            # Check 3: From address is a known recipient
-            from_address = self._extract_email_address(message.get('from', {}))
-            if from_address and from_address in self.known_recipients:
-                self.logger.debug(f"Reply detected from known recipient: {from_address}")
-                return True
-            
             return False
             
         except Exception as e:
             self.logger.error(f"Error checking if message is reply: {e}")
             return False
     
-    async def _identify_replying_recipient(self, message: Dict[str, Any]) -> Optional[int]:
-        """Identify which recipient sent the reply"""
+    async def _identify_replying_recipient(self, from_address: Optional[str],
+                                           recipients: Optional[Dict[str, Recipient]] = None) -> Optional[int]:
+        """Identify which recipient sent the reply from its (lower-cased) sender address"""
         try:
-            # Get sender email address
-            from_address = self._extract_email_address(message.get('from', {}))
-            
             if not from_address:
                 return None
             
             # Look up recipient ID
-            recipient_id = self.known_recipients.get(from_address.lower())
+            recipient_id = self.known_recipients.get(from_address)
             
             if not recipient_id:
-                # Try to find in database (in case cache is stale)
-                recipient = await self.recipient_repo.get_by_email(from_address)
+                # Try the prefetched recipients, else the database (in case cache is stale)
+                if recipients is not None:
+                    recipient = recipients.get(from_address)
+                else:
+                    recipient = await self.recipient_repo.get_by_email(from_address)
                 if recipient:
                     recipient_id = recipient.id
-                    self.known_recipients[from_address.lower()] = recipient_id
+                    self.known_recipients[from_address] = recipient_id
             
             return recipient_id
             
@@ -221,7 +341,12 @@ class ReplyTracker:
             self.logger.error(f"Error identifying replying recipient: {e}")
             return None
     
-    def _extract_email_address(self, from_field: Dict[str, Any]) -> Optional[str]:
+    def _parse_received(self, message: Dict[str, Any]) -> Optional[datetime]:
+        """Parse a message's receivedDateTime as a timezone-aware UTC datetime"""
+        return parse_graph_datetime(message.get('receivedDateTime'))
+    
+    @staticmethod
+    def _extract_email_address(from_field: Dict[str, Any]) -> Optional[str]:
         """Extract email address from Graph API from field"""
         try:
             email_address = from_field.get('emailAddress', {})
@@ -229,7 +354,7 @@ class ReplyTracker:
         except Exception:
             return None
     
-    async def _handle_reply(self, recipient_id: int, message: Dict[str, Any]):
+    async def _handle_reply(self, recipient_id: int, message: Dict[str, Any], from_address: Optional[str]):
         """Handle a detected reply"""
         try:
             # Get recipient info
@@ -239,28 +364,34 @@ class ReplyTracker:
                 return
             
             # Log the reply
-            from_address = self._extract_email_address(message.get('from', {}))
             subject = message.get('subject', '')
             received_time = message.get('receivedDateTime', '')
             
             self.logger.info(f"Reply detected from {from_address} (recipient {recipient_id}): {subject}")
             
+            # Store reply information (optional: for analytics) alongside the cancellation
+            store_info = self._store_reply_info(recipient_id, message, from_address, subject, received_time)
+            
             # Cancel future emails for this recipient
             if self.scheduler:
-                cancelled_count = await self.scheduler.cancel_future_emails(recipient_id)
+                cancelled_count, _ = await asyncio.gather(
+                    self.scheduler.cancel_future_emails(recipient_id),
+                    store_info
+                )
                 self.logger.info(f"Cancelled {cancelled_count} future emails for recipient {recipient_id}")
             else:
                 # Fallback: cancel directly via repository
-                await self.sequence_repo.mark_replied(recipient_id)
-                await self.recipient_repo.update_status(recipient_id, 'replied')
-            
-            # Store reply information (optional: for analytics)
-            await self._store_reply_info(recipient_id, message)
+                await asyncio.gather(
+                    self.sequence_repo.mark_replied(recipient_id),
+                    self.recipient_repo.update_status(recipient_id, 'replied'),
+                    store_info
+                )
             
         except Exception as e:
             self.logger.error(f"Error handling reply from recipient {recipient_id}: {e}")
     
-    async def _store_reply_info(self, recipient_id: int, message: Dict[str, Any]):
+    async def _store_reply_info(self, recipient_id: int, message: Dict[str, Any], from_address: Optional[str],
+                                subject: str, received_time: str):
         """Store reply information for analytics (optional)"""
         try:
             # This could be expanded to store detailed reply analytics
@@ -268,8 +399,9 @@ class ReplyTracker:
             reply_info = {
                 'recipient_id': recipient_id,
                 'message_id': message.get('id'),
-                'subject': message.get('subject', ''),
-                'received_at': message.get('receivedDateTime', ''),
+                'from_address': from_address,
+                'subject': subject,
+                'received_at': received_time,
                 'conversation_id': message.get('conversationId', '')
             }
             
@@ -281,12 +413,8 @@ class ReplyTracker:
     async def _load_known_recipients(self):
         """Load known recipients into memory for faster lookup"""
         try:
-            # Get all active recipients
-            active_recipients = await self.recipient_repo.get_all_by_status('active')
-            
-            # Build email -> recipient_id mapping
-            for recipient in active_recipients:
-                self.known_recipients[recipient.email.lower()] = recipient.id
+            # Build email -> recipient_id mapping straight from (lower(email), id) rows
+            self.known_recipients.update(await self.recipient_repo.get_active_email_id_pairs())
             
             self.logger.info(f"Loaded {len(self.known_recipients)} known recipients")
             
@@ -303,14 +431,13 @@ class ReplyTracker:
         try:
             # Get recent messages from this sender
             params = {
-                '$filter': f"from/emailAddress/address eq '{recipient_email}'",
+                '$filter': f"from/emailAddress/address eq '{_odata_quote(recipient_email)}'",
                 '$select': 'id,subject,from,receivedDateTime,inReplyTo',
                 '$orderby': 'receivedDateTime desc',
                 '$top': 10
             }
             
-            endpoint = f"users/{self.config.sender_email}/mailFolders/inbox/messages"
-            response = await self.graph_client.get(endpoint, params)
+            response = await self.graph_client.get(self._inbox_endpoint, params)
             
             messages = response.get('value', [])
             
@@ -349,7 +476,8 @@ class ReplyTracker:
             'check_interval_minutes': self.config.reply_check_interval_minutes,
             'known_recipients_count': len(self.known_recipients),
             'processed_messages_count': len(self.processed_message_ids),
-            'reply_patterns_count': len(self.reply_subject_patterns)
+            'processed_messages_cap': self._dedup_cap,
+            'reply_patterns_count': len(self.reply_subject_prefixes)
         }
     
     async def test_reply_detection(self) -> Dict[str, Any]:
@@ -368,16 +496,23 @@ class ReplyTracker:
                 test_result['error'] = 'Graph API client not configured'
                 return test_result
             
-            # Test basic connectivity
+            # Test inbox access and message retrieval in one $batch round-trip
             try:
-                endpoint = f"users/{self.config.sender_email}/mailFolders/inbox"
-                response = await self.graph_client.get(endpoint)
+                endpoint, params = self._recent_messages_query()
+                inbox_response, messages_response = await self.graph_client.batch([
+                    {'url': f"/{self._inbox_folder_endpoint}"},
+                    {'url': f"/{endpoint}?{urlencode(params, safe='$,:', quote_via=quote)}"}
+                ])
                 test_result['graph_api_connected'] = True
-                test_result['inbox_accessible'] = True
+                test_result['inbox_accessible'] = inbox_response.get('status') == 200
                 
-                # Test message retrieval
-                messages = await self._get_recent_messages()
-                test_result['recent_messages_count'] = len(messages)
+                if messages_response.get('status') == 200:
+                    messages = messages_response.get('body', {}).get('value', [])
+                    test_result['recent_messages_count'] = len(messages)
+                else:
+                    failed = messages_response if test_result['inbox_accessible'] else inbox_response
+                    error = failed.get('body', {}).get('error', {})
+                    test_result['error'] = error.get('message') or f"HTTP {failed.get('status')}"
                 
             except Exception as e:
                 test_result['error'] = str(e)
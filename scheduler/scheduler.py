@@ -6,19 +6,33 @@ Manages timing and execution of email sequences
 import logging
 import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Set, Tuple
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.executors.asyncio import AsyncIOExecutor
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.job import Job
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 
 from config import Config
 from db.database import DatabaseManager
 from db.models import Recipient, EmailSequence, RecipientRepository, EmailSequenceRepository
+from db.batcher import MarkSentBatcher
 from email.sender import EmailSender
 from utils.rate_limiter import AdaptiveRateLimiter
 
+# In-memory job store for per-sequence dispatch jobs; the database stays the source of
+# truth and the jobs are re-armed from it on start
+DISPATCH_JOBSTORE = 'dispatch'
+
+# app_state key recording that the missing follow-up backfill has run
+FOLLOW_UPS_BACKFILLED_KEY = 'scheduler.follow_ups_backfilled'
+
+
+def _as_datetime(value) -> datetime:
+    """Convert a scheduled_at value read back from SQLite to a datetime"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
 
 class SequenceScheduler:
     """Manages email sequence scheduling and execution"""
@@ -32,11 +46,41 @@ class SequenceScheduler:
         self.recipient_repo = RecipientRepository(db_manager)
         self.sequence_repo = EmailSequenceRepository(db_manager)
         
+        # Concurrent sends record their results in group commits
+        self._sent_batcher = MarkSentBatcher(self.sequence_repo)
+        
         # Initialize rate limiter
-        self.rate_limiter = AdaptiveRateLimiter(config)
+        self.rate_limiter = AdaptiveRateLimiter(config, config.rate_limiter_mode)
+        
+        # Email sender will be injected with set_email_sender() before start()
+        self.email_sender: EmailSender = None
+        
+        # How often sequences created outside the scheduler are picked up, how long a
+        # sequence that couldn't be sent waits before its next attempt, and how long
+        # finished sequences are kept
+        self.sync_interval = timedelta(minutes=15)
+        self.retry_delay = timedelta(minutes=1)
+        self.claim_timeout = timedelta(minutes=5)
+        
+        # No more than the per-minute limit allows can go out before the next sync, so
+        # each sync reads at most that many unarmed due entries
+        self.sync_batch_size = config.rate_limit_per_minute * int(self.sync_interval.total_seconds() // 60)
+        
+        self.sequence_retention = timedelta(days=config.sequence_retention_days)
+        
+        # Whole sequence as (step, delay after the previous step), created up front
+        self.sequence_steps: List[Tuple[int, timedelta]] = [(1, timedelta(seconds=30))]
+        self.sequence_steps.append((2, timedelta(days=config.follow_up_1_delay_days)))
+        if config.follow_up_2_enabled:
+            self.sequence_steps.append((3, timedelta(days=config.follow_up_2_delay_days)))
+        self._step_delays: Dict[int, timedelta] = dict(self.sequence_steps)
+        
+        # Bounds how many sends overlap across dispatch jobs
+        self._send_slots = asyncio.Semaphore(config.max_concurrent_sends)
         
-        # Email sender will be injected
-        self.email_sender: Optional[EmailSender] = None
+        # Tracked alongside the job stores so status reads don't walk every job
+        self._periodic_jobs: List[Job] = []
+        self._armed_sequences: Set[int] = set()
         
         # Configure APScheduler
         self._setup_scheduler()
@@ -44,10 +88,14 @@ class SequenceScheduler:
         self.logger.info("Email sequence scheduler initialized")
     
     def _setup_scheduler(self):
-        """Configure APScheduler with persistence"""
-        # Job store configuration (using SQLite for persistence)
+        """Configure APScheduler"""
+        # In-memory job stores: a database-backed store would do blocking I/O on the
+        # event loop for every add_job/remove_job, and every job is rebuilt on start
+        # (periodic tasks here, dispatch jobs from email_sequence)
+        self._dispatch_store = MemoryJobStore()
         jobstores = {
-            'default': SQLAlchemyJobStore(url=self.config.database_url, tablename='scheduler_jobs')
+            'default': MemoryJobStore(),
+            DISPATCH_JOBSTORE: self._dispatch_store
         }
         
         # Executor configuration
@@ -73,6 +121,7 @@ class SequenceScheduler:
         # Add event listeners
         self.scheduler.add_listener(self._job_executed, EVENT_JOB_EXECUTED)
         self.scheduler.add_listener(self._job_error, EVENT_JOB_ERROR)
+        self.scheduler.add_listener(self._job_missed, EVENT_JOB_MISSED)
     
     def set_email_sender(self, email_sender: EmailSender):
         """Set the email sender instance"""
@@ -81,6 +130,10 @@ class SequenceScheduler:
     def start(self):
         """Start the scheduler"""
         try:
+            # Checked once here so sends don't have to
+            if self.email_sender is None:
+                raise RuntimeError("set_email_sender() must be called before start()")
+            
             self.scheduler.start()
             self.logger.info("Email sequence scheduler started")
             
@@ -99,26 +152,62 @@ class SequenceScheduler:
         except Exception as e:
             self.logger.error(f"Error shutting down scheduler: {e}")
     
+    async def close_sent_batcher(self):
+        """Flush and stop the batcher recording sent emails"""
+        await self._sent_batcher.close()
+    
     def _schedule_periodic_tasks(self):
         """Schedule recurring tasks"""
-        # Process due emails every minute
-        self.scheduler.add_job(
-            self.process_due_emails,
+        # Arm dispatch jobs for pending sequences now, then periodically pick up any
+        # created outside the scheduler; sends themselves run from per-sequence jobs.
+        # Periodic jobs touch shared tables, so a slow or missed run never overlaps
+        # with or queues up behind another one
+        sync_job = self.scheduler.add_job(
+            self._sync_sequence_jobs,
             'interval',
-            minutes=1,
-            id='process_due_emails',
-            replace_existing=True
+            seconds=self.sync_interval.total_seconds(),
+            next_run_time=datetime.now().astimezone(),
+            id='sync_sequence_jobs',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
         )
         
         # Cleanup old jobs daily
-        self.scheduler.add_job(
+        cleanup_job = self.scheduler.add_job(
             self._cleanup_old_jobs,
             'cron',
             hour=2,  # 2 AM daily
             id='cleanup_old_jobs',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        
+        self._periodic_jobs = [sync_job, cleanup_job]
+        
+        # Give recipients whose sequences predate up-front scheduling their remaining
+        # steps; runs once per database, recorded in app_state
+        self.scheduler.add_job(
+            self._create_missing_follow_ups,
+            next_run_time=datetime.now().astimezone(),
+            id='create_missing_follow_ups',
             replace_existing=True
         )
     
+    def _plan_sequence(self, recipient_id: Optional[int] = None) -> List[EmailSequence]:
+        """Build every step of a sequence starting now; each entry is only sent once the ones before it have been"""
+        sequences = []
+        step_time = datetime.now()
+        for step, delay in self.sequence_steps:
+            step_time += delay
+            sequences.append(EmailSequence(
+                recipient_id=recipient_id,
+                step=step,
+                scheduled_at=step_time
+            ))
+        return sequences
+    
     async def schedule_initial_email(self, recipient_id: int) -> bool:
         """Schedule the initial email for a recipient"""
         try:
@@ -128,20 +217,11 @@ class SequenceScheduler:
                 self.logger.error(f"Recipient {recipient_id} not found")
                 return False
             
-            # Schedule immediately (or with small delay)
-            scheduled_time = datetime.now() + timedelta(seconds=30)
-            
-            # Create email sequence entry
-            sequence = EmailSequence(
-                recipient_id=recipient_id,
-                step=1,
-                scheduled_at=scheduled_time
-            )
-            
-            sequence_id = await self.sequence_repo.create(sequence)
-            
-            # Update recipient status to active
-            await self.recipient_repo.update_status(recipient_id, 'active')
+            # Create the sequence and mark the recipient active in one transaction
+            sequences = self._plan_sequence(recipient_id)
+            sequence_ids = await self.sequence_repo.create_many_and_activate(sequences)
+            scheduled_time = sequences[0].scheduled_at
+            self._arm_sequence(sequence_ids[0], scheduled_time)
             
             self.logger.info(f"Scheduled initial email for recipient {recipient_id} at {scheduled_time}")
             return True
@@ -150,129 +230,204 @@ class SequenceScheduler:
             self.logger.error(f"Failed to schedule initial email for recipient {recipient_id}: {e}")
             return False
     
-    async def schedule_follow_up(self, recipient_id: int, step: int, delay_days: int) -> bool:
-        """Schedule a follow-up email"""
+    def _arm_sequence(self, sequence_id: int, run_at: datetime):
+        """Schedule a one-off job that sends a sequence entry at its scheduled time"""
+        self.scheduler.add_job(
+            self._dispatch_sequence,
+            'date',
+            run_date=run_at.astimezone(),  # scheduled_at is naive local time
+            args=[sequence_id],
+            id=f"seq:{sequence_id}",
+            jobstore=DISPATCH_JOBSTORE,
+            replace_existing=True,
+            misfire_grace_time=300
+        )
+        self._armed_sequences.add(sequence_id)
+    
+    def _disarm_sequence(self, sequence_id: int):
+        """Remove a sequence entry's dispatch job if it has one"""
+        if self.scheduler.get_job(f"seq:{sequence_id}", DISPATCH_JOBSTORE):
+            self.scheduler.remove_job(f"seq:{sequence_id}", DISPATCH_JOBSTORE)
+        self._armed_sequences.discard(sequence_id)
+    
+    async def _sync_sequence_jobs(self):
+        """Arm dispatch jobs for sequences due before the next sync that don't have one"""
         try:
-            # Calculate scheduled time
-            scheduled_time = datetime.now() + timedelta(days=delay_days)
+            now = datetime.now()
             
-            # Create email sequence entry
-            sequence = EmailSequence(
-                recipient_id=recipient_id,
-                step=step,
-                scheduled_at=scheduled_time
+            # Already armed entries come back too, so leave room for them on top of the batch
+            upcoming = await self.sequence_repo.get_due_emails(
+                now + self.sync_interval, limit=len(self._armed_sequences) + self.sync_batch_size
             )
             
-            sequence_id = await self.sequence_repo.create(sequence)
-            
-            self.logger.info(f"Scheduled follow-up email step {step} for recipient {recipient_id} at {scheduled_time}")
-            return True
+            unarmed = [sequence for sequence in upcoming
+                       if not self.scheduler.get_job(f"seq:{sequence.id}", DISPATCH_JOBSTORE)]
+            
+            # Only run as many overdue entries now as the limits have room for; the rest
+            # wait a retry delay instead of each reading, claiming and re-arming itself
+            overdue = sum(1 for sequence in unarmed if _as_datetime(sequence.scheduled_at) <= now)
+            budget = await self.rate_limiter.can_send_email_bulk(overdue) if overdue else 0
+            
+            armed = 0
+            for sequence in unarmed:
+                scheduled_at = _as_datetime(sequence.scheduled_at)
+                if scheduled_at <= now:
+                    if budget > 0:
+                        budget -= 1
+                        scheduled_at = now
+                    else:
+                        scheduled_at = now + self.retry_delay
+                self._arm_sequence(sequence.id, scheduled_at)
+                armed += 1
+            
+            if armed:
+                self.logger.info(f"Armed dispatch jobs for {armed} pending emails")
             
         except Exception as e:
-            self.logger.error(f"Failed to schedule follow-up step {step} for recipient {recipient_id}: {e}")
-            return False
+            self.logger.error(f"Error syncing sequence jobs: {e}")
     
-    async def process_due_emails(self):
-        """Process all emails that are due to be sent"""
+    async def _dispatch_sequence(self, sequence_id: int):
+        """Send one sequence entry when its dispatch job fires"""
+        # The fired date job is gone; anything below that retries re-arms it
+        self._armed_sequences.discard(sequence_id)
+        
         try:
-            # Get due emails
-            due_emails = await self.sequence_repo.get_due_emails()
+            # The recipient comes back in the same query, so a send costs one read
+            ready = await self.sequence_repo.get_ready_by_id(sequence_id)
             
-            if not due_emails:
+            # Cancelled, or an earlier step is still unsent (the sync re-arms it once
+            # that's gone out)
+            if not ready:
                 return
             
-            self.logger.info(f"Processing {len(due_emails)} due emails")
+            # Already sent or replied since the job was armed
+            sequence, recipient = ready
+            if sequence.sent_at or sequence.replied:
+                return
+            
+            # Rescheduled later since the job was armed
+            scheduled_at = _as_datetime(sequence.scheduled_at)
+            if scheduled_at > datetime.now():
+                self._arm_sequence(sequence_id, scheduled_at)
+                return
             
-            # Process each email
-            for sequence in due_emails:
-                await self._process_single_email(sequence)
+            await self._process_single_email(sequence, recipient)
             
         except Exception as e:
-            self.logger.error(f"Error processing due emails: {e}")
+            self.logger.error(f"Error dispatching email sequence {sequence_id}: {e}")
     
-    async def _process_single_email(self, sequence: EmailSequence):
+    async def _process_single_email(self, sequence: EmailSequence, recipient: Recipient):
         """Process a single email sequence"""
+        # Skip claiming when the limits are already used up; the send itself is only
+        # counted when it's reserved right before going out
+        if not await self.rate_limiter.can_send_email():
+            self.logger.info("Rate limit reached, retrying email sequence %s later", sequence.id)
+            self._arm_sequence(sequence.id, datetime.now() + self.retry_delay)
+            return
+        
+        # Another scheduler is already sending it
+        if not await self.sequence_repo.claim(sequence.id, datetime.now() - self.claim_timeout):
+            self.logger.debug("Email sequence %s already claimed, skipping", sequence.id)
+            return
+        
+        await self._send_with_slot(sequence, recipient)
+    
+    async def _send_with_slot(self, sequence: EmailSequence, recipient: Recipient):
+        """Send a claimed sequence entry's email once a send slot is free"""
+        async with self._send_slots:
+            sent = await self._send_sequence_email(sequence, recipient)
+        
+        # Let the retry claim it again without waiting for the claim to go stale
+        if not sent:
+            await self.sequence_repo.release_claim(sequence.id)
+    
+    async def _send_sequence_email(self, sequence: EmailSequence, recipient: Recipient) -> bool:
+        """Send a sequence entry's email and record the result, returning whether it was sent"""
         try:
-            # Check rate limits
-            if not await self.rate_limiter.can_send_email():
-                self.logger.info(f"Rate limit reached, skipping email sequence {sequence.id}")
-                return
-            
-            # Get recipient
-            recipient = await self.recipient_repo.get_by_id(sequence.recipient_id)
-            if not recipient:
-                self.logger.error(f"Recipient {sequence.recipient_id} not found for sequence {sequence.id}")
-                return
-            
             # Check if recipient is still active (not replied or stopped)
             if recipient.status in ['replied', 'stopped']:
-                self.logger.info(f"Skipping email for recipient {recipient.id} (status: {recipient.status})")
-                return
+                self.logger.info("Skipping email for recipient %s (status: %s)", recipient.id, recipient.status)
+                return False
+            
+            # Count the send against the limits before it goes out; checking earlier and
+            # recording after the Graph call would let every concurrent send pass the check
+            if not await self.rate_limiter.reserve_send():
+                self.logger.info("Rate limit reached, retrying email sequence %s later", sequence.id)
+                self._arm_sequence(sequence.id, datetime.now() + self.retry_delay)
+                return False
             
             # Send email
-            if self.email_sender:
-                result = await self.email_sender.send_email(recipient, sequence.step)
+            result = await self.email_sender.send_email(recipient, sequence.step)
+            
+            if result['success']:
+                # Mark as sent and keep the next step's delay after this send, in one commit
+                next_delay = self._step_delays.get(sequence.step + 1)
+                await self._sent_batcher.submit(
+                    sequence.id,
+                    result['message_id'],
+                    result['sent_at'],
+                    result['sent_at'] + next_delay if next_delay else None
+                )
+                
+                # Record rate limiting
+                await self.rate_limiter.record_send_result(True, reserved=True)
+                
+                self.logger.info("Successfully sent email step %s to %s", sequence.step, recipient.email)
+                return True
                 
-                if result['success']:
-                    # Mark as sent
-                    await self.sequence_repo.mark_sent(
-                        sequence.id,
-                        result['message_id'],
-                        result['sent_at']
-                    )
-                    
-                    # Record rate limiting
-                    await self.rate_limiter.record_send_result(True)
-                    
-                    # Schedule next follow-up if applicable
-                    await self._schedule_next_follow_up(recipient.id, sequence.step)
-                    
-                    self.logger.info(f"Successfully sent email step {sequence.step} to {recipient.email}")
-                    
-                else:
-                    # Record failure
-                    await self.rate_limiter.record_send_result(False, result.get('error', ''))
-                    self.logger.error(f"Failed to send email step {sequence.step} to {recipient.email}: {result.get('error')}")
-            
             else:
-                self.logger.error("Email sender not configured")
+                # Record failure and retry later
+                await self.rate_limiter.record_send_result(False, result.get('error', ''), reserved=True)
+                self.logger.error(f"Failed to send email step {sequence.step} to {recipient.email}: {result.get('error')}")
+                self._arm_sequence(sequence.id, datetime.now() + self.retry_delay)
         
         except Exception as e:
             self.logger.error(f"Error processing email sequence {sequence.id}: {e}")
+        
+        return False
     
-    async def _schedule_next_follow_up(self, recipient_id: int, current_step: int):
-        """Schedule the next follow-up email in the sequence"""
+    async def _create_missing_follow_ups(self):
+        """Create the remaining steps for sequences started before they were created up front"""
         try:
-            next_step = current_step + 1
+            if await self.db_manager.get_state(FOLLOW_UPS_BACKFILLED_KEY):
+                return
             
-            if next_step == 2:
-                # Schedule follow-up 1
-                delay_days = self.config.follow_up_1_delay_days
-                await self.schedule_follow_up(recipient_id, next_step, delay_days)
-                
-            elif next_step == 3 and self.config.follow_up_2_enabled:
-                # Schedule follow-up 2 if enabled
-                delay_days = self.config.follow_up_2_delay_days
-                await self.schedule_follow_up(recipient_id, next_step, delay_days)
+            for (step, _), (_, delay) in zip(self.sequence_steps, self.sequence_steps[1:]):
+                await self.sequence_repo.create_missing_next_steps(step, delay)
+            
+            await self.db_manager.set_state(FOLLOW_UPS_BACKFILLED_KEY, datetime.now().isoformat())
             
         except Exception as e:
-            self.logger.error(f"Error scheduling next follow-up for recipient {recipient_id}: {e}")
+            self.logger.error(f"Error creating missing follow-ups: {e}")
     
     async def cancel_future_emails(self, recipient_id: int) -> int:
-        """Cancel all future emails for a recipient (when they reply)"""
-        try:
-            # Cancel in database
-            cancelled_count = await self.sequence_repo.cancel_future_emails(recipient_id)
-            
-            # Update recipient status
-            await self.recipient_repo.update_status(recipient_id, 'replied')
-            
-            self.logger.info(f"Cancelled {cancelled_count} future emails for recipient {recipient_id}")
-            return cancelled_count
-            
-        except Exception as e:
-            self.logger.error(f"Error cancelling future emails for recipient {recipient_id}: {e}")
-            return 0
+        """Cancel all future emails for a recipient (when they reply), raising if the cancel fails"""
+        unsent = await self.sequence_repo.get_unsent_by_recipient(recipient_id)
+        
+        # Cancel and mark the recipient replied in one transaction, then drop the
+        # dispatch jobs; errors reach the caller so a failed write isn't taken for a stop
+        cancelled_count = await self.sequence_repo.cancel_future_emails(recipient_id, 'replied')
+        for sequence in unsent:
+            self._disarm_sequence(sequence.id)
+        
+        self.logger.info(f"Cancelled {cancelled_count} future emails for recipient {recipient_id}")
+        return cancelled_count
+    
+    async def cancel_future_emails_bulk(self, recipient_ids: List[int]) -> int:
+        """Cancel all future emails for many recipients and mark them replied, returning the total cancelled"""
+        # Read the entries before they're deleted so their dispatch jobs can be dropped
+        sequences = await self.sequence_repo.get_by_recipient_ids(recipient_ids)
+        
+        cancelled_count = await self.sequence_repo.cancel_future_emails_bulk(recipient_ids)
+        await self.recipient_repo.update_status_bulk(recipient_ids, 'replied')
+        
+        for recipient_sequences in sequences.values():
+            for sequence in recipient_sequences:
+                if not sequence.sent_at:
+                    self._disarm_sequence(sequence.id)
+        
+        self.logger.info(f"Cancelled {cancelled_count} future emails for {len(recipient_ids)} recipients")
+        return cancelled_count
     
     async def pause_recipient_sequence(self, recipient_id: int) -> bool:
         """Pause email sequence for a recipient"""
@@ -289,6 +444,13 @@ class SequenceScheduler:
         """Resume email sequence for a recipient"""
         try:
             await self.recipient_repo.update_status(recipient_id, 'active')
+            
+            # Dispatch jobs that fired while paused skipped the recipient, so arm them again
+            now = datetime.now()
+            for sequence in await self.sequence_repo.get_unsent_by_recipient(recipient_id):
+                if not sequence.replied:
+                    self._arm_sequence(sequence.id, max(_as_datetime(sequence.scheduled_at), now))
+            
             self.logger.info(f"Resumed email sequence for recipient {recipient_id}")
             return True
             
@@ -298,21 +460,31 @@ class SequenceScheduler:
     
     def _job_executed(self, event):
         """Handle job execution events"""
-        self.logger.debug(f"Job {event.job_id} executed successfully")
+        self.logger.debug("Job %s executed successfully", event.job_id)
     
     def _job_error(self, event):
         """Handle job error events"""
         self.logger.error(f"Job {event.job_id} failed: {event.exception}")
     
+    def _job_missed(self, event):
+        """Handle missed job events"""
+        self.logger.warning(f"Job {event.job_id} missed its run time")
+        
+        # Date jobs past their misfire grace time are dropped without running;
+        # the next sync re-arms the sequence
+        if event.job_id.startswith('seq:'):
+            self._armed_sequences.discard(int(event.job_id[4:]))
+    
     async def _cleanup_old_jobs(self):
-        """Clean up old completed jobs"""
+        """Delete sent emails of finished sequences past the retention period"""
         try:
-            # Remove jobs older than 30 days
-            cutoff_date = datetime.now() - timedelta(days=30)
+            cutoff_date = datetime.now() - self.sequence_retention
             
-            # This would typically involve cleaning up the job store
-            # For now, just log the cleanup attempt
-            self.logger.info("Performed scheduled cleanup of old jobs")
+            # Dispatch jobs are removed when they fire and live in memory, so only the
+            # database needs pruning
+            deleted = await self.sequence_repo.delete_finished_before(cutoff_date)
+            
+            self.logger.info(f"Performed scheduled cleanup, deleted {deleted} old sequence entries")
             
         except Exception as e:
             self.logger.error(f"Error during job cleanup: {e}")
@@ -321,17 +493,21 @@ class SequenceScheduler:
         """Get current scheduler status"""
         try:
             # Get pending sequences
-            due_emails = await self.sequence_repo.get_due_emails()
+            pending_emails = await self.sequence_repo.count_due_emails()
             
             # Get rate limiter status
             rate_status = self.rate_limiter.get_adaptive_status()
             
+            # Next time an email is due to be sent; the dispatch store keeps its jobs
+            # ordered by run time, so this doesn't walk them
+            next_dispatch = self._dispatch_store.get_next_run_time()
+            
             return {
                 'scheduler_running': self.scheduler.running,
-                'pending_emails': len(due_emails),
+                'pending_emails': pending_emails,
                 'rate_limiter': rate_status,
-                'jobs_count': len(self.scheduler.get_jobs()),
-                'next_run_time': self.scheduler.get_job('process_due_emails').next_run_time.isoformat() if self.scheduler.get_job('process_due_emails') else None
+                'jobs_count': len(self._periodic_jobs) + len(self._armed_sequences),
+                'next_run_time': next_dispatch.isoformat() if next_dispatch else None
             }
             
         except Exception as e:
@@ -353,22 +529,20 @@ class SequenceScheduler:
                 self.logger.error(f"Invalid recipient data: {recipient_data}")
                 return False
             
-            # Check if recipient already exists
-            existing = await self.recipient_repo.get_by_email(recipient.email)
-            if existing:
+            # Create the active recipient and their whole sequence in one transaction,
+            # unless they already exist, then arm the initial email
+            recipient.status = 'active'
+            sequences = self._plan_sequence()
+            created = await self.recipient_repo.create_with_sequence(recipient, sequences)
+            if created is None:
                 self.logger.warning(f"Recipient {recipient.email} already exists")
                 return False
             
-            # Create recipient in database
-            recipient_id = await self.recipient_repo.create(recipient)
-            
-            # Schedule initial email
-            success = await self.schedule_initial_email(recipient_id)
+            recipient_id, sequence_ids = created
+            self._arm_sequence(sequence_ids[0], sequences[0].scheduled_at)
             
-            if success:
-                self.logger.info(f"Added recipient {recipient.email} to email sequence")
-            
-            return success
+            self.logger.info(f"Added recipient {recipient.email} to email sequence")
+            return True
             
         except Exception as e:
             self.logger.error(f"Error adding recipient to sequence: {e}")
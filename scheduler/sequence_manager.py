@@ -3,6 +3,7 @@ Email sequence management with advanced timing controls and logic
 Handles complex sequence workflows and timing configurations
 """
 
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
@@ -12,6 +13,13 @@ from config import Config
 from db.models import Recipient, EmailSequence, RecipientRepository, EmailSequenceRepository
 
 
+def _as_timestamp_text(value) -> Optional[str]:
+    """Timestamp as SQLite stores it ('YYYY-MM-DD HH:MM:SS[.ffffff]'), which sorts chronologically as text"""
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat(" ")
+
+
 class SequenceStatus(Enum):
     """Email sequence status enumeration"""
     PENDING = "pending"
@@ -60,6 +68,23 @@ class SequenceManager:
             }
         }
         
+        # Steps every sequence gets, in order; fixed for the life of the manager
+        self._active_steps: Tuple[Tuple[SequenceStep, Dict[str, Any]], ...] = tuple(
+            (step_enum, self.sequence_config[step_enum])
+            for step_enum in SequenceStep
+            if self.sequence_config[step_enum]['required']
+        )
+        
+        # Each step's delay from the start of the sequence
+        self._step_offsets: Dict[int, timedelta] = {
+            step_enum.value: timedelta(
+                days=step_config['delay_days'],
+                hours=step_config['delay_hours'],
+                minutes=step_config['delay_minutes']
+            )
+            for step_enum, step_config in self.sequence_config.items()
+        }
+        
         self.logger.info("Sequence manager initialized with timing controls")
     
     async def create_complete_sequence(self, recipient_id: int) -> bool:
@@ -71,40 +96,13 @@ class SequenceManager:
                 return False
             
             # Check if sequence already exists
-            existing_sequences = await self._get_recipient_sequences(recipient_id)
-            if existing_sequences:
+            if await self.sequence_repo.exists_for_recipient(recipient_id):
                 self.logger.warning(f"Sequence already exists for recipient {recipient_id}")
                 return False
             
-            # Create sequence steps
-            base_time = datetime.now()
-            
-            for step_enum in SequenceStep:
-                step_config = self.sequence_config[step_enum]
-                
-                if not step_config['required']:
-                    continue
-                
-                # Calculate scheduled time
-                scheduled_time = self._calculate_scheduled_time(
-                    base_time, 
-                    step_config,
-                    step_enum.value
-                )
-                
-                # Create sequence entry
-                sequence = EmailSequence(
-                    recipient_id=recipient_id,
-                    step=step_enum.value,
-                    scheduled_at=scheduled_time
-                )
-                
-                await self.sequence_repo.create(sequence)
-                
-                self.logger.debug(f"Created sequence step {step_enum.value} for recipient {recipient_id} at {scheduled_time}")
-            
-            # Update recipient status
-            await self.recipient_repo.update_status(recipient_id, 'active')
+            # Insert the planned steps and activate the recipient in one commit
+            sequences = self._plan_sequence(recipient_id, datetime.now())
+            await self.sequence_repo.create_many_and_activate(sequences)
             
             self.logger.info(f"Created complete email sequence for recipient {recipient_id}")
             return True
@@ -113,59 +111,89 @@ class SequenceManager:
             self.logger.error(f"Failed to create sequence for recipient {recipient_id}: {e}")
             return False
     
-    def _calculate_scheduled_time(self, base_time: datetime, step_config: Dict[str, Any], step: int) -> datetime:
+    async def create_complete_sequences(self, recipient_ids: List[int]) -> Dict[int, bool]:
+        """Create complete email sequences for several recipients, returning whether each was created"""
+        results = {recipient_id: False for recipient_id in recipient_ids}
+        
+        try:
+            # One lookup each for which recipients exist and which are already enrolled
+            existing = {recipient.id for recipient in await self.recipient_repo.get_by_ids(recipient_ids)}
+            enrolled = await self.sequence_repo.get_enrolled_recipient_ids(list(existing))
+            
+            for recipient_id in results:
+                if recipient_id not in existing:
+                    self.logger.error(f"Recipient {recipient_id} not found")
+                elif recipient_id in enrolled:
+                    self.logger.warning(f"Sequence already exists for recipient {recipient_id}")
+            
+            new_ids = [recipient_id for recipient_id in results if recipient_id in existing and recipient_id not in enrolled]
+            if not new_ids:
+                return results
+            
+            # Every new recipient's steps and status change go in one transaction
+            base_time = datetime.now()
+            sequences = []
+            for recipient_id in new_ids:
+                sequences.extend(self._plan_sequence(recipient_id, base_time))
+            
+            await self.sequence_repo.create_many_and_activate(sequences)
+            
+            for recipient_id in new_ids:
+                results[recipient_id] = True
+            
+            self.logger.info(f"Created complete email sequences for {len(new_ids)} recipients")
+            
+        except Exception as e:
+            self.logger.error(f"Failed to create sequences for {len(recipient_ids)} recipients: {e}")
+        
+        return results
+    
+    def _plan_sequence(self, recipient_id: int, base_time: datetime) -> List[EmailSequence]:
+        """Build the required sequence steps for a recipient, timed from base_time"""
+        sequences = []
+        
+        for step_enum, _ in self._active_steps:
+            sequences.append(EmailSequence(
+                recipient_id=recipient_id,
+                step=step_enum.value,
+                scheduled_at=self._calculate_scheduled_time(base_time, step_enum.value)
+            ))
+        
+        return sequences
+    
+    def _calculate_scheduled_time(self, base_time: datetime, step: int) -> datetime:
         """Calculate scheduled time for a sequence step"""
-        if step == 1:
-            # Initial email - schedule immediately with small delay
-            return base_time + timedelta(
-                minutes=step_config['delay_minutes']
-            )
-        else:
-            # Follow-up emails - calculate from base time
-            return base_time + timedelta(
-                days=step_config['delay_days'],
-                hours=step_config['delay_hours'],
-                minutes=step_config['delay_minutes']
-            )
+        return base_time + self._step_offsets[step]
     
     async def _get_recipient_sequences(self, recipient_id: int) -> List[EmailSequence]:
         """Get all sequences for a recipient"""
-        # This would typically be a method in the repository
-        # For now, we'll implement a basic version
         try:
-            # Query database for sequences
-            query = "SELECT * FROM email_sequence WHERE recipient_id = ? ORDER BY step"
-            results = await self.sequence_repo.db_manager.execute_query(query, (recipient_id,))
-            
-            sequences = []
-            for row in results:
-                sequences.append(EmailSequence(
-                    id=row[0],
-                    recipient_id=row[1],
-                    step=row[2],
-                    scheduled_at=row[3],
-                    sent_at=row[4],
-                    message_id=row[5],
-                    replied=bool(row[6]),
-                    created_at=row[7],
-                    updated_at=row[8]
-                ))
-            
-            return sequences
+            return await self.sequence_repo.get_by_recipient(recipient_id)
             
         except Exception as e:
             self.logger.error(f"Error getting sequences for recipient {recipient_id}: {e}")
             return []
     
+    async def _get_sequences_for_recipients(self, recipient_ids: List[int]) -> Dict[int, List[EmailSequence]]:
+        """Get all sequences for several recipients in one query per chunk of IDs, keyed by recipient ID"""
+        try:
+            return await self.sequence_repo.get_by_recipient_ids(recipient_ids)
+            
+        except Exception as e:
+            self.logger.error(f"Error getting sequences for {len(recipient_ids)} recipients: {e}")
+            return {}
+    
     async def get_sequence_status(self, recipient_id: int) -> Dict[str, Any]:
         """Get detailed status of a recipient's email sequence"""
         try:
-            recipient = await self.recipient_repo.get_by_id(recipient_id)
+            # Independent reads, run concurrently on the read connection pool
+            recipient, sequences = await asyncio.gather(
+                self.recipient_repo.get_by_id(recipient_id),
+                self._get_recipient_sequences(recipient_id)
+            )
             if not recipient:
                 return {'error': f'Recipient {recipient_id} not found'}
             
-            sequences = await self._get_recipient_sequences(recipient_id)
-            
             sequence_info = {
                 'recipient_id': recipient_id,
                 'recipient_email': recipient.email,
@@ -174,14 +202,17 @@ class SequenceManager:
                 'steps': []
             }
             
+            # Values read back from SQLite are already text; compare and report them as
+            # such rather than parsing every timestamp
+            now = _as_timestamp_text(datetime.now())
             for sequence in sequences:
                 step_info = {
                     'step': sequence.step,
-                    'scheduled_at': sequence.scheduled_at.isoformat() if sequence.scheduled_at else None,
-                    'sent_at': sequence.sent_at.isoformat() if sequence.sent_at else None,
+                    'scheduled_at': _as_timestamp_text(sequence.scheduled_at),
+                    'sent_at': _as_timestamp_text(sequence.sent_at),
                     'message_id': sequence.message_id,
                     'replied': sequence.replied,
-                    'status': self._get_step_status(sequence)
+                    'status': self._get_step_status(sequence, now)
                 }
                 sequence_info['steps'].append(step_info)
             
@@ -191,13 +222,13 @@ class SequenceManager:
             self.logger.error(f"Error getting sequence status for recipient {recipient_id}: {e}")
             return {'error': str(e)}
     
-    def _get_step_status(self, sequence: EmailSequence) -> str:
-        """Determine the status of a sequence step"""
+    def _get_step_status(self, sequence: EmailSequence, now: Optional[str] = None) -> str:
+        """Determine the status of a sequence step, as of now in timestamp text (taken once per listing by callers)"""
         if sequence.replied:
             return 'replied'
         elif sequence.sent_at:
             return 'sent'
-        elif sequence.scheduled_at and sequence.scheduled_at <= datetime.now():
+        elif sequence.scheduled_at and _as_timestamp_text(sequence.scheduled_at) <= (now or _as_timestamp_text(datetime.now())):
             return 'due'
         else:
             return 'scheduled'
@@ -218,16 +249,10 @@ class SequenceManager:
                 self.logger.error(f"No modifiable sequence found for recipient {recipient_id}, step {step}")
                 return False
             
-            # Update scheduled time
-            query = """
-            UPDATE email_sequence 
-            SET scheduled_at = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """
-            
-            await self.sequence_repo.db_manager.execute_update(
-                query, (new_scheduled_time, target_sequence.id)
-            )
+            # Update scheduled time, unless it was sent in the meantime
+            if not await self.sequence_repo.update_scheduled_at(target_sequence.id, new_scheduled_time):
+                self.logger.error(f"No modifiable sequence found for recipient {recipient_id}, step {step}")
+                return False
             
             self.logger.info(f"Modified sequence timing for recipient {recipient_id}, step {step} to {new_scheduled_time}")
             return True
@@ -282,57 +307,33 @@ class SequenceManager:
     async def get_sequence_analytics(self) -> Dict[str, Any]:
         """Get analytics for all email sequences"""
         try:
-            # Get all recipients
-            all_recipients = await self.recipient_repo.get_all_by_status('active')
-            all_recipients.extend(await self.recipient_repo.get_all_by_status('replied'))
-            all_recipients.extend(await self.recipient_repo.get_all_by_status('stopped'))
+            # Recipients that have started a sequence; counts and step totals come from
+            # grouped queries rather than loading every recipient and their sequences
+            tracked_statuses = ['active', 'replied', 'stopped']
+            status_breakdown = await self.recipient_repo.count_by_statuses(tracked_statuses + ['pending'])
+            step_counts = await self.sequence_repo.get_step_counts(tracked_statuses)
+            
+            total_recipients = sum(status_breakdown[status] for status in tracked_statuses)
             
             analytics = {
-                'total_recipients': len(all_recipients),
-                'status_breakdown': {
-                    'active': 0,
-                    'replied': 0,
-                    'stopped': 0,
-                    'pending': 0
-                },
+                'total_recipients': total_recipients,
+                'status_breakdown': status_breakdown,
                 'step_analytics': {
-                    1: {'sent': 0, 'pending': 0, 'replied': 0},
-                    2: {'sent': 0, 'pending': 0, 'replied': 0},
-                    3: {'sent': 0, 'pending': 0, 'replied': 0}
+                    step: {'sent': 0, 'pending': 0, 'replied': 0} for step in (1, 2, 3)
                 },
                 'reply_rate': 0.0,
                 'completion_rate': 0.0
             }
-            
-            # Count by status
-            for recipient in all_recipients:
-                analytics['status_breakdown'][recipient.status] += 1
-            
-            # Get sequence statistics
-            total_sent = 0
-            total_replied = 0
-            
-            for recipient in all_recipients:
-                sequences = await self._get_recipient_sequences(recipient.id)
-                
-                for sequence in sequences:
-                    step = sequence.step
-                    if sequence.sent_at:
-                        analytics['step_analytics'][step]['sent'] += 1
-                        total_sent += 1
-                    elif sequence.replied:
-                        analytics['step_analytics'][step]['replied'] += 1
-                        total_replied += 1
-                    else:
-                        analytics['step_analytics'][step]['pending'] += 1
+            analytics['step_analytics'].update(step_counts)
             
             # Calculate rates
+            total_sent = sum(counts['sent'] for counts in step_counts.values())
             if total_sent > 0:
-                analytics['reply_rate'] = (analytics['status_breakdown']['replied'] / total_sent) * 100
+                analytics['reply_rate'] = (status_breakdown['replied'] / total_sent) * 100
             
-            if len(all_recipients) > 0:
-                completed = analytics['status_breakdown']['replied'] + analytics['status_breakdown']['stopped']
-                analytics['completion_rate'] = (completed / len(all_recipients)) * 100
+            if total_recipients > 0:
+                completed = status_breakdown['replied'] + status_breakdown['stopped']
+                analytics['completion_rate'] = (completed / total_recipients) * 100
             
             return analytics
             
@@ -356,7 +357,7 @@ class SequenceManager:
             
             for sequence in sequences:
                 optimization_suggestions['current_timing'][sequence.step] = {
-                    'scheduled_at': sequence.scheduled_at.isoformat() if sequence.scheduled_at else None
+                    'scheduled_at': _as_timestamp_text(sequence.scheduled_at)
                 }
             
             return optimization_suggestions
@@ -380,5 +381,5 @@ class SequenceManager:
         return {
             'sequence_steps': config_dict,
             'follow_up_2_enabled': self.config.follow_up_2_enabled,
-            'total_possible_steps': len([s for s in self.sequence_config.values() if s['required']])
+            'total_possible_steps': len(self._active_steps)
         }
\ No newline at end of file
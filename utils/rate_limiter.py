@@ -3,21 +3,288 @@ Rate limiting implementation for Microsoft 365 email sending
 Ensures compliance with sending limits and prevents bulk blasting
 """
 
+import array
+import atexit
+import bisect
 import logging
 import asyncio
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from collections import deque
+from typing import Dict, Any, Optional, Tuple
 import json
 import os
 
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
 from config import Config
 
 
+class TokenBucket:
+    """Per-minute limit as a token bucket on the monotonic clock
+    
+    Holds up to `limit` tokens and refills continuously at `limit` per `window_seconds`.
+    """
+    
+    __slots__ = ('capacity', 'refill_rate', 'tokens', 'last_refill')
+    
+    def __init__(self, limit: int, window_seconds: float = 60.0):
+        self.capacity = float(limit)
+        self.refill_rate = limit / window_seconds  # tokens per second
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+    
+    def _refill(self, now: float):
+        """Add the tokens accrued since the last refill, up to capacity"""
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.last_refill = now
+    
+    def used(self, now: float) -> float:
+        """Sends currently counted against the limit"""
+        self._refill(now)
+        return self.capacity - self.tokens
+    
+    def consume(self, now: float, count: int = 1):
+        """Record sends"""
+        self._refill(now)
+        self.tokens -= count
+    
+    def seconds_until_available(self, now: float) -> float:
+        """Seconds until one more send fits under the limit"""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.refill_rate)
+    
+    def restore(self, used: float):
+        """Start from a previously saved usage level"""
+        self.tokens = min(self.capacity, self.capacity - used)
+        self.last_refill = time.monotonic()
+
+
+class EncodedSlidingWindow:
+    """Per-minute limit as a sliding window approximated from two fixed windows
+    
+    The previous and current window counts are packed into one integer,
+    (previous << 32) | current, and usage is the previous count weighted by how much
+    of it still overlaps the sliding window, plus the current count.
+    """
+    
+    _COUNT_MASK = 0xFFFFFFFF
+    
+    __slots__ = ('limit', 'window_seconds', 'state', 'window_index')
+    
+    def __init__(self, limit: int, window_seconds: float = 60.0):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.state = 0
+        self.window_index = int(time.monotonic() // window_seconds)
+    
+    def _roll(self, now: float) -> float:
+        """Advance to the window containing now and return the time elapsed within it"""
+        index = int(now // self.window_seconds)
+        if index != self.window_index:
+            # The current count becomes the previous one only if the windows are adjacent
+            current = self.state & self._COUNT_MASK
+            self.state = (current << 32) if index == self.window_index + 1 else 0
+            self.window_index = index
+        return now - index * self.window_seconds
+    
+    def used(self, now: float) -> float:
+        """Sends currently counted against the limit"""
+        elapsed = self._roll(now)
+        previous = self.state >> 32
+        current = self.state & self._COUNT_MASK
+        return previous * (1 - elapsed / self.window_seconds) + current
+    
+    def consume(self, now: float, count: int = 1):
+        """Record sends"""
+        self._roll(now)
+        self.state += count
+    
+    def seconds_until_available(self, now: float) -> float:
+        """Seconds until one more send fits under the limit"""
+        elapsed = self._roll(now)
+        previous = self.state >> 32
+        current = self.state & self._COUNT_MASK
+        allowed = self.limit - 1  # usage must drop to this for one more send
+        
+        if current <= allowed:
+            if previous * (1 - elapsed / self.window_seconds) + current <= allowed:
+                return 0.0
+            # Wait for the previous window's weight to decay far enough
+            target = self.window_seconds * (1 - (allowed - current) / previous)
+            return max(0.0, target - elapsed)
+        
+        # The current window alone is over the limit: wait for it to become the previous one and decay
+        remaining = self.window_seconds - elapsed
+        return remaining + self.window_seconds * max(0.0, 1 - allowed / current)
+    
+    def restore(self, used: float):
+        """Start from a previously saved usage level, counted in the current window"""
+        self.window_index = int(time.monotonic() // self.window_seconds)
+        self.state = max(0, round(used))
+
+
+class FixedWindowCounter:
+    """Per-minute limit as a fixed-window counter
+    
+    Counts sends in the current clock-aligned window only, so a burst straddling a
+    window boundary can reach twice the limit within one window's length.
+    """
+    
+    __slots__ = ('limit', 'window_seconds', 'window_index', 'count')
+    
+    def __init__(self, limit: int, window_seconds: float = 60.0):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.window_index = int(time.monotonic() // window_seconds)
+        self.count = 0
+    
+    def _roll(self, now: float):
+        """Start a new count when now is in a later window"""
+        index = int(now // self.window_seconds)
+        if index != self.window_index:
+            self.window_index = index
+            self.count = 0
+    
+    def used(self, now: float) -> float:
+        """Sends currently counted against the limit"""
+        self._roll(now)
+        return float(self.count)
+    
+    def consume(self, now: float, count: int = 1):
+        """Record sends"""
+        self._roll(now)
+        self.count += count
+    
+    def seconds_until_available(self, now: float) -> float:
+        """Seconds until one more send fits under the limit"""
+        self._roll(now)
+        if self.count < self.limit:
+            return 0.0
+        return (self.window_index + 1) * self.window_seconds - now
+    
+    def restore(self, used: float):
+        """Start from a previously saved usage level, counted in the current window"""
+        self.window_index = int(time.monotonic() // self.window_seconds)
+        self.count = max(0, round(used))
+
+
+class TimestampRingWindow:
+    """Per-minute limit as an exact sliding window over send times
+    
+    Send times are kept as integer monotonic nanoseconds in a compact array('q'),
+    oldest first; times older than the window are dropped with a binary search.
+    """
+    
+    __slots__ = ('limit', 'window_ns', 'ring')
+    
+    def __init__(self, limit: int, window_seconds: float = 60.0):
+        self.limit = limit
+        self.window_ns = int(window_seconds * 1_000_000_000)
+        self.ring = array.array('q')
+    
+    def _expire(self, now: float) -> int:
+        """Drop send times that have left the window and return the current time in nanoseconds"""
+        now_ns = int(now * 1_000_000_000)
+        expired = bisect.bisect_right(self.ring, now_ns - self.window_ns)
+        if expired:
+            del self.ring[:expired]
+        return now_ns
+    
+    def used(self, now: float) -> float:
+        """Sends currently counted against the limit"""
+        self._expire(now)
+        return float(len(self.ring))
+    
+    def consume(self, now: float, count: int = 1):
+        """Record sends"""
+        now_ns = self._expire(now)
+        self.ring.extend([now_ns] * count)
+    
+    def seconds_until_available(self, now: float) -> float:
+        """Seconds until one more send fits under the limit"""
+        now_ns = self._expire(now)
+        excess = len(self.ring) - self.limit
+        if excess < 0:
+            return 0.0
+        # One more send fits once the (excess + 1) oldest sends have left the window
+        return max(0.0, (self.ring[excess] + self.window_ns - now_ns) / 1_000_000_000)
+    
+    def restore(self, used: float):
+        """Start from a previously saved usage level, counted as sent now"""
+        now_ns = int(time.monotonic() * 1_000_000_000)
+        self.ring = array.array('q', [now_ns] * max(0, round(used)))
+
+
+class SharedSendCounter:
+    """Minute and daily send counts kept in Redis, shared by every scheduler sending as one mailbox
+    
+    Uses fixed windows: one counter per clock minute and one per day, each expiring on its own.
+    """
+    
+    # Counts one send only if neither counter has reached its limit; runs atomically on the
+    # keys it's given, so the check and the count can't land in different minutes
+    RESERVE_SCRIPT = """
+    local minute = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local day = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if minute >= tonumber(ARGV[1]) or day >= tonumber(ARGV[2]) then
+        return {0, minute, day}
+    end
+    minute = redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], 120)
+    day = redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], 172800)
+    return {1, minute, day}
+    """
+    
+    def __init__(self, redis_url: str, key_prefix: str):
+        self.redis = redis_asyncio.from_url(redis_url)
+        self.key_prefix = key_prefix
+        self._reserve_script = self.redis.register_script(self.RESERVE_SCRIPT)
+    
+    def _keys(self) -> Tuple[str, str]:
+        """Keys of the current minute's and day's counters"""
+        now = time.time()
+        return (
+            f"{self.key_prefix}:minute:{int(now // 60)}",
+            f"{self.key_prefix}:day:{datetime.now().strftime('%Y-%m-%d')}"
+        )
+    
+    async def counts(self) -> Tuple[int, int]:
+        """Sends so far in the current minute and day, across all instances"""
+        minute, day = await self.redis.mget(self._keys())
+        return int(minute or 0), int(day or 0)
+    
+    async def record(self, count: int = 1):
+        """Add sends to the current minute's and day's counters in one round trip"""
+        minute_key, day_key = self._keys()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.incrby(minute_key, count).expire(minute_key, 120)
+            pipe.incrby(day_key, count).expire(day_key, 2 * 86400)
+            await pipe.execute()
+    
+    async def reserve(self, max_per_minute: int, max_per_day: int) -> Tuple[bool, int, int]:
+        """Count one send unless a limit is reached, returning whether it was counted and the counts"""
+        reserved, minute, day = await self._reserve_script(keys=list(self._keys()), args=[max_per_minute, max_per_day])
+        return bool(reserved), int(minute), int(day)
+
+
 class RateLimiter:
     """Rate limiter for email sending to comply with Microsoft 365 limits"""
     
-    def __init__(self, config: Config):
+    # Per-minute limit implementations selectable through the mode argument
+    MINUTE_WINDOWS = {
+        'token_bucket': TokenBucket,
+        'encoded_sliding': EncodedSlidingWindow,
+        'fixed_window': FixedWindowCounter,
+        'exact_sliding': TimestampRingWindow
+    }
+    
+    def __init__(self, config: Config, mode: str = 'token_bucket'):
         self.config = config
         self.logger = logging.getLogger(__name__)
         
@@ -25,29 +292,75 @@ class RateLimiter:
         self.max_per_minute = config.rate_limit_per_minute
         self.max_per_day = config.rate_limit_per_day
         
-        # Tracking data structures
-        self.minute_window = deque()  # Timestamps of emails sent in current minute
+        # Per-minute tracking
+        if mode not in self.MINUTE_WINDOWS:
+            raise ValueError(f"Unsupported rate limiter mode: {mode}")
+        self.mode = mode
+        self.minute_window = self.MINUTE_WINDOWS[mode](self.max_per_minute)
+        self._minute_threshold = self.max_per_minute - 1  # usage above this leaves no room for a send
+        
+        # Daily tracking
         self.daily_count = 0
         self.daily_reset_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
         
-        # Persistence file for rate limiting data
+        # Counts shared with other instances through Redis, when configured; the local
+        # counters still back status reporting and persistence
+        self.shared_counter: Optional[SharedSendCounter] = None
+        if config.rate_limit_redis_url:
+            if redis_asyncio is None:
+                self.logger.warning("RATE_LIMIT_REDIS_URL is set but redis is not installed, counting sends per process")
+            else:
+                self.shared_counter = SharedSendCounter(config.rate_limit_redis_url, f"email_automation:rate:{config.sender_email}")
+        
+        # Persistence file for rate limiting data; sends only mark the state dirty and a
+        # background task writes it every flush_interval seconds
         self.persistence_file = "rate_limiter_state.json"
+        self.flush_interval = 5.0
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._pending_write: Optional[asyncio.Future] = None
         
         # Load persisted state
         self._load_state()
         
-        self.logger.info(f"Rate limiter initialized: {self.max_per_minute}/min, {self.max_per_day}/day")
+        # Last-resort flush when the process exits without close(), which unregisters it so
+        # closed limiters aren't kept alive until exit
+        atexit.register(self._flush_if_dirty)
+        
+        self.logger.info(f"Rate limiter initialized ({mode}): {self.max_per_minute}/min, {self.max_per_day}/day")
+    
+    @property
+    def daily_reset_time(self) -> datetime:
+        """When the daily counter next resets"""
+        return self._daily_reset_time
+    
+    @daily_reset_time.setter
+    def daily_reset_time(self, value: datetime):
+        # Keep a POSIX timestamp alongside so the hot path can compare against time.time()
+        self._daily_reset_time = value
+        self._daily_reset_ts = value.timestamp()
+    
+    @property
+    def minute_count(self) -> int:
+        """Approximate number of sends counted against the current minute"""
+        return max(0, round(self.minute_window.used(time.monotonic())))
+    
+    def _minute_limit_reached(self) -> bool:
+        """Check whether one more send would exceed the per-minute limit"""
+        return self.minute_window.used(time.monotonic()) > self._minute_threshold
     
     async def can_send_email(self) -> bool:
         """Check if an email can be sent without exceeding rate limits"""
-        current_time = datetime.now()
+        # Check daily reset (a float comparison until the reset time actually passes)
+        if time.time() >= self._daily_reset_ts:
+            self._cleanup_old_entries(datetime.now())
         
-        # Clean up old entries and check daily reset
-        self._cleanup_old_entries(current_time)
+        if self.shared_counter is not None:
+            return await self._can_send_shared()
         
         # Check minute limit
-        if len(self.minute_window) >= self.max_per_minute:
-            self.logger.warning(f"Minute rate limit reached: {len(self.minute_window)}/{self.max_per_minute}")
+        if self.minute_window.used(time.monotonic()) > self._minute_threshold:
+            self.logger.warning(f"Minute rate limit reached: {self.minute_count}/{self.max_per_minute}")
             return False
         
         # Check daily limit
@@ -57,29 +370,96 @@ class RateLimiter:
         
         return True
     
+    async def _can_send_shared(self) -> bool:
+        """Check the limits against the counts shared by all instances"""
+        minute_count, daily_count = await self.shared_counter.counts()
+        
+        if minute_count >= self.max_per_minute:
+            self.logger.warning(f"Shared minute rate limit reached: {minute_count}/{self.max_per_minute}")
+            return False
+        
+        if daily_count >= self.max_per_day:
+            self.logger.warning(f"Shared daily rate limit reached: {daily_count}/{self.max_per_day}")
+            return False
+        
+        return True
+    
+    async def can_send_email_bulk(self, count: int) -> int:
+        """Return how many of the next `count` emails could be sent without exceeding rate limits"""
+        if time.time() >= self._daily_reset_ts:
+            self._cleanup_old_entries(datetime.now())
+        
+        if self.shared_counter is not None:
+            minute_count, daily_count = await self.shared_counter.counts()
+            return max(0, min(count, self.max_per_minute - minute_count, self.max_per_day - daily_count))
+        
+        minute_room = int(self.max_per_minute - self.minute_window.used(time.monotonic()))
+        daily_room = self.max_per_day - self.daily_count
+        
+        return max(0, min(count, minute_room, daily_room))
+    
+    async def reserve_send(self) -> bool:
+        """Check the limits and count one send against them in a single step
+        
+        Concurrent senders can't all pass the check before any of them records, as they
+        could with can_send_email() followed by record_email_sent().
+        """
+        if time.time() >= self._daily_reset_ts:
+            self._cleanup_old_entries(datetime.now())
+        
+        if self.shared_counter is not None:
+            # Checked and counted in one Redis script, so instances racing for the last slot can't both get it
+            reserved, minute_count, daily_count = await self.shared_counter.reserve(self.max_per_minute, self.max_per_day)
+            if not reserved:
+                self.logger.warning(f"Shared rate limit reached: {minute_count}/{self.max_per_minute} this minute, "
+                                    f"{daily_count}/{self.max_per_day} today")
+                return False
+        
+        # No await between the check and the count below
+        elif self._minute_limit_reached():
+            self.logger.warning(f"Minute rate limit reached: {self.minute_count}/{self.max_per_minute}")
+            return False
+        
+        elif self.daily_count >= self.max_per_day:
+            self.logger.warning(f"Daily rate limit reached: {self.daily_count}/{self.max_per_day}")
+            return False
+        
+        self.minute_window.consume(time.monotonic())
+        self.daily_count += 1
+        self._mark_dirty()
+        return True
+    
     async def record_email_sent(self):
         """Record that an email was sent"""
-        current_time = datetime.now()
-        
-        # Add to minute window
-        self.minute_window.append(current_time)
+        # Count against the minute window
+        self.minute_window.consume(time.monotonic())
         
         # Increment daily count
         self.daily_count += 1
         
-        # Persist state
-        self._save_state()
+        if self.shared_counter is not None:
+            await self.shared_counter.record()
+        
+        self._mark_dirty()
         
-        self.logger.debug(f"Email recorded: {len(self.minute_window)} in current minute, {self.daily_count} today")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Email recorded: %d in current minute, %d today", self.minute_count, self.daily_count)
     
-    def _cleanup_old_entries(self, current_time: datetime):
-        """Remove old entries from tracking windows"""
-        # Clean minute window (remove entries older than 1 minute)
-        minute_ago = current_time - timedelta(minutes=1)
-        while self.minute_window and self.minute_window[0] < minute_ago:
-            self.minute_window.popleft()
+    async def record_email_sent_bulk(self, count: int):
+        """Record that several emails were sent"""
+        self.minute_window.consume(time.monotonic(), count)
+        self.daily_count += count
+        
+        if self.shared_counter is not None:
+            await self.shared_counter.record(count)
         
-        # Reset daily count if it's a new day
+        self._mark_dirty()
+        
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("%d emails recorded: %d in current minute, %d today", count, self.minute_count, self.daily_count)
+    
+    def _cleanup_old_entries(self, current_time: datetime):
+        """Reset the daily counter if it's a new day"""
         if current_time >= self.daily_reset_time:
             self.daily_count = 0
             self.daily_reset_time = current_time.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
@@ -94,20 +474,20 @@ class RateLimiter:
         next_minute_slot = None
         next_day_slot = None
         
-        if len(self.minute_window) >= self.max_per_minute:
-            # Next slot available when oldest entry in minute window expires
-            oldest_entry = self.minute_window[0]
-            next_minute_slot = oldest_entry + timedelta(minutes=1)
+        minute_limit_reached = self._minute_limit_reached()
+        if minute_limit_reached:
+            wait_seconds = self.minute_window.seconds_until_available(time.monotonic())
+            next_minute_slot = current_time + timedelta(seconds=wait_seconds)
         
         if self.daily_count >= self.max_per_day:
             next_day_slot = self.daily_reset_time
         
         return {
-            'current_minute_count': len(self.minute_window),
+            'current_minute_count': self.minute_count,
             'max_per_minute': self.max_per_minute,
             'current_daily_count': self.daily_count,
             'max_per_day': self.max_per_day,
-            'can_send_now': len(self.minute_window) < self.max_per_minute and self.daily_count < self.max_per_day,
+            'can_send_now': not minute_limit_reached and self.daily_count < self.max_per_day,
             'next_minute_slot': next_minute_slot.isoformat() if next_minute_slot else None,
             'next_day_slot': next_day_slot.isoformat() if next_day_slot else None,
             'daily_reset_time': self.daily_reset_time.isoformat()
@@ -115,49 +495,96 @@ class RateLimiter:
     
     async def wait_for_rate_limit(self) -> float:
         """Wait until rate limit allows sending, return wait time in seconds"""
-        wait_time = 0
+        wait_time = 0.0
         
+        # Sleeps exactly until the next send fits; the loop only re-checks in case
+        # something else used the room in the meantime
         while not await self.can_send_email():
-            current_time = datetime.now()
-            
-            # Calculate wait time
-            if len(self.minute_window) >= self.max_per_minute:
-                # Wait until oldest entry in minute window expires
-                oldest_entry = self.minute_window[0]
-                wait_until = oldest_entry + timedelta(minutes=1)
-                wait_seconds = (wait_until - current_time).total_seconds()
-                
-                if wait_seconds > 0:
-                    self.logger.info(f"Rate limit reached, waiting {wait_seconds:.1f} seconds")
-                    await asyncio.sleep(min(wait_seconds, 60))  # Cap at 60 seconds
-                    wait_time += wait_seconds
+            if self.daily_count >= self.max_per_day:
+                # Don't wait for the daily reset, let the scheduler retry after it
+                self.logger.info(f"Daily limit reached, waiting until {self.daily_reset_time}")
+                return max(0.0, self._daily_reset_ts - time.time())
             
-            elif self.daily_count >= self.max_per_day:
-                # Wait until daily reset
-                wait_until = self.daily_reset_time
-                wait_seconds = (wait_until - current_time).total_seconds()
-                
-                if wait_seconds > 0:
-                    self.logger.info(f"Daily limit reached, waiting until {wait_until}")
-                    # For daily waits, we might want to return immediately and let the scheduler handle it
-                    return wait_seconds
+            if self.shared_counter is not None:
+                # Shared counts use clock-minute windows
+                wait_seconds = 60 - time.time() % 60
+            else:
+                wait_seconds = self.minute_window.seconds_until_available(time.monotonic())
             
-            # Refresh state
-            self._cleanup_old_entries(datetime.now())
+            self.logger.info(f"Rate limit reached, waiting {wait_seconds:.1f} seconds")
+            await asyncio.sleep(wait_seconds)
+            wait_time += wait_seconds
         
         return wait_time
     
+    def _mark_dirty(self):
+        """Note unsaved changes, starting the background flush on first use"""
+        self._dirty = True
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """Write the state every flush_interval seconds while it has unsaved changes"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self._dirty:
+                continue
+            
+            # Snapshot on the loop, write on a worker thread so the disk I/O doesn't
+            # stall sends; sends recorded during the write mark the state dirty again
+            state = self._state_snapshot()
+            self._dirty = False
+            self._pending_write = asyncio.ensure_future(asyncio.to_thread(self._write_state, state))
+            try:
+                await asyncio.shield(self._pending_write)
+            except Exception as e:
+                self._dirty = True
+                self.logger.error(f"Failed to save rate limiter state: {e}")
+    
+    def _flush_if_dirty(self):
+        """Write the state if it changed since the last write"""
+        if self._dirty:
+            self._save_state()
+    
+    async def close(self):
+        """Stop the background flush and write any unsaved state"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        
+        # Let a background write finish first so it can't replace the final state
+        if self._pending_write is not None:
+            await asyncio.gather(self._pending_write, return_exceptions=True)
+            self._pending_write = None
+        
+        self._flush_if_dirty()
+        atexit.unregister(self._flush_if_dirty)
+    
+    def _state_snapshot(self) -> Dict[str, Any]:
+        """Current state to persist, with times as POSIX timestamps"""
+        return {
+            'daily_count': self.daily_count,
+            'daily_reset_ts': self._daily_reset_ts,
+            'minute_used': self.minute_window.used(time.monotonic()),
+            'saved_ts': time.time()
+        }
+    
+    def _write_state(self, state: Dict[str, Any]):
+        """Write state to a temporary file and swap it in, so a crash mid-write never leaves a truncated file"""
+        tmp_file = f"{self.persistence_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(state))
+        os.replace(tmp_file, self.persistence_file)
+    
     def _save_state(self):
         """Persist rate limiter state to file"""
         try:
-            state = {
-                'daily_count': self.daily_count,
-                'daily_reset_time': self.daily_reset_time.isoformat(),
-                'minute_window': [dt.isoformat() for dt in self.minute_window]
-            }
-            
-            with open(self.persistence_file, 'w') as f:
-                json.dump(state, f)
+            self._write_state(self._state_snapshot())
+            self._dirty = False
                 
         except Exception as e:
             self.logger.error(f"Failed to save rate limiter state: {e}")
@@ -171,16 +598,25 @@ class RateLimiter:
                 
                 # Load daily count and reset time
                 self.daily_count = state.get('daily_count', 0)
-                reset_time_str = state.get('daily_reset_time')
-                if reset_time_str:
-                    self.daily_reset_time = datetime.fromisoformat(reset_time_str)
+                if 'daily_reset_ts' in state:
+                    self.daily_reset_time = datetime.fromtimestamp(state['daily_reset_ts'])
+                elif state.get('daily_reset_time'):
+                    self.daily_reset_time = datetime.fromisoformat(state['daily_reset_time'])
                 
-                # Load minute window
-                minute_window_data = state.get('minute_window', [])
-                self.minute_window = deque([
-                    datetime.fromisoformat(dt_str) 
-                    for dt_str in minute_window_data
-                ])
+                # Load minute usage, crediting the time elapsed while not running
+                now = datetime.now()
+                if 'minute_used' in state:
+                    if 'saved_ts' in state:
+                        saved_at = datetime.fromtimestamp(state['saved_ts'])
+                    else:
+                        saved_at = datetime.fromisoformat(state['saved_at'])
+                    idle_seconds = max(0.0, (now - saved_at).total_seconds())
+                    minute_used = max(0.0, state['minute_used'] - idle_seconds * self.max_per_minute / 60)
+                else:
+                    # Older state files list the send timestamps of the last minute
+                    minute_ago = now - timedelta(minutes=1)
+                    minute_used = sum(1 for dt_str in state.get('minute_window', []) if datetime.fromisoformat(dt_str) >= minute_ago)
+                self.minute_window.restore(minute_used)
                 
                 # Clean up old data
                 self._cleanup_old_entries(datetime.now())
@@ -191,11 +627,11 @@ class RateLimiter:
             self.logger.error(f"Failed to load rate limiter state: {e}")
             # Reset to clean state
             self.daily_count = 0
-            self.minute_window = deque()
+            self.minute_window.restore(0)
     
     def reset_limits(self):
         """Reset all rate limiting counters (for testing/admin purposes)"""
-        self.minute_window.clear()
+        self.minute_window.restore(0)
         self.daily_count = 0
         self.daily_reset_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
         self._save_state()
@@ -205,8 +641,8 @@ class RateLimiter:
 class AdaptiveRateLimiter(RateLimiter):
     """Advanced rate limiter with adaptive behavior based on API responses"""
     
-    def __init__(self, config: Config):
-        super().__init__(config)
+    def __init__(self, config: Config, mode: str = 'token_bucket'):
+        super().__init__(config, mode)
         
         # Adaptive behavior settings
         self.consecutive_successes = 0
@@ -219,9 +655,10 @@ class AdaptiveRateLimiter(RateLimiter):
         self.backoff_multiplier = 2.0
         self.backoff_max_retries = 3
     
-    async def record_send_result(self, success: bool, error_code: str = None):
-        """Record the result of an email send attempt"""
-        await self.record_email_sent()
+    async def record_send_result(self, success: bool, error_code: str = None, reserved: bool = False):
+        """Record the result of an email send attempt (already counted if it was reserved with reserve_send)"""
+        if not reserved:
+            await self.record_email_sent()
         
         if success:
             self.consecutive_successes += 1
@@ -250,7 +687,7 @@ class AdaptiveRateLimiter(RateLimiter):
     async def wait_before_send(self):
         """Wait appropriate time before sending next email"""
         if self.current_delay > self.min_delay:
-            self.logger.debug(f"Adaptive delay: waiting {self.current_delay}s before next send")
+            self.logger.debug("Adaptive delay: waiting %ss before next send", self.current_delay)
             await asyncio.sleep(self.current_delay)
     
     async def exponential_backoff_retry(self, send_function, max_retries: int = None):